@@ -1,5 +1,6 @@
 import os, io, tempfile, base64, json, re
 from app.models import AnalyzeResponse, Fields, Series, Verifications, ProofSnip, ValueWithMeta
+from app.parser.document import DocumentContext
 from app.parser.preflight import ocr_if_needed, normalize_orientation
 from app.parser.tables import find_roi_and_tables
 from app.parser.mapping import label_columns, clean_number
@@ -27,16 +28,16 @@ def b64_file(path: str) -> str:
         return base64.b64encode(f.read()).decode("ascii")
 
 def analyze_pdf(pdf_path: str):
+    ctx = DocumentContext.open(pdf_path)
     try:
-        prepped = ocr_if_needed(pdf_path)
-        prepped = normalize_orientation(prepped)
+        ctx = ocr_if_needed(ctx)
+        ctx = normalize_orientation(ctx)
+        prepped = ctx.path
 
         # Extract text for fields
-        doc = fitz.open(prepped)
         text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
+        for i in range(len(ctx)):
+            text += ctx.text(i)
 
         # Use tabula for table extraction
         import tabula
@@ -225,11 +226,11 @@ def analyze_pdf(pdf_path: str):
             pass
 
         # Proof snips
-        snip_coords = find_snip_coords(df, t_page)
+        snip_coords = find_snip_coords(ctx, df, t_page)
         proof_snips = []
         for s in snip_coords:
             rect = fitz.Rect(s["box"])
-            b64_img = crop_to_b64(prepped, s["page"], rect)
+            b64_img = crop_to_b64(ctx, s["page"], rect)
             proof_snips.append(ProofSnip(label=s["label"], page=s["page"], image_b64=b64_img))
 
         # Extract fields from text
@@ -272,7 +273,7 @@ def analyze_pdf(pdf_path: str):
         return result
 
     finally:
-        pass
+        ctx.close()
 
 if __name__ == "__main__":
     pdf_path = "/home/tech9/Downloads/testing pdf/Sandra-Ariyama-Inforce-Illustration.pdf"
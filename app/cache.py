@@ -0,0 +1,182 @@
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from app.serialization import dumps, loads
+
+# Bump whenever parser or response changes would make cached results stale
+PIPELINE_VERSION = "3"
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")  # memory | disk | none
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "/tmp/extractor-cache")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+
+# Settings that change the pipeline output and therefore belong in the key
+CACHE_CONFIG_KEYS = [
+    "CONFIDENCE_THRESHOLD", "DECISION_MODEL", "DECISION_LLM", "REDACT_LEDGER_ONLY",
+    # Table discovery and ledger stitching
+    "TABLE_EXTRACTORS", "FAST_TIER_MIN_SCORE", "TABLE_EARLY_EXIT_SCORE", "TABLE_MIN_ROWS", "HEADER_SCAN_ROWS",
+    "STITCH_MAX_PAGES", "STITCH_MIN_SHARED_COLUMNS", "STITCH_MIN_SHAPE", "MATURITY_AGE",
+    # Proof snips
+    "SNIP_FORMAT", "SNIP_DPI", "SNIP_QUALITY", "SNIP_PADDING", "SNIP_LOAN_SEARCH_PAGES",
+    # Redaction
+    "SPACY_MODEL", "PII_SLIM_NLP", "SPACY_DISABLE", "OCR_OPTIMIZE",
+]
+
+
+def config_fingerprint() -> str:
+    cfg = {k: os.getenv(k) for k in CACHE_CONFIG_KEYS}
+    cfg["pipeline_version"] = PIPELINE_VERSION
+    return hashlib.sha256(json.dumps(cfg, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def digest_key(digest: str) -> str:
+    # Result cache key for an upload's sha256 (Upload.digest, computed while it was spooled)
+    return f"{digest}-{config_fingerprint()}"
+
+
+class ResultCache:
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class NullCache(ResultCache):
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+
+class MemoryCache(ResultCache):
+    """In-process LRU bounded by entry count, total bytes and TTL."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl: float = RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, size, value = item
+            if expires < time.time():
+                self._pop(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            self._items[key] = (time.time() + self.ttl, size, value)
+            self._bytes += size
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                self._pop(next(iter(self._items)))
+
+    def _pop(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+
+class DiskCache(ResultCache):
+    """JSON files under a directory; TTL by mtime, size eviction by oldest access."""
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL_SECONDS):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if st.st_mtime + self.ttl < time.time():
+                os.unlink(path)
+                return None
+            with open(path, "rb") as f:
+                value = loads(f.read())
+            # Record the access for LRU eviction without resetting the TTL clock
+            os.utime(path, (time.time(), st.st_mtime))
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(dumps(value))
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            evict_files(self.directory, ".json", self.max_bytes, self.ttl, self.max_entries)
+
+
+def evict_files(directory: str, suffix: str, max_bytes: int, ttl: float, max_entries: int = 0):
+    # Drops files past their TTL (by mtime), then the least recently accessed until the
+    # directory is under max_bytes and max_entries (0 = no entry limit)
+    now = time.time()
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if st.st_mtime + ttl < now:
+            _unlink(path)
+            continue
+        entries.append((st.st_atime, st.st_size, path))
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    while entries and ((max_entries and len(entries) > max_entries) or total > max_bytes):
+        _, size, path = entries.pop(0)
+        total -= size
+        _unlink(path)
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+_result_cache = None
+
+def get_result_cache() -> ResultCache:
+    global _result_cache
+    if _result_cache is None:
+        if RESULT_CACHE_BACKEND == "disk":
+            _result_cache = DiskCache()
+        elif RESULT_CACHE_BACKEND == "memory":
+            _result_cache = MemoryCache()
+        else:
+            _result_cache = NullCache()
+    return _result_cache
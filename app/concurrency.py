@@ -0,0 +1,90 @@
+import os, asyncio, functools, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from app.metrics import call_profiled
+
+# Threads for CPU-bound stages (OCR, Camelot, Presidio, rendering)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+# Threads for blocking network clients (boto3)
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# Requests allowed in flight (running + waiting) before we shed load
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "8"))
+# Share of those slots background work (bulk job items) may hold. It only starts while
+# the gate is below that share, so requests keep the rest and jobs yield under load.
+BACKGROUND_ADMISSION_SHARE = float(os.getenv("BACKGROUND_ADMISSION_SHARE", "0.5"))
+
+_cpu_executor = None
+_io_executor = None
+
+def cpu_executor() -> ThreadPoolExecutor:
+    global _cpu_executor
+    if _cpu_executor is None:
+        _cpu_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+    return _cpu_executor
+
+def io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+    return _io_executor
+
+# Both carry the caller's context into the worker so stage timings land on the request's trace
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor(), functools.partial(ctx.run, call_profiled, fn, *args, **kwargs))
+
+async def run_io(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(io_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+class AdmissionGate:
+    """Rejects new work with 503 once `limit` requests are already in flight."""
+
+    def __init__(self, limit: int = MAX_PENDING_REQUESTS, retry_after: int = 5,
+                 background_share: float = BACKGROUND_ADMISSION_SHARE):
+        self.limit = limit
+        self.retry_after = retry_after
+        self.background_limit = max(1, int(limit * background_share))
+        self.pending = 0
+
+    def acquire(self):
+        # Only touched from the event loop thread, so no lock is needed
+        if self.pending >= self.limit:
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry shortly.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.pending += 1
+
+    def try_acquire_background(self) -> bool:
+        # Lower priority than acquire(): never waits, never 503s, just declines
+        if self.pending >= self.background_limit:
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        self.pending -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_admission = None
+
+def get_admission_gate() -> AdmissionGate:
+    # Shared by the request handlers and the job workers
+    global _admission
+    if _admission is None:
+        _admission = AdmissionGate()
+    return _admission
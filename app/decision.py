@@ -0,0 +1,131 @@
+import os, asyncio, hashlib, logging
+from typing import Any, Dict, List, Optional
+import httpx
+from openai import AsyncOpenAI, OpenAIError
+from app import metrics
+from app.cache import MemoryCache
+from app.models import AnalyzeResponse
+from app.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.80"))
+DECISION_MODEL = os.getenv("DECISION_MODEL", "gpt-4o-mini")
+# "false" decides every document with the local rules
+DECISION_LLM = os.getenv("DECISION_LLM", "true").lower() == "true"
+# Whole budget for the LLM call; past it the local rules answer instead
+DECISION_TIMEOUT_SECONDS = float(os.getenv("DECISION_TIMEOUT_SECONDS", "8"))
+DECISION_MAX_TOKENS = int(os.getenv("DECISION_MAX_TOKENS", "1024"))
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "1024"))
+DECISION_CACHE_TTL_SECONDS = float(os.getenv("DECISION_CACHE_TTL_SECONDS", "86400"))
+# Point at a local mock server (or a proxy) instead of api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+SYSTEM_PROMPT = ("You are deciding 1035 exchanges. Only use provided JSON. "
+                 f"If confidence < {CONFIDENCE_THRESHOLD:.2f}, return Needs-Review.")
+
+# Series the local rules need before a document can be called decision-ready
+REQUIRED_SERIES = ["cash_value_by_year", "net_surrender_value_by_year"]
+
+_client: Optional[AsyncOpenAI] = None
+_cache = MemoryCache(max_entries=DECISION_CACHE_MAX_ENTRIES, ttl=DECISION_CACHE_TTL_SECONDS)
+
+
+def get_client() -> AsyncOpenAI:
+    # One client (and one keep-alive connection pool) per process
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            timeout=DECISION_TIMEOUT_SECONDS,
+            # Retries would blow the budget; the local fallback covers failures
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)),
+        )
+    return _client
+
+
+def decision_payload(resp: AnalyzeResponse) -> Dict[str, Any]:
+    # Temporarily remove the large Base64-encoded strings before sending to OpenAI
+    # This is the key to solving the RateLimitError
+    payload = resp.model_dump()
+    payload.pop('redacted_pdf_b64', None)
+    payload.pop('proof_snips', None)
+    return payload
+
+
+def canonical_payload(payload: Dict[str, Any]) -> bytes:
+    # Sorted keys, compact: equal payloads give equal bytes. Also the message body,
+    # so the payload is serialized exactly once.
+    return dumps(payload, sort_keys=True)
+
+
+def payload_key(body: bytes) -> str:
+    h = hashlib.sha256(body)
+    h.update(f"\0{DECISION_MODEL}\0{SYSTEM_PROMPT}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def local_decision(resp: AnalyzeResponse, reason: Optional[str] = None) -> str:
+    # Deterministic rules; conservative, so anything missing means Needs-Review
+    problems: List[str] = []
+    if resp.confidence_overall < CONFIDENCE_THRESHOLD:
+        problems.append(f"confidence {resp.confidence_overall:.2f} is below {CONFIDENCE_THRESHOLD:.2f}")
+    series = resp.series.model_dump()
+    for name in REQUIRED_SERIES:
+        if not series.get(name):
+            problems.append(f"no {name.replace('_', ' ')} values were extracted")
+    if resp.verifications.year_sequence_ok is False:
+        problems.append("policy years are not sequential")
+    lines = []
+    if problems:
+        lines.append("Needs-Review")
+        lines += [f"- {p}" for p in problems]
+    else:
+        lines.append("Decision-Ready")
+        lines.append(f"- confidence {resp.confidence_overall:.2f}; required ledger series present")
+    if reason:
+        lines.append(f"(Local rules: {reason})")
+    return "\n".join(lines)
+
+
+async def _ask_llm(body: bytes) -> str:
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": body.decode("utf-8")}
+    ]
+    response = await asyncio.wait_for(get_client().chat.completions.create(
+        model=DECISION_MODEL,
+        messages=messages,
+        max_completion_tokens=DECISION_MAX_TOKENS # Increased tokens for a complete response
+    ), timeout=DECISION_TIMEOUT_SECONDS)
+    return response.choices[0].message.content.strip()
+
+
+async def decide(resp: AnalyzeResponse) -> Dict[str, str]:
+    """Final decision text plus where it came from: rules, cache, llm or fallback."""
+    with metrics.stage("decision"):
+        if not DECISION_LLM or resp.confidence_overall < CONFIDENCE_THRESHOLD:
+            # Below threshold the answer is Needs-Review regardless; no reason to wait on the LLM
+            result = {"analysis": local_decision(resp), "source": "rules"}
+        else:
+            body = canonical_payload(decision_payload(resp))
+            key = payload_key(body)
+            cached = _cache.get(key)
+            if cached is not None:
+                result = {"analysis": cached, "source": "cache"}
+            else:
+                try:
+                    analysis = await _ask_llm(body)
+                    _cache.set(key, analysis)
+                    result = {"analysis": analysis, "source": "llm"}
+                except (asyncio.TimeoutError, OpenAIError, httpx.HTTPError) as e:
+                    logger.warning("LLM decision failed (%s), using local rules", type(e).__name__)
+                    reason = "LLM timed out" if isinstance(e, asyncio.TimeoutError) else "LLM unavailable"
+                    result = {"analysis": local_decision(resp, reason), "source": "fallback"}
+    metrics.decisions_total.inc(source=result["source"])
+    metrics.count(f"decision_{result['source']}")
+    return result
@@ -0,0 +1,385 @@
+import os, time, uuid, sqlite3, zipfile, hashlib, tempfile, asyncio, logging, threading
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from app.cache import digest_key
+from app.concurrency import AdmissionGate, get_admission_gate, run_io
+from app.serialization import dumps, loads
+from app.uploads import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR = os.getenv("JOB_DIR", "/tmp/extractor-jobs")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(JOB_DIR, "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2.0"))
+JOB_MAX_FILES = int(os.getenv("JOB_MAX_FILES", "5000"))
+# Per PDF (zip members counted decompressed, so zip bombs stop here) and per /jobs request
+JOB_MAX_FILE_BYTES = int(os.getenv("JOB_MAX_FILE_BYTES", str(MAX_UPLOAD_BYTES)))
+JOB_MAX_BATCH_BYTES = int(os.getenv("JOB_MAX_BATCH_BYTES", str(4 * 1024 * 1024 * 1024)))
+# The pre-forking server turns this off in workers and resumes once in the master,
+# so a recycled worker never requeues items its siblings are still running; workers
+# only reclaim items whose owning process is gone
+JOB_RESUME_ON_START = os.getenv("JOB_RESUME_ON_START", "true").lower() == "true"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    owner INTEGER,
+    result_key TEXT
+);
+CREATE INDEX IF NOT EXISTS items_queue ON items (status, priority DESC, id);
+CREATE INDEX IF NOT EXISTS items_hash ON items (content_hash, status);
+CREATE INDEX IF NOT EXISTS items_job ON items (job_id, id);
+"""
+
+_MIGRATIONS = {
+    # Stores created before items recorded the pid that claimed them
+    "owner": "ALTER TABLE items ADD COLUMN owner INTEGER",
+    # ...and the result-cache key (content, PIPELINE_VERSION, config) of their result
+    "result_key": "ALTER TABLE items ADD COLUMN result_key TEXT",
+}
+
+
+def _count_file(batch: Dict[str, int]):
+    batch["files"] += 1
+    if batch["files"] > JOB_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"A job may contain at most {JOB_MAX_FILES} files.")
+
+
+def _ingest(store: "JobStore", filename: str, src: BinaryIO, batch: Dict[str, int], files: List[Tuple[str, str]]):
+    # A zip expands to its PDF members; anything else must itself be a PDF.
+    # Everything is streamed into the blob store; (filename, digest) pairs are appended
+    # to files as each blob lands, so a limit hit mid-zip still knows what to discard.
+    if filename.lower().endswith(".zip"):
+        try:
+            with zipfile.ZipFile(src) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                        continue
+                    _count_file(batch)
+                    with zf.open(info) as member:
+                        files.append((info.filename, store.write_blob(member, info.filename, batch)))
+            return
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"{filename} is not a valid zip file.")
+    if filename.lower().endswith(".pdf"):
+        _count_file(batch)
+        files.append((filename, store.write_blob(src, filename, batch)))
+        return
+    raise HTTPException(status_code=400, detail=f"{filename}: please upload PDF or zip files.")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """SQLite job/item tables plus a content-addressed blob directory."""
+
+    def __init__(self, db_path: str = JOB_DB_PATH, blob_dir: str = os.path.join(JOB_DIR, "blobs")):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        os.makedirs(blob_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = [r[1] for r in self._conn.execute("PRAGMA table_info(items)")]
+        for column, ddl in _MIGRATIONS.items():
+            if column not in columns:
+                self._conn.execute(ddl)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_result ON items (result_key, status)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, f"{digest}.pdf")
+
+    def resume(self) -> int:
+        # Items a previous process was working on when it stopped go back on the queue
+        with self._lock:
+            return self._conn.execute("UPDATE items SET status='queued', owner=NULL WHERE status='running'").rowcount
+
+    def requeue(self, digest: str) -> int:
+        # This process stopped working on the item (e.g. the worker is being recycled)
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE items SET status='queued', owner=NULL WHERE content_hash=? AND status='running' AND owner=?",
+                (digest, os.getpid())).rowcount
+
+    def reclaim_stale(self) -> int:
+        # Running items whose owner process no longer exists (killed past the graceful timeout)
+        with self._lock:
+            owners = [r[0] for r in self._conn.execute(
+                "SELECT DISTINCT owner FROM items WHERE status='running' AND owner IS NOT NULL")]
+            dead = [pid for pid in owners if not _pid_alive(pid)]
+            return sum(self._conn.execute(
+                "UPDATE items SET status='queued', owner=NULL WHERE status='running' AND owner=?", (pid,)).rowcount
+                for pid in dead)
+
+    def write_blob(self, src: BinaryIO, name: str, batch: Dict[str, int]) -> str:
+        # Copies src into the blob store in chunks, hashing as it goes; returns the digest
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.blob_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: src.read(UPLOAD_CHUNK_BYTES), b""):
+                    size += len(chunk)
+                    batch["bytes"] += len(chunk)
+                    if JOB_MAX_FILE_BYTES > 0 and size > JOB_MAX_FILE_BYTES:
+                        raise HTTPException(status_code=413, detail=f"{name} exceeds {JOB_MAX_FILE_BYTES} bytes.")
+                    if JOB_MAX_BATCH_BYTES > 0 and batch["bytes"] > JOB_MAX_BATCH_BYTES:
+                        raise HTTPException(status_code=413, detail=f"A job may contain at most {JOB_MAX_BATCH_BYTES} bytes.")
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            os.replace(tmp, self._blob_path(digest))
+            return digest
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def discard_blobs(self, digests: List[str]):
+        # Blobs no queued or running item still needs
+        for digest in set(digests):
+            with self._lock:
+                pending = self._conn.execute(
+                    "SELECT 1 FROM items WHERE content_hash=? AND status IN ('queued', 'running') LIMIT 1", (digest,)
+                ).fetchone()
+            if pending is None:
+                try:
+                    os.unlink(self._blob_path(digest))
+                except OSError:
+                    pass
+
+    def create_job(self, files: List[Tuple[str, str]], priority: int) -> str:
+        # files: (filename, digest) pairs already in the blob store
+        job_id = uuid.uuid4().hex
+        rows = [(job_id, filename, digest, priority) for filename, digest in files]
+        reused = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("INSERT INTO jobs (id, priority, total, created_at) VALUES (?, ?, ?, ?)",
+                                   (job_id, priority, len(rows), time.time()))
+                for job, filename, digest, prio in rows:
+                    # Dedupe: reuse a finished result for the same content, pipeline version
+                    # and config, the same key /analyze caches under
+                    key = digest_key(digest)
+                    done = self._conn.execute(
+                        "SELECT result FROM items WHERE result_key=? AND status='done' LIMIT 1", (key,)
+                    ).fetchone()
+                    if done:
+                        reused.append(digest)
+                        self._conn.execute(
+                            "INSERT INTO items (job_id, filename, content_hash, priority, status, result, finished_at, "
+                            "result_key) VALUES (?, ?, ?, ?, 'done', ?, ?, ?)",
+                            (job, filename, digest, prio, done[0], time.time(), key))
+                    else:
+                        self._conn.execute(
+                            "INSERT INTO items (job_id, filename, content_hash, priority, status) VALUES (?, ?, ?, ?, 'queued')",
+                            (job, filename, digest, prio))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        # Deduped items never run, so nothing else removes their blobs
+        self.discard_blobs(reused)
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, str]]:
+        # Highest priority first, then FIFO; all queued items with that content are claimed together
+        # BEGIN IMMEDIATE: with several server workers, another process may be claiming too
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT content_hash FROM items WHERE status='queued' ORDER BY priority DESC, id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE items SET status='running', owner=? WHERE content_hash=? AND status='queued'",
+                        (os.getpid(), row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        digest = row[0]
+        # The blob is opened from disk by the pipeline, not read into memory here
+        return digest, self._blob_path(digest)
+
+    def finish(self, digest: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE items SET status=?, result=?, error=?, finished_at=?, result_key=? "
+                "WHERE content_hash=? AND status='running'",
+                ("failed" if error else "done", dumps(result).decode("utf-8") if result is not None else None, error,
+                 time.time(), digest_key(digest), digest))
+        self.discard_blobs([digest])
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._conn.execute("SELECT id, priority, total, created_at FROM jobs WHERE id=?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM items WHERE job_id=? GROUP BY status", (job_id,)).fetchall())
+        return {
+            "job_id": job[0],
+            "priority": job[1],
+            "total": job[2],
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "created_at": job[3],
+        }
+
+    def results(self, job_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, filename, content_hash, status, result, error FROM items "
+                "WHERE job_id=? AND id>? AND status IN ('done', 'failed') ORDER BY id", (job_id, after_id)).fetchall()
+        return [{
+            "item_id": r[0],
+            "filename": r[1],
+            "content_hash": r[2],
+            "status": r[3],
+            "result": loads(r[4]) if r[4] else None,
+            "error": r[5],
+        } for r in rows]
+
+
+class JobRunner:
+    """Pool of asyncio workers that feed queued items through the analyze pipeline."""
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, admission: Optional[AdmissionGate] = None):
+        self.store = store
+        self.workers = workers
+        # Each item holds a background slot, so bulk work counts against the same
+        # limit as /analyze and backs off while requests are waiting
+        self.admission = admission
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        resumed = await run_io(self.store.resume if JOB_RESUME_ON_START else self.store.reclaim_stale)
+        if resumed:
+            logger.info("Resumed %d job items", resumed)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def _idle(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _work(self):
+        while True:
+            if self.admission is not None and not self.admission.try_acquire_background():
+                await self._idle()
+                continue
+            try:
+                claimed = await run_io(self.store.claim)
+                if claimed is not None:
+                    await self._run(*claimed)
+            finally:
+                if self.admission is not None:
+                    self.admission.release()
+            if claimed is None:
+                await self._idle()
+
+    async def _run(self, digest: str, path: str):
+        # Imported here so the job module does not pull in the whole pipeline at import
+        from app.pipeline import analyze_upload
+        from app.uploads import Upload
+        try:
+            upload = Upload(path=path, size=os.path.getsize(path), digest=digest)
+            result = await analyze_upload(upload)
+            await run_io(self.store.finish, digest, result)
+        except asyncio.CancelledError:
+            # Back on the queue for a sibling or the replacement worker. Called directly:
+            # awaiting in a cancelled task is not reliable, and this is one quick UPDATE.
+            self.store.requeue(digest)
+            raise
+        except HTTPException as e:
+            await run_io(self.store.finish, digest, None, str(e.detail))
+        except Exception as e:
+            logger.exception("Job item %s failed", digest)
+            await run_io(self.store.finish, digest, None, str(e))
+
+
+_store = None
+_runner = None
+
+def get_job_store() -> JobStore:
+    global _store
+    if _store is None:
+        _store = JobStore()
+    return _store
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(get_job_store(), admission=get_admission_gate())
+    return _runner
+
+
+async def submit_job(uploads: List[Tuple[str, BinaryIO]], priority: int = 0) -> str:
+    # uploads: (filename, readable file) pairs, e.g. UploadFile.file; zips must be seekable
+    store = get_job_store()
+    batch = {"files": 0, "bytes": 0}
+    files: List[Tuple[str, str]] = []
+    try:
+        for filename, src in uploads:
+            await run_io(_ingest, store, filename, src, batch, files)
+        if not files:
+            raise HTTPException(status_code=400, detail="No PDF files found in the upload.")
+        job_id = await run_io(store.create_job, files, priority)
+    except BaseException:
+        # Blobs of a rejected batch; ones another job's items still use are kept
+        store.discard_blobs([digest for _, digest in files])
+        raise
+    get_job_runner().notify()
+    return job_id
@@ -1,50 +1,50 @@
-import os, io, tempfile, base64, json, uuid
-import boto3
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.staticfiles import StaticFiles
-from app.models import AnalyzeResponse, Fields, Series, Verifications, ProofSnip, ValueWithMeta
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, RedirectResponse
-from app.parser.preflight import ocr_if_needed, normalize_orientation
-from app.parser.tables import find_roi_and_tables
-from app.parser.mapping import label_columns, clean_number
-from app.parser.confidence import compute_confidence
-from app.parser.pii import scrub_text, redact_pdf_boxes, find_pii_coords
-from app.parser.snips import find_snip_coords, crop_to_b64
-import fitz
-import pandas as pd
-from typing import List, Dict, Any
-from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
 
+import os, asyncio
+from typing import List
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.staticfiles import StaticFiles
+from app.models import AnalyzeResponse, JobStatus
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from app import metrics
+from app.serialization import check_acceptable, dumps, render
+from app.concurrency import get_admission_gate, run_blocking, run_io
+from app.jobs import JOB_MAX_BATCH_BYTES, get_job_runner, get_job_store, submit_job
+from app.uploads import check_content_length, spool_upload
+from app.parser.pii import warm_up as warm_up_pii, is_warm as pii_is_warm
+from app.parser.tables import extractor_stats
+from app.pipeline import analyze_upload, iter_upload
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+api = FastAPI(title="1035 In-Force Extractor API")
 
-if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME]):
-    raise ValueError("AWS S3 environment variables not set. Please check your .env file.")
+# Job workers take slots here too, at a lower priority
+admission = get_admission_gate()
 
+# Load spaCy/Presidio at startup instead of on the first /analyze
+PII_WARM_UP = os.getenv("PII_WARM_UP", "true").lower() == "true"
 
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
 
-CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.80"))
+@api.on_event("startup")
+async def warm_up_models():
+    # In the background so /ready can answer while spaCy loads. Skipped when the
+    # pre-forking server (app.server) already warmed up in the master process.
+    api.state.warm_up = None
+    if PII_WARM_UP and not pii_is_warm():
+        api.state.warm_up = asyncio.ensure_future(run_blocking(warm_up_pii))
 
 
-api = FastAPI(title="1035 In-Force Extractor API")
+@api.on_event("startup")
+async def start_job_workers():
+    await get_job_runner().start()
+
+
+@api.on_event("shutdown")
+async def stop_job_workers():
+    await get_job_runner().stop()
+
 
-def b64_file(path: str) -> str:
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("ascii")
-    
 api.mount("/static", StaticFiles(directory="frontend"), name="static")
 
 
@@ -52,150 +52,131 @@ api.mount("/static", StaticFiles(directory="frontend"), name="static")
 async def read_index():
     return FileResponse('frontend/index.html')
 
+
+@api.get("/ready")
+async def ready():
+    # 503 until models are warm and job workers run, so load balancers hold traffic
+    state = {
+        "pid": os.getpid(),
+        "pii_warm": pii_is_warm() or not PII_WARM_UP,
+        "job_workers": get_job_runner().running,
+    }
+    task = api.state.warm_up
+    if task is not None and task.done() and not task.cancelled() and task.exception() is not None:
+        state["error"] = f"PII warm-up failed: {task.exception()}"
+    state["ready"] = state["pii_warm"] and state["job_workers"]
+    return render(state, status_code=200 if state["ready"] else 503)
+
+
+@api.get("/metrics")
+async def prometheus_metrics():
+    body = metrics.render()
+    body += ("# HELP extractor_pending_requests Requests admitted and not yet finished.\n"
+             "# TYPE extractor_pending_requests gauge\n"
+             f"extractor_pending_requests {admission.pending}\n")
+    stats = extractor_stats()
+    for field, name, kind, help in (
+            ("pages", "extractor_tier_pages_total", "counter", "Pages run through each extractor tier."),
+            ("seconds", "extractor_tier_seconds_total", "counter", "Time spent in each extractor tier."),
+            ("win_rate", "extractor_tier_win_rate", "gauge", "Share of discovered ledgers each tier won.")):
+        body += metrics.render_values(name, help, kind, "extractor", {k: e[field] for k, e in stats.items()})
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @api.post("/analyze", response_model=AnalyzeResponse)
-async def analyze(file: UploadFile = File(...)):
+async def analyze(request: Request, file: UploadFile = File(...), timings: bool = False):
+    # timings=true adds a per-stage latency breakdown and the RSS budget report;
+    # Accept: application/msgpack returns MessagePack instead of JSON
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Please upload a PDF file.")
-    # Save temp
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        data = await file.read()
-        tmp.write(data)
-        tmp_path = tmp.name
-
-    try:
-        prepped = ocr_if_needed(tmp_path)
-        prepped = normalize_orientation(prepped)
-
-        tables = find_roi_and_tables(prepped)
-        if not tables:
-            # Return minimal response with low confidence
-            resp = AnalyzeResponse(
-                decision_ready=False,
-                needs_manual_review=True,
-                confidence_overall=0.0,
-                notes=["No tables detected."]
-            )
-            return JSONResponse(content=json.loads(resp.model_dump_json()))
-
-        # Take best table
-        t = tables[0]
-        df = t["df"]
-        col_map = t["col_map"]
-        metrics = t["metrics"]
-
-        # Build simple series from labeled columns if present
-        series = Series()
-        def col_vals(key):
-            idx = col_map.get(key)
-            if idx is None: return []
-            vals = [clean_number(v) for v in df.iloc[1:, idx].to_list()]
-            return [v for v in vals if v is not None]
-
-        series.cash_value_by_year = col_vals("cash_value")
-        series.surrender_charge_by_year = col_vals("surrender_charge")
-        series.net_surrender_value_by_year = col_vals("net_surrender_value")
-        series.planned_premiums_by_year = col_vals("premium")
-
-        # Simple verification metric placeholders
-        verif = Verifications(
-            net_sv_identity_rmse=None,
-            year_sequence_ok=True,
-            rows_parsed_pct=float(len(df) - 1) / float(len(df)) if len(df) > 1 else 0.0
-        )
-        metrics["rows_parsed"] = verif.rows_parsed_pct
-        conf = compute_confidence(metrics)
-        decision_ready = conf >= CONFIDENCE_THRESHOLD
-        needs_review = not decision_ready
-
-        # Redact PDF
-        pii_coords = find_pii_coords(prepped)
-        redacted_path = prepped.replace(".pdf", "-redacted.pdf")
-        redact_pdf_boxes(prepped, pii_coords, redacted_path)
-        redacted_b64 = b64_file(redacted_path)
-        try:
-            os.unlink(redacted_path)
-        except Exception:
-            pass
-
-
-        # Proof snips
-        snip_coords = find_snip_coords(df, t["page"])
-        proof_snips = []
-        for s in snip_coords:
-            rect = fitz.Rect(s["box"])
-            b64_img = crop_to_b64(prepped, s["page"], rect)
-            s3_url = upload_file_to_s3(b64_img, 'image/png', '.png')
-            image_data = s3_url if s3_url else b64_img
-            proof_snips.append(ProofSnip(label=s["label"], page=s["page"], image_b64=image_data))
-
-        s3_url = upload_file_to_s3(redacted_b64)
-        if not s3_url:
-            raise HTTPException(status_code=500, detail="Failed to upload file to S3")
-
-        resp = AnalyzeResponse(
-            decision_ready=decision_ready,
-            needs_manual_review=needs_review,
-            confidence_overall=conf,
-            fields=Fields(
-                crediting_rate=None,
-                death_benefit_pattern=None,
-                face_amount_structure=None,
-                loan_balance_today=None
-            ),
-            series=series,
-            verifications=verif,
-            proof_snips=proof_snips,
-            redacted_pdf_b64=s3_url,
-            notes=[f"Columns found: {list(col_map.keys())}"]
-        )
-
-        # New logic to handle the API call
-        # Temporarily remove the large Base64-encoded strings before sending to OpenAI
-        # This is the key to solving the RateLimitError
-        temp_resp_dict = resp.model_dump()
-        if 'redacted_pdf_b64' in temp_resp_dict:
-            del temp_resp_dict['redacted_pdf_b64']
-        if 'proof_snips' in temp_resp_dict:
-            del temp_resp_dict['proof_snips']
-            
-        json_string = json.dumps(temp_resp_dict)
-        
-        messages = [
-            {"role": "system", "content": "You are deciding 1035 exchanges. Only use provided JSON. If confidence < 0.80, return Needs-Review."},
-            {"role": "user", "content": json_string}
-        ]
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_completion_tokens=1024 # Increased tokens for a complete response
-        )
-
-        final_output = response.choices[0].message.content.strip()
-
-        final_response_content = {
-            "analysis": final_output,
-            "redacted_pdf_b64": s3_url
-        }
-
-        return JSONResponse(content=final_response_content)
-
-    finally:
+    check_content_length(request.headers.get("content-length"))
+    check_acceptable(request.headers.get("accept"))
+    async with admission.admit():
+        upload = await spool_upload(file)
         try:
-            os.unlink(tmp_path)
-        except Exception:
-            pass
+            content = await analyze_upload(upload, timings)
+        finally:
+            await run_io(upload.close)
+        return render(content, request.headers.get("accept"))
+
+
+def _format_event(stage: str, payload, sse: bool) -> bytes:
+    if sse:
+        return b"event: " + stage.encode("ascii") + b"\ndata: " + dumps(payload) + b"\n\n"
+    return dumps({"event": stage, "data": payload}) + b"\n"
 
 
-def upload_file_to_s3(b64_content: str, content_type: str = 'application/pdf', extension: str = '.pdf') -> str:
+@api.post("/analyze/stream")
+async def analyze_stream(request: Request, file: UploadFile = File(...), timings: bool = False):
+    # Emits each stage as soon as it is ready: NDJSON by default, SSE for Accept: text/event-stream
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Please upload a PDF file.")
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    check_content_length(request.headers.get("content-length"))
+    # Held for the life of the stream, not just this handler
+    admission.acquire()
     try:
-        # Decode base64 to bytes
-        file_content = base64.b64decode(b64_content)
-        # Generate random filename
-        random_filename = str(uuid.uuid4()) + extension
-        s3_key = f"extractor/{random_filename}"
-        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=s3_key, Body=file_content, ContentType=content_type)
-        s3_url = f"https://{S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
-        return s3_url
-    except Exception as e:
-        print(f"Error uploading file to S3: {e}")
-        return None
\ No newline at end of file
+        upload = await spool_upload(file)
+    except BaseException:
+        admission.release()
+        raise
+
+    async def events():
+        try:
+            async for stage, payload in iter_upload(upload, timings):
+                if stage == "result":
+                    yield _format_event("decision", payload["content"], sse)
+                else:
+                    yield _format_event(stage, payload, sse)
+        except HTTPException as e:
+            yield _format_event("error", {"status": e.status_code, "detail": e.detail}, sse)
+        except Exception as e:
+            yield _format_event("error", {"status": 500, "detail": str(e)}, sse)
+        finally:
+            try:
+                await run_io(upload.close)
+            finally:
+                admission.release()
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+@api.post("/jobs", response_model=JobStatus, status_code=202)
+async def create_job(request: Request, files: List[UploadFile] = File(...), priority: int = Form(0)):
+    # Starlette has spooled each file to disk; they are streamed on into the blob store
+    check_content_length(request.headers.get("content-length"), JOB_MAX_BATCH_BYTES)
+    job_id = await submit_job([(f.filename, f.file) for f in files], priority)
+    return await run_io(get_job_store().status, job_id)
+
+
+@api.get("/jobs/{job_id}", response_model=JobStatus)
+async def job_status(job_id: str):
+    status = await run_io(get_job_store().status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return status
+
+
+@api.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, follow: bool = False):
+    # NDJSON, one finished item per line; follow=true keeps streaming until the job completes
+    store = get_job_store()
+    if await run_io(store.status, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def lines():
+        last_id = 0
+        while True:
+            for item in await run_io(store.results, job_id, last_id):
+                last_id = item["item_id"]
+                yield dumps(item) + b"\n"
+            status = await run_io(store.status, job_id)
+            if not follow or status["queued"] + status["running"] == 0:
+                # Pick up anything that finished between the two reads
+                for item in await run_io(store.results, job_id, last_id):
+                    yield dumps(item) + b"\n"
+                return
+            await asyncio.sleep(1.0)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,84 @@
+import os, logging, resource, contextvars
+from typing import Any, Dict, List, Optional
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# RSS growth one request may cause over the worker's RSS when it started; 0 disables.
+# RSS is per process, so concurrent requests in one worker count against each other.
+REQUEST_RSS_BUDGET_MB = float(os.getenv("REQUEST_RSS_BUDGET_MB", "768"))
+
+_MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    # Current resident set from /proc; elsewhere the lifetime peak is the best available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryBudget:
+    """Samples RSS at stage and page-window boundaries and records degraded steps."""
+
+    def __init__(self, limit_mb: float = REQUEST_RSS_BUDGET_MB):
+        self.limit = int(limit_mb * _MB)
+        self.start = rss_bytes()
+        self.peak = self.start
+        self.degraded: List[str] = []
+
+    def sample(self) -> int:
+        rss = rss_bytes()
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def over(self) -> bool:
+        rss = self.sample()
+        return self.limit > 0 and rss - self.start > self.limit
+
+    def degrade(self, step: str):
+        if step not in self.degraded:
+            self.degraded.append(step)
+            metrics.degradations_total.inc(step=step)
+            logger.warning("Over the %d MB RSS budget, degrading: %s", self.limit // _MB, step)
+
+    def report(self) -> Dict[str, Any]:
+        self.sample()
+        return {
+            "rss_budget_mb": self.limit // _MB,
+            "rss_start_mb": round(self.start / _MB, 1),
+            "rss_peak_mb": round(self.peak / _MB, 1),
+            "rss_growth_mb": round((self.peak - self.start) / _MB, 1),
+            "degraded": list(self.degraded),
+        }
+
+    def finish(self):
+        metrics.request_rss_growth_mb.observe((self.peak - self.start) / _MB)
+
+
+_current: contextvars.ContextVar[Optional[MemoryBudget]] = contextvars.ContextVar("memory_budget", default=None)
+
+
+def start_budget() -> MemoryBudget:
+    budget = MemoryBudget()
+    _current.set(budget)
+    return budget
+
+
+def current_budget() -> Optional[MemoryBudget]:
+    return _current.get()
+
+
+def over_budget() -> bool:
+    # Always False outside a request
+    budget = _current.get()
+    return budget is not None and budget.over()
+
+
+def degrade(step: str):
+    budget = _current.get()
+    if budget is not None:
+        budget.degrade(step)
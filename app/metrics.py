@@ -0,0 +1,224 @@
+import os, time, random, logging, threading, contextvars, cProfile, pstats
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, shared by every stage histogram
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+MB_BUCKETS = (16, 32, 64, 128, 256, 512, 768, 1024, 2048, 4096)
+
+# cProfile hook: profile a sample of requests and dump the ones slower than the threshold
+PROFILER_SLOW_SECONDS = float(os.getenv("PROFILER_SLOW_SECONDS", "0"))  # 0 disables profiling
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "1.0"))
+PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR", "/tmp/extractor-profiles")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_labels(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values: Dict[LabelKey, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                for i, b in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', str(b))])} {v[i]}")
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {v[-1]}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {v[-2]}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {v[-1]}")
+        return lines
+
+
+stage_seconds = Histogram("extractor_stage_seconds", "Wall time per pipeline stage.")
+request_seconds = Histogram("extractor_request_seconds", "Wall time per analyzed upload.")
+pages_total = Counter("extractor_pages_total", "Pages opened, by kind (all, ocr).")
+candidate_tables = Histogram("extractor_candidate_tables", "Candidate tables found per document.", COUNT_BUCKETS)
+table_wins_total = Counter("extractor_table_wins_total", "Best-table wins per extractor tier.")
+upload_bytes_total = Counter("extractor_upload_bytes_total", "Bytes uploaded to S3, by content type.")
+uploads_total = Counter("extractor_uploads_total", "S3 uploads, by content type and outcome.")
+cache_requests_total = Counter("extractor_cache_requests_total", "Result cache lookups, by outcome (hit, miss).")
+profiles_total = Counter("extractor_profile_matches_total", "Layout profile lookups, by outcome (hit, miss).")
+decisions_total = Counter("extractor_decisions_total", "Final decisions, by source (rules, cache, llm, fallback).")
+request_rss_growth_mb = Histogram("extractor_request_rss_growth_mb", "Peak RSS growth per request in MB.", MB_BUCKETS)
+degradations_total = Counter("extractor_degradations_total", "Steps skipped or narrowed to stay inside the RSS budget.")
+
+REGISTRY = [stage_seconds, request_seconds, pages_total, candidate_tables, table_wins_total,
+            upload_bytes_total, uploads_total, cache_requests_total, profiles_total, decisions_total,
+            request_rss_growth_mb, degradations_total]
+
+
+def render_values(name: str, help: str, kind: str, label: str, values: Dict[str, float]) -> str:
+    # Values kept elsewhere (e.g. the extractor tier stats), one sample per label value
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_fmt_labels(((label, k),))} {v}" for k, v in sorted(values.items())]
+    return "\n".join(lines) + "\n"
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    hits, misses = cache_requests_total.value(result="hit"), cache_requests_total.value(result="miss")
+    lines += ["# HELP extractor_cache_hit_ratio Result cache hits / lookups since start.",
+              "# TYPE extractor_cache_hit_ratio gauge",
+              f"extractor_cache_hit_ratio {hits / (hits + misses) if hits + misses else 0.0}"]
+    return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """Per-request stage timings and counts, plus an optional merged cProfile."""
+
+    def __init__(self, profile: bool = False):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self.profile = profile
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def add_profile(self, prof: cProfile.Profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(prof)
+            else:
+                self._stats.add(prof)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_seconds": round(self.elapsed(), 4),
+                "stages": {k: round(v, 4) for k, v in self.stages.items()},
+                "counts": dict(self.counts),
+            }
+
+    def finish(self, label: str) -> Optional[str]:
+        # Records the request latency; returns the profile path if one was dumped
+        total = self.elapsed()
+        request_seconds.observe(total)
+        if self._stats is None or total < PROFILER_SLOW_SECONDS:
+            return None
+        os.makedirs(PROFILER_OUTPUT_DIR, exist_ok=True)
+        path = os.path.join(PROFILER_OUTPUT_DIR, f"{int(time.time())}-{label[:16]}-{total:.1f}s.prof")
+        with self._lock:
+            self._stats.dump_stats(path)
+        logger.warning("Slow request (%.2fs), profile written to %s", total, path)
+        return path
+
+
+_current: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def start_trace() -> RequestTrace:
+    sampled = PROFILER_SLOW_SECONDS > 0 and random.random() < PROFILER_SAMPLE_RATE
+    trace = RequestTrace(profile=sampled)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+def add_stage(name: str, seconds: float):
+    # For time measured outside a `with stage()` block (e.g. lock waits)
+    stage_seconds.observe(seconds, stage=name)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+def count(name: str, amount: float = 1):
+    # Per-request count only; process-wide counters are incremented by the caller
+    trace = _current.get()
+    if trace is not None:
+        trace.add_count(name, amount)
+
+
+def call_profiled(fn, *args, **kwargs):
+    # cProfile only sees its own thread, so each executor call gets a profile merged into the trace
+    trace = _current.get()
+    if trace is None or not trace.profile:
+        return fn(*args, **kwargs)
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        prof.disable()
+        trace.add_profile(prof)
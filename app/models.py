@@ -41,3 +41,13 @@ class AnalyzeResponse(BaseModel):
     proof_snips: List[ProofSnip] = []
     redacted_pdf_b64: Optional[str] = None
     notes: List[str] = []
+
+class JobStatus(BaseModel):
+    job_id: str
+    priority: int = 0
+    total: int = 0
+    queued: int = 0
+    running: int = 0
+    done: int = 0
+    failed: int = 0
+    created_at: Optional[float] = None
@@ -0,0 +1,200 @@
+import fitz, os, time, tempfile, itertools, threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
+from app import metrics
+from app.memory import over_budget
+
+# Pages whose extraction caches stay resident at once on documents longer than this
+PAGE_WINDOW = int(os.getenv("PAGE_WINDOW", "16"))
+
+# MuPDF is not thread-safe, so all fitz work in the process is serialized on one lock.
+# Pipeline stages hold it for their whole run and step out of it (mupdf_released)
+# around long work that doesn't touch fitz: ocrmypdf, Camelot, spaCy.
+_mupdf = threading.Lock()
+_held = threading.local()
+
+
+@contextmanager
+def mupdf_lock():
+    # Reentrant within a thread; waiting time shows up as the "mupdf_wait" stage
+    if getattr(_held, "depth", 0):
+        _held.depth += 1
+        try:
+            yield
+        finally:
+            _held.depth -= 1
+        return
+    start = time.perf_counter()
+    with _mupdf:
+        metrics.add_stage("mupdf_wait", time.perf_counter() - start)
+        _held.depth = 1
+        try:
+            yield
+        finally:
+            _held.depth = 0
+
+
+@contextmanager
+def mupdf_released():
+    # Lets other requests use MuPDF while this thread does non-fitz work
+    depth = getattr(_held, "depth", 0)
+    if not depth:
+        yield
+        return
+    _held.depth = 0
+    _mupdf.release()
+    try:
+        yield
+    finally:
+        start = time.perf_counter()
+        _mupdf.acquire()
+        metrics.add_stage("mupdf_wait", time.perf_counter() - start)
+        _held.depth = depth
+
+
+# Distinguishes documents in process-wide caches (id() can be reused after close)
+_uids = itertools.count(1)
+
+
+class DocumentContext:
+    """One open fitz.Document per request plus per-page extraction caches.
+
+    Every stage in app/parser takes this object instead of a path so each page
+    is parsed and text-extracted at most once per request.
+    """
+
+    def __init__(self, doc: fitz.Document, path: Optional[str] = None, data: Optional[bytes] = None):
+        self.doc = doc
+        self.path = path
+        # Original bytes when the upload was opened from memory
+        self.data = data
+        # sha256 of the upload when the caller already has it
+        self.digest: Optional[str] = None
+        self.uid = next(_uids)
+        # Temp files created for this request, removed on close
+        self._owned_files: List[str] = []
+        # Page indices that went through OCR in preflight
+        self.ocr_pages: List[int] = []
+        self._text: Dict[int, str] = {}
+        self._blocks: Dict[int, list] = {}
+        self._words: Dict[int, list] = {}
+        self._word_text: Dict[int, Tuple[str, List[Tuple[int, int]]]] = {}
+
+    @classmethod
+    def open(cls, pdf_path: str) -> "DocumentContext":
+        return cls(fitz.open(pdf_path), pdf_path)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DocumentContext":
+        return cls(fitz.open(stream=data, filetype="pdf"), None, data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+    def close(self):
+        self._text.clear()
+        self._blocks.clear()
+        self._words.clear()
+        self._word_text.clear()
+        if not self.doc.is_closed:
+            self.doc.close()
+        for p in self._owned_files:
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
+        self._owned_files.clear()
+
+    def replace(self, doc: fitz.Document, path: Optional[str] = None):
+        # Swap in a new document (e.g. after OCR) and drop the stale caches
+        self.close()
+        self.doc = doc
+        self.path = path
+        self.data = None
+        self.digest = None
+        self.uid = next(_uids)
+
+    def release(self, pages: Iterable[int]):
+        # Drop the cached extraction for these pages; they are re-read if needed again
+        for i in pages:
+            self._text.pop(i, None)
+            self._blocks.pop(i, None)
+            self._words.pop(i, None)
+            self._word_text.pop(i, None)
+
+    def windows(self, pages: Optional[Iterable[int]] = None, size: int = PAGE_WINDOW) -> Iterator[List[int]]:
+        """Yields pages in windows of `size`, releasing each window's caches after it.
+
+        Short documents keep their caches. Over the memory budget MuPDF's own
+        object store is emptied too, so only the current window stays resident.
+        """
+        pages = list(range(len(self))) if pages is None else list(pages)
+        for k in range(0, len(pages), size):
+            window = pages[k:k + size]
+            yield window
+            if len(self) > size:
+                self.release(window)
+            if over_budget():
+                self.release(window)
+                fitz.TOOLS.store_shrink(100)
+
+    def own_file(self, path: str):
+        self._owned_files.append(path)
+
+    def source_path(self) -> str:
+        # Only stages that need a real file (ocrmypdf) pay for writing one
+        if self.path is None:
+            fd, path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.data)
+            self.path = path
+            self.own_file(path)
+        return self.path
+
+    def page(self, index: int) -> fitz.Page:
+        return self.doc[index]
+
+    def text(self, index: int) -> str:
+        if index not in self._text:
+            self._text[index] = self.doc[index].get_text("text")
+        return self._text[index]
+
+    def blocks(self, index: int) -> List[Tuple]:
+        if index not in self._blocks:
+            self._blocks[index] = self.doc[index].get_text("blocks")
+        return self._blocks[index]
+
+    def words(self, index: int) -> List[Tuple]:
+        if index not in self._words:
+            self._words[index] = self.doc[index].get_text("words")
+        return self._words[index]
+
+    def word_text(self, index: int) -> Tuple[str, List[Tuple[int, int]]]:
+        """Page text rebuilt from words, plus each word's (start, end) offset.
+
+        Words on a line are joined by spaces, lines by newlines and blocks by a
+        blank line, so character offsets map straight back to words(index).
+        """
+        if index not in self._word_text:
+            parts: List[str] = []
+            offsets: List[Tuple[int, int]] = []
+            pos = 0
+            prev = None
+            for w in self.words(index):
+                block, line = w[5], w[6]
+                if prev is not None:
+                    sep = " " if (block, line) == prev else ("\n" if block == prev[0] else "\n\n")
+                    parts.append(sep)
+                    pos += len(sep)
+                parts.append(w[4])
+                offsets.append((pos, pos + len(w[4])))
+                pos += len(w[4])
+                prev = (block, line)
+            self._word_text[index] = ("".join(parts), offsets)
+        return self._word_text[index]
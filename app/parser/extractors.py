@@ -0,0 +1,96 @@
+import fitz
+import camelot
+import pandas as pd
+import tempfile, os
+from typing import Dict, List, Tuple, Sequence
+from app.parser.document import DocumentContext
+
+CAMELOT_FLAVORS = ("lattice", "stream")
+
+
+class TableExtractor:
+    """One extraction tier: returns (flavor, DataFrame) pairs for an ROI of an open page.
+
+    DataFrames follow Camelot's layout: integer column labels, header text in row 0.
+    """
+
+    name = ""
+
+    def extract(self, ctx: DocumentContext, page_index: int, roi: fitz.Rect) -> List[Tuple[str, pd.DataFrame]]:
+        raise NotImplementedError
+
+
+class PyMuPDFExtractor(TableExtractor):
+    # Works on the already-open page: no temp files, no reparse
+    name = "pymupdf"
+    strategies = ("lines", "text")
+
+    def extract(self, ctx, page_index, roi):
+        page = ctx.page(page_index)
+        for strategy in self.strategies:
+            found = []
+            for tab in page.find_tables(clip=roi, strategy=strategy).tables:
+                rows = tab.extract()
+                if tab.header.external:
+                    # Header found above the table body: extract() leaves it out, and
+                    # scoring reads row 0 as the header
+                    rows = [tab.header.names] + rows
+                rows = [["" if c is None else str(c) for c in row] for row in rows]
+                if len(rows) > 1:
+                    found.append((strategy, pd.DataFrame(rows)))
+            if found:
+                return found
+        return []
+
+
+def roi_pdf_bytes(ctx: DocumentContext, i: int, roi: fitz.Rect) -> bytes:
+    # Cropped page as a single-page PDF
+    pdf_roi = fitz.open()
+    #pdf_roi.insert_pdf(doc, from_page=i, to_page=i, clip=roi)
+
+    # Copy the full page first
+    pdf_roi.insert_pdf(ctx.doc, from_page=i, to_page=i)
+
+    # Then crop the page to ROI
+    page = pdf_roi[-1]   # last inserted page
+    page.set_cropbox(roi)   # roi is a fitz.Rect
+    try:
+        return pdf_roi.tobytes()
+    finally:
+        pdf_roi.close()
+
+
+def camelot_tables(pdf_bytes: bytes, flavors: Sequence[str] = CAMELOT_FLAVORS) -> List[Tuple[str, pd.DataFrame]]:
+    # Picklable inputs and outputs so it can run in a pool worker
+    found = []
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+    tmp.write(pdf_bytes); tmp.close()
+    try:
+        # try lattice then stream
+        for flavor in flavors:
+            try:
+                ts = camelot.read_pdf(tmp.name, flavor=flavor, pages="1")
+                found.extend((flavor, t.df) for t in ts)
+                if ts.n > 0:
+                    break
+            except Exception:
+                continue
+    finally:
+        os.unlink(tmp.name)
+    return found
+
+
+class CamelotExtractor(TableExtractor):
+    name = "camelot"
+
+    def extract(self, ctx, page_index, roi):
+        return camelot_tables(roi_pdf_bytes(ctx, page_index, roi))
+
+
+EXTRACTORS: Dict[str, TableExtractor] = {}
+
+def register_extractor(extractor: TableExtractor):
+    EXTRACTORS[extractor.name] = extractor
+
+register_extractor(PyMuPDFExtractor())
+register_extractor(CamelotExtractor())
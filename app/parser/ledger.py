@@ -0,0 +1,54 @@
+import numpy as np
+from typing import Any, Dict, Optional
+from app.models import Series
+from app.parser.mapping import numeric_matrix
+
+# Series field -> canonical column it is read from
+SERIES_COLUMNS = {
+    "planned_premiums_by_year": "premium",
+    "cash_value_by_year": "cash_value",
+    "surrender_charge_by_year": "surrender_charge",
+    "net_surrender_value_by_year": "net_surrender_value",
+}
+
+
+class Ledger:
+    """Ledger table as float64 columns aligned on one year axis; NaN marks a missing cell."""
+
+    def __init__(self, years: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.years = years
+        self.columns = columns
+
+    @classmethod
+    def from_table(cls, t: Dict[str, Any]) -> "Ledger":
+        # Reuses the numeric matrix scoring already built when the candidate carries it
+        values: Optional[np.ndarray] = t.get("values")
+        if values is None:
+            values = numeric_matrix(t["df"])
+        body = values[1:]
+        col_map = t["col_map"]
+        columns = {name: np.ascontiguousarray(body[:, idx]) for name, idx in col_map.items()}
+        years = columns.get("year")
+        if years is None or np.isnan(years).all():
+            years = np.arange(1, len(body) + 1, dtype=float)
+        return cls(years, columns)
+
+    def __len__(self) -> int:
+        return len(self.years)
+
+    def column(self, name: str) -> np.ndarray:
+        # Missing cells dropped, matching how the response lists were always built
+        col = self.columns.get(name)
+        if col is None:
+            return np.empty(0)
+        return col[~np.isnan(col)]
+
+    def to_series(self) -> Series:
+        # tolist() is one C-level pass; the values are already validated floats
+        return Series.model_construct(**{field: self.column(name).tolist()
+                                         for field, name in SERIES_COLUMNS.items()})
+
+    def to_columns(self) -> Dict[str, Any]:
+        # Columnar form for binary consumers; arrays are serialized without copying to lists
+        return {"years": self.years, "columns": self.columns}
+
@@ -1,6 +1,9 @@
+import os
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz
-from typing import Dict, Any, Tuple, List
+from functools import lru_cache
+from rapidfuzz import fuzz, process
+from typing import Dict, Any, Tuple, List, Optional
 
 SYNONYMS = {
     "year": ["Policy Year","Year","Yr"],
@@ -31,77 +34,146 @@ def clean_number(x: str):
     except Exception:
         return None
 
+HEADER_MATCH_THRESHOLD = 70
+# Body rows also scanned for headers (Camelot often leaves the real header in row 0)
+HEADER_SCAN_ROWS = int(os.getenv("HEADER_SCAN_ROWS", "3"))
+
+# Built once at import: one query per (canonical field, synonym), already lowercased
+_CANON_FIELDS = list(SYNONYMS)
+_QUERIES: List[str] = []
+_QUERY_FIELD: List[int] = []
+for _fi, (_canon, _syns) in enumerate(SYNONYMS.items()):
+    for _s in _syns + [_canon]:
+        _QUERIES.append(_s.lower())
+        _QUERY_FIELD.append(_fi)
+_QUERY_ROWS = [np.array([q for q, f in enumerate(_QUERY_FIELD) if f == fi]) for fi in range(len(_CANON_FIELDS))]
+
+@lru_cache(maxsize=4096)
+def _match_headers(headers: Tuple[str, ...]) -> Tuple[Tuple[str, int], ...]:
+    # headers are stripped + lowercased; scores every synonym against every header at once
+    if not headers:
+        return ()
+    scores = process.cdist(_QUERIES, list(headers), scorer=fuzz.partial_ratio, dtype=np.float64)
+    matches = []
+    for fi, canon in enumerate(_CANON_FIELDS):
+        per_header = scores[_QUERY_ROWS[fi]].max(axis=0)
+        if per_header.max() >= HEADER_MATCH_THRESHOLD:
+            # ties go to the rightmost header, as in the original nested loop
+            idx = len(per_header) - 1 - int(np.argmax(per_header[::-1]))
+            matches.append((canon, idx))
+    return tuple(matches)
+
+def _normalize_cells(cells) -> Tuple[str, ...]:
+    return tuple(str(c).strip().lower() for c in cells)
+
 def label_columns(df: pd.DataFrame) -> Dict[str, int]:
     # Try header match first
-    header_map: Dict[str, int] = {}
-    headers = [str(h).strip() for h in df.columns]
-    for canon, syns in SYNONYMS.items():
-        best = (-1, -1)
-        for idx, h in enumerate(headers):
-            for s in syns + [canon]:
-                score = fuzz.partial_ratio(s.lower(), h.lower())
-                if score > best[0] or (score == best[0] and idx > best[1]):
-                    best = (score, idx)
-        if best[0] >= 70:
-            header_map[canon] = best[1]
-    return header_map
-
-def shape_score(df: pd.DataFrame, col_map: Dict[str, int]) -> float:
+    header_map: Dict[str, int] = dict(_match_headers(_normalize_cells(df.columns)))
+    # Then fill missing fields from the first body rows
+    for r in range(min(HEADER_SCAN_ROWS, len(df))):
+        if len(header_map) == len(_CANON_FIELDS):
+            break
+        for canon, idx in _match_headers(_normalize_cells(df.iloc[r].tolist())):
+            header_map.setdefault(canon, idx)
+    return {c: header_map[c] for c in _CANON_FIELDS if c in header_map}
+
+# clean_number rules as pandas string ops: "2025-26" -> "2025", "(12)" -> "-12"
+_YEAR_RANGE_RE = r"(?s)^([^-]{4})-.*$"
+_PAREN_NEG_RE = r"(?s)^\((.*)\)$"
+
+def numeric_matrix(df: pd.DataFrame) -> np.ndarray:
+    # Coerce every cell once with clean_number semantics; NaN marks "not a number".
+    # One deliberate difference: cells that are NaN themselves (the text "nan", float NaN)
+    # count as missing, where the row-wise scorers kept clean_number's nan and counted
+    # those rows as failed checks. "inf" still parses to inf, as with clean_number.
+    flat = pd.Series(df.to_numpy(dtype=object).ravel())
+    if flat.empty:
+        return np.empty(df.shape, dtype=float)
+    missing = flat.isna().to_numpy()
+    s = flat.astype(str).str.strip()
+    s = s.str.replace(",", "", regex=False).str.replace("$", "", regex=False)
+    s = s.str.replace(_YEAR_RANGE_RE, r"\1", regex=True)
+    s = s.str.replace(_PAREN_NEG_RE, r"-\1", regex=True)
+    out = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
+    # Cells the fast path rejected (headers, odd spacing) go through clean_number itself
+    residue = np.isnan(out) & ~missing & (s != "").to_numpy()
+    for i in np.flatnonzero(residue):
+        v = clean_number(flat.iat[i])
+        out[i] = np.nan if v is None else v
+    return out.reshape(df.shape)
+
+def infer_year_column(values: np.ndarray, col_map: Dict[str, int]) -> Optional[int]:
+    # For tables whose "Policy Year" header the extractor lost: the leftmost unlabeled
+    # column of whole numbers counting up by one
+    body = values[1:]
+    taken = set(col_map.values())
+    for j in range(body.shape[1] if body.ndim == 2 else 0):
+        if j in taken:
+            continue
+        col = body[:, j]
+        col = col[~np.isnan(col)]
+        if len(col) >= 3 and len(col) >= 0.8 * len(body) and np.all(col == np.round(col)) \
+                and np.all(np.diff(col) == 1):
+            return j
+    return None
+
+
+def shape_score(df: pd.DataFrame, col_map: Dict[str, int], values: Optional[np.ndarray] = None) -> float:
     # More robust shape scoring based on expected patterns
+    if values is None:
+        values = numeric_matrix(df)
+    body = values[1:]
     scores = []
     # Year should increment by 1
     if "year" in col_map:
-        years = [clean_number(v) for v in df.iloc[1:, col_map["year"]].to_list()]
-        years = [y for y in years if y is not None]
+        years = body[:, col_map["year"]]
+        years = years[~np.isnan(years)]
         if len(years) > 1:
-            year_diffs = [years[i] - years[i-1] for i in range(1, len(years))]
-            scores.append(sum(1 for d in year_diffs if d == 1) / float(len(year_diffs)))
+            scores.append(float(np.mean(np.diff(years) == 1)))
 
     # Surrender charge should trend to 0
     if "surrender_charge" in col_map:
-        sc = [clean_number(v) for v in df.iloc[1:, col_map["surrender_charge"]].to_list()]
-        sc = [v for v in sc if v is not None]
+        sc = body[:, col_map["surrender_charge"]]
+        sc = sc[~np.isnan(sc)]
         if len(sc) > 1 and sc[-1] == 0:
             scores.append(1.0)
         elif len(sc) > 1:
             # check if it's mostly decreasing
-            decreasing = [sc[i] <= sc[i-1] for i in range(1, len(sc))]
-            scores.append(sum(decreasing) / len(decreasing))
-
+            scores.append(float(np.mean(sc[1:] <= sc[:-1])))
 
     # Net surrender value <= cash value
     if "net_surrender_value" in col_map and "cash_value" in col_map:
-        nsv = [clean_number(v) for v in df.iloc[1:, col_map["net_surrender_value"]].to_list()]
-        cv = [clean_number(v) for v in df.iloc[1:, col_map["cash_value"]].to_list()]
-        if len(nsv) == len(cv):
-            valid = [nsv[i] <= cv[i] for i in range(len(nsv)) if nsv[i] is not None and cv[i] is not None]
-            if valid:
-                scores.append(sum(valid) / len(valid))
+        nsv = body[:, col_map["net_surrender_value"]]
+        cv = body[:, col_map["cash_value"]]
+        both = ~np.isnan(nsv) & ~np.isnan(cv)
+        if both.any():
+            scores.append(float(np.mean(nsv[both] <= cv[both])))
 
     return sum(scores) / len(scores) if scores else 0.0
 
 
-def reconciliation_score(df: pd.DataFrame, col_map: Dict[str, int]) -> float:
+def reconciliation_score(df: pd.DataFrame, col_map: Dict[str, int], values: Optional[np.ndarray] = None) -> float:
     # net_sv ~= cash_value - surrender_charge - loan - interest
     required_cols = ["net_surrender_value", "cash_value", "surrender_charge"]
     if not all(c in col_map for c in required_cols):
         return 0.0
+    if values is None:
+        values = numeric_matrix(df)
+    body = values[1:]
 
-    rows_ok = 0
-    total_rows = 0
-    for i in range(1, len(df)):
-        try:
-            nsv = clean_number(df.iloc[i, col_map["net_surrender_value"]])
-            cv = clean_number(df.iloc[i, col_map["cash_value"]])
-            sc = clean_number(df.iloc[i, col_map["surrender_charge"]])
-            loan = clean_number(df.iloc[i, col_map.get("loan_balance", -1)]) or 0.0
-            interest = clean_number(df.iloc[i, col_map.get("loan_interest", -1)]) or 0.0
-
-            if nsv is not None and cv is not None and sc is not None:
-                total_rows += 1
-                # Check with a 1% tolerance
-                if abs(nsv - (cv - sc - loan - interest)) <= 0.01 * abs(nsv):
-                    rows_ok += 1
-        except (ValueError, TypeError):
-            continue
-    return rows_ok / total_rows if total_rows > 0 else 0.0
+    nsv = body[:, col_map["net_surrender_value"]]
+    cv = body[:, col_map["cash_value"]]
+    sc = body[:, col_map["surrender_charge"]]
+    # Unmapped loan columns read index -1 (the last column), as the row-wise version did
+    loan = np.nan_to_num(body[:, col_map.get("loan_balance", -1)], nan=0.0)
+    interest = np.nan_to_num(body[:, col_map.get("loan_interest", -1)], nan=0.0)
+
+    valid = ~np.isnan(nsv) & ~np.isnan(cv) & ~np.isnan(sc)
+    total_rows = int(valid.sum())
+    if total_rows == 0:
+        return 0.0
+    # Check with a 1% tolerance
+    with np.errstate(invalid="ignore", over="ignore"):
+        # "inf" cells parse like clean_number's; such rows just fail the check
+        ok = np.abs(nsv - (cv - sc - loan - interest)) <= 0.01 * np.abs(nsv)
+    return int((ok & valid).sum()) / total_rows
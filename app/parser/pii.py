@@ -1,47 +1,145 @@
-from presidio_analyzer import AnalyzerEngine, PatternRecognizer
-from presidio_anonymizer import AnonymizerEngine
-from typing import Dict, Any
-import base64
+from typing import Dict, Any, Iterable, Optional
+import base64, os, threading
+from bisect import bisect_right
 import fitz
-
-analyzer = AnalyzerEngine()
-anonymizer = AnonymizerEngine()
+from app.parser.document import DocumentContext, mupdf_released
 
 DEFAULT_ENTITIES = ["PERSON","PHONE_NUMBER","EMAIL_ADDRESS","CREDIT_CARD","US_SSN","IP_ADDRESS","NRP","LOCATION"]
 
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+# Slim mode keeps only the components NER needs. Presidio's context enhancement
+# reads lemmas, so this trades a little recall on context words for speed.
+PII_SLIM_NLP = os.getenv("PII_SLIM_NLP", "false").lower() == "true"
+SPACY_DISABLE = [c for c in os.getenv("SPACY_DISABLE", "tagger,parser,attribute_ruler,lemmatizer").split(",") if c]
+# nlp.pipe batching for page texts
+PII_BATCH_SIZE = int(os.getenv("PII_BATCH_SIZE", "16"))
+# Upload only the ledger pages (redacted) instead of the whole document
+REDACT_LEDGER_ONLY = os.getenv("REDACT_LEDGER_ONLY", "false").lower() == "true"
+
+# Presidio/spaCy are loaded on first use (or by warm_up), not at import
+_analyzer = None
+_anonymizer = None
+_engine_lock = threading.Lock()
+_warm = False
+
+def _build_analyzer():
+    from presidio_analyzer import AnalyzerEngine
+    from presidio_analyzer.nlp_engine import NlpEngineProvider
+    provider = NlpEngineProvider(nlp_configuration={
+        "nlp_engine_name": "spacy",
+        "models": [{"lang_code": "en", "model_name": SPACY_MODEL}],
+    })
+    nlp_engine = provider.create_engine()
+    if PII_SLIM_NLP:
+        nlp = nlp_engine.nlp["en"]
+        for name in SPACY_DISABLE:
+            if name in nlp.pipe_names:
+                nlp.disable_pipe(name)
+    return AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=["en"])
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with _engine_lock:
+            if _analyzer is None:
+                _analyzer = _build_analyzer()
+    return _analyzer
+
+def get_anonymizer():
+    global _anonymizer
+    if _anonymizer is None:
+        with _engine_lock:
+            if _anonymizer is None:
+                from presidio_anonymizer import AnonymizerEngine
+                _anonymizer = AnonymizerEngine()
+    return _anonymizer
+
+def warm_up():
+    # Load the engines and run one pass so the first request doesn't pay for it
+    global _warm
+    get_analyzer().analyze(text="John Smith, 555-123-4567", entities=DEFAULT_ENTITIES, language="en")
+    get_anonymizer()
+    _warm = True
+
+def is_warm() -> bool:
+    # True in forked workers when the master already warmed up before forking
+    return _warm
+
 def scrub_text(text: str) -> str:
-    results = analyzer.analyze(text=text, entities=DEFAULT_ENTITIES, language="en")
-    anonymized = anonymizer.anonymize(text=text, analyzer_results=results)
+    results = get_analyzer().analyze(text=text, entities=DEFAULT_ENTITIES, language="en")
+    anonymized = get_anonymizer().anonymize(text=text, analyzer_results=results)
     return anonymized.text
 
 
-def find_pii_coords(pdf_path: str) -> Dict[int, list]:
-    # returns dict of page_num -> list of fitz.Rect
-    doc = fitz.open(pdf_path)
+def _entity_rects(words: list, offsets: list, starts: list, start: int, end: int) -> list:
+    # Union of the words overlapping [start, end), one rect per text line
+    lines = {}
+    k = max(0, bisect_right(starts, start) - 1)
+    while k < len(offsets) and offsets[k][0] < end:
+        if offsets[k][1] > start:
+            w = words[k]
+            key = (w[5], w[6])
+            r = fitz.Rect(w[:4])
+            lines[key] = lines[key] | r if key in lines else r
+        k += 1
+    return list(lines.values())
+
+
+def find_pii_coords(ctx: DocumentContext, page_numbers: Optional[Iterable[int]] = None) -> Dict[int, list]:
+    # returns dict of page_num -> list of fitz.Rect; page_numbers limits the scan
+    from presidio_analyzer import BatchAnalyzerEngine
+    numbers = list(range(len(ctx))) if page_numbers is None else sorted(set(page_numbers))
+    batch = BatchAnalyzerEngine(analyzer_engine=get_analyzer())
     coords = {}
-    for i, page in enumerate(doc):
-        text = page.get_text("text")
-        results = analyzer.analyze(text=text, entities=DEFAULT_ENTITIES, language="en")
-        page_coords = []
-        for res in results:
-            pii_text = text[res.start:res.end]
-            for r in page.search_for(pii_text):
-                page_coords.append(r)
-        if page_coords:
-            coords[i] = page_coords
+    # One nlp.pipe pass per page window, so only a window of page texts and docs is resident
+    for window in ctx.windows(numbers):
+        # word_text also caches words(i), so the NER pass below needs no fitz
+        pages = [ctx.word_text(i) for i in window]
+        with mupdf_released():
+            all_results = list(batch.analyze_iterator(
+                [text for text, _ in pages], language="en",
+                batch_size=PII_BATCH_SIZE, entities=DEFAULT_ENTITIES,
+            ))
+        for i, (text, offsets), results in zip(window, pages, all_results):
+            if not results:
+                continue
+            words = ctx.words(i)
+            starts = [o[0] for o in offsets]
+            page_coords = []
+            for res in results:
+                page_coords.extend(_entity_rects(words, offsets, starts, res.start, res.end))
+            if page_coords:
+                coords[i] = page_coords
     return coords
 
 
-def redact_pdf_boxes(pdf_path: str, spans: Dict[int, list], out_path: str):
-    # spans: dict of page -> list of fitz.Rect to cover
-    doc = fitz.open(pdf_path)
-    red = (1,1,1)  # white box
+def redact_pdf_boxes(ctx: DocumentContext, spans: Dict[int, list], keep_pages: Optional[Iterable[int]] = None) -> bytes:
+    # spans: dict of page -> list of fitz.Rect to remove
+    # keep_pages: emit only these pages (e.g. the ledger) as a small derivative PDF
+    # Edits the shared document, so this must be the last stage that reads it
+    doc = ctx.doc
+    keep = None if keep_pages is None else sorted(set(p for p in keep_pages if p < len(doc)))
+    ocr_pages = set(ctx.ocr_pages)
+    white = (1,1,1)
     for pno, rects in spans.items():
-        if pno >= len(doc): continue
+        if pno >= len(doc) or (keep is not None and pno not in keep): continue
         page = doc[pno]
         for r in rects:
-            page.draw_rect(r, color=red, fill=red, width=0)
-    doc.save(out_path)
+            page.add_redact_annot(r, fill=white)
+        # True removal from the content stream, only on pages with hits. Image
+        # pixels only matter where the text came from OCR of a scan; leaving
+        # images and vector art alone elsewhere keeps this fast.
+        page.apply_redactions(
+            images=fitz.PDF_REDACT_IMAGE_PIXELS if pno in ocr_pages else fitz.PDF_REDACT_IMAGE_NONE,
+            graphics=fitz.PDF_REDACT_LINE_ART_NONE,
+        )
+    if keep is not None:
+        doc.select(keep)
+    # Always strip PDF metadata (Author, Title, XMP)
+    doc.set_metadata({})
+    doc.del_xml_metadata()
+    # Written straight to memory in one pass; garbage collection + deflate keep it small
+    return doc.tobytes(garbage=3, deflate=True)
 
 def pixmap_to_b64(pix) -> str:
     return base64.b64encode(pix.tobytes("png")).decode("ascii")
@@ -1,20 +1,121 @@
-import fitz, tempfile, subprocess, os
-
-def has_text_layer(pdf_path: str) -> bool:
-    with fitz.open(pdf_path) as doc:
-        for p in doc:
-            if p.get_text().strip():
-                return True
-    return False
-
-def ocr_if_needed(pdf_path: str) -> str:
-    if has_text_layer(pdf_path):
-        return pdf_path
-    out = pdf_path.replace(".pdf", "-ocr.pdf")
-    cmd = ["ocrmypdf", "--force-ocr", "--deskew", "--rotate-pages", "--clean", "--optimize", "3", pdf_path, out]
-    subprocess.run(cmd, check=True)
-    return out
-
-def normalize_orientation(pdf_path: str) -> str:
+import fitz, subprocess, os, time, hashlib, tempfile, threading
+from typing import List
+from app.parser.document import DocumentContext, mupdf_released
+from app.cache import evict_files
+from app import metrics
+
+OCR_JOBS = int(os.getenv("OCR_JOBS", "1"))
+# --optimize only shrinks the output file, which we discard after extraction
+OCR_OPTIMIZE = os.getenv("OCR_OPTIMIZE", "0")
+MAX_RUNTIME_SECONDS = float(os.getenv("MAX_RUNTIME_SECONDS", "60"))
+# Content-addressed store of OCR'd PDFs; empty disables it
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "/tmp/extractor-ocr-cache")
+# Evicted like the disk result cache: TTL by mtime, then least recently used over the size cap
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+OCR_CACHE_TTL_SECONDS = float(os.getenv("OCR_CACHE_TTL_SECONDS", "604800"))
+
+_ocr_cache_lock = threading.Lock()
+
+def pages_without_text(ctx: DocumentContext) -> List[int]:
+    pages = []
+    for window in ctx.windows():
+        pages.extend(i for i in window if not ctx.text(i).strip())
+    return pages
+
+def _page_ranges(pages: List[int]) -> str:
+    # 0-based page indices -> ocrmypdf's 1-based "1,3-5" syntax
+    ranges, start, prev = [], None, None
+    for p in pages:
+        if start is None:
+            start = prev = p
+        elif p == prev + 1:
+            prev = p
+        else:
+            ranges.append((start, prev)); start = prev = p
+    if start is not None:
+        ranges.append((start, prev))
+    return ",".join(str(a + 1) if a == b else f"{a + 1}-{b + 1}" for a, b in ranges)
+
+def _ocr_options(pages: List[int]) -> List[str]:
+    return ["--force-ocr", "--pages", _page_ranges(pages), "--jobs", str(OCR_JOBS),
+            "--deskew", "--rotate-pages", "--clean", "--optimize", OCR_OPTIMIZE]
+
+def _ocr_cache_key(ctx: DocumentContext, options: List[str]) -> str:
+    h = hashlib.sha256()
+    if ctx.digest:
+        # Already hashed while the upload was read
+        h.update(ctx.digest.encode("ascii"))
+    elif ctx.data is not None:
+        h.update(ctx.data)
+    else:
+        with open(ctx.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    h.update("\0".join(options).encode("utf-8"))
+    return h.hexdigest()
+
+def _open_cached(path: str):
+    # None on a miss, an expired entry, or one evicted by another request meanwhile
+    try:
+        st = os.stat(path)
+        if st.st_mtime + OCR_CACHE_TTL_SECONDS < time.time():
+            os.unlink(path)
+            return None
+        doc = fitz.open(path)
+        # Record the access for LRU eviction without resetting the TTL clock
+        os.utime(path, (time.time(), st.st_mtime))
+        return doc
+    except (OSError, RuntimeError):
+        return None
+
+def _run_ocrmypdf(pdf_path: str, out: str, options: List[str]):
+    cmd = ["ocrmypdf", *options, pdf_path, out]
+    with metrics.stage("ocr"), mupdf_released():
+        subprocess.run(cmd, check=True, timeout=MAX_RUNTIME_SECONDS)
+
+def ocr_if_needed(ctx: DocumentContext) -> DocumentContext:
+    # OCR only the image-only pages; pages with a text layer pass through untouched
+    pages = pages_without_text(ctx)
+    if not pages:
+        return ctx
+    options = _ocr_options(pages)
+    owned = False
+    if not OCR_CACHE_DIR:
+        fd, out = tempfile.mkstemp(suffix="-ocr.pdf")
+        os.close(fd)
+        owned = True
+        try:
+            _run_ocrmypdf(ctx.source_path(), out, options)
+        except Exception:
+            os.unlink(out)
+            raise
+        doc = fitz.open(out)
+    else:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        out = os.path.join(OCR_CACHE_DIR, _ocr_cache_key(ctx, options) + ".pdf")
+        doc = _open_cached(out)
+        if doc is None:
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=OCR_CACHE_DIR)
+            os.close(fd)
+            try:
+                _run_ocrmypdf(ctx.source_path(), tmp, options)
+                # Opened before it is published: eviction may unlink it, and an open
+                # file stays readable
+                doc = fitz.open(tmp)
+                os.replace(tmp, out)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            with _ocr_cache_lock:
+                evict_files(OCR_CACHE_DIR, ".pdf", OCR_CACHE_MAX_BYTES, OCR_CACHE_TTL_SECONDS)
+    ctx.replace(doc, out)
+    if owned:
+        ctx.own_file(out)
+    ctx.ocr_pages = pages
+    metrics.pages_total.inc(len(pages), kind="ocr")
+    metrics.count("ocr_pages", len(pages))
+    return ctx
+
+def normalize_orientation(ctx: DocumentContext) -> DocumentContext:
     # PyMuPDF auto-rotates content when extracting. We keep as-is here.
-    return pdf_path
+    return ctx
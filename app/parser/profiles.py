@@ -0,0 +1,118 @@
+import os, re, json, time, hashlib, threading
+from collections import Counter
+from typing import Dict, Any, List, Optional, Set
+from app.parser.document import DocumentContext
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "app/profiles")
+PROFILE_FINGERPRINT_PAGES = int(os.getenv("PROFILE_FINGERPRINT_PAGES", "2"))
+# Jaccard similarity between fingerprints needed to reuse a profile
+PROFILE_MATCH_THRESHOLD = float(os.getenv("PROFILE_MATCH_THRESHOLD", "0.6"))
+
+_TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z&'\-]{2,}")
+
+
+def _hash_token(token: str) -> str:
+    # Profiles are written to disk, so keep tokens (which may include names) hashed
+    return hashlib.sha1(token.lower().encode("utf-8")).hexdigest()[:12]
+
+
+def fingerprint(ctx: DocumentContext) -> List[str]:
+    # Carrier/product tokens from the first pages, where the cover and policy summary live
+    tokens: Set[str] = set()
+    for i in range(min(PROFILE_FINGERPRINT_PAGES, len(ctx))):
+        for w in _TOKEN_RE.findall(ctx.text(i)):
+            tokens.add(_hash_token(w))
+    return sorted(tokens)
+
+
+class ProfileStore:
+    """JSON profiles on disk plus an in-memory inverted index token -> profile ids."""
+
+    def __init__(self, directory: str = PROFILE_DIR):
+        self.directory = directory
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._index: Dict[str, Set[str]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                        self._add(json.load(f))
+                except (OSError, ValueError, KeyError):
+                    continue
+        self._loaded = True
+
+    def _add(self, profile: Dict[str, Any]):
+        pid = profile["id"]
+        old = self._profiles.get(pid)
+        if old is not None:
+            for tok in old["tokens"]:
+                self._index.get(tok, set()).discard(pid)
+        self._profiles[pid] = profile
+        for tok in profile["tokens"]:
+            self._index.setdefault(tok, set()).add(pid)
+
+    def _best(self, tokens: List[str]) -> Optional[Dict[str, Any]]:
+        # Count shared tokens via the index so only overlapping profiles are scored
+        overlap = Counter()
+        for tok in tokens:
+            for pid in self._index.get(tok, ()):
+                overlap[pid] += 1
+        best, best_sim = None, PROFILE_MATCH_THRESHOLD
+        for pid in sorted(overlap):
+            shared = overlap[pid]
+            union = len(tokens) + len(self._profiles[pid]["tokens"]) - shared
+            sim = shared / union if union else 0.0
+            if sim >= best_sim and (best is None or sim > best_sim):
+                best, best_sim = self._profiles[pid], sim
+        return best
+
+    def match(self, tokens: List[str]) -> Optional[Dict[str, Any]]:
+        if not tokens:
+            return None
+        with self._lock:
+            self._load()
+            return self._best(tokens)
+
+    def learn(self, tokens: List[str], table: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._load()
+            existing = self._best(tokens)
+            pid = existing["id"] if existing else hashlib.sha1("".join(tokens).encode("utf-8")).hexdigest()[:16]
+            # Every page of a stitched ledger, so the next upload extracts them all directly
+            rois = table.get("page_rois") or [{"page": table["page"], "roi": table["roi"]}]
+            profile = {
+                "id": pid,
+                "tokens": tokens,
+                "roi": [{"page": r["page"], "y0": r["roi"][1], "y1": r["roi"][3]} for r in rois],
+                "flavor": table["flavor"],
+                # A stitched table's col_map points into the stitched frame, not the pages
+                "col_map": table.get("page_col_map", table["col_map"]),
+                "score": table["score"],
+                "hits": (existing or {}).get("hits", 0) + 1,
+                "updated_at": time.time(),
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{pid}.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(profile, f)
+            os.replace(tmp, path)
+            self._add(profile)
+            return profile
+
+
+_store = None
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    if _store is None:
+        _store = ProfileStore()
+    return _store
@@ -1,29 +1,296 @@
+import os, io, re, base64, datetime, threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 import pandas as pd
-import fitz, base64
-from typing import List, Dict, Any
+import fitz
+from app.parser.document import DocumentContext
 
-def find_snip_coords(df: pd.DataFrame, page_num: int) -> List[Dict[str, Any]]:
-    # Placeholder logic for finding snip coordinates
-    # This would need to be much more sophisticated in a real application
+SNIP_FORMAT = os.getenv("SNIP_FORMAT", "png").lower()  # png | webp | jpeg
+SNIP_DPI = int(os.getenv("SNIP_DPI", "200"))
+# Encoder quality for webp/jpeg (png is lossless)
+SNIP_QUALITY = int(os.getenv("SNIP_QUALITY", "80"))
+# Rendered page regions kept for reuse across snips, shared by all requests
+SNIP_RENDER_CACHE_BYTES = int(os.getenv("SNIP_RENDER_CACHE_BYTES", str(64 * 1024 * 1024)))
+SNIP_PADDING = float(os.getenv("SNIP_PADDING", "3"))
+# Leading pages searched for the loan callout, besides the ledger page
+SNIP_LOAN_SEARCH_PAGES = int(os.getenv("SNIP_LOAN_SEARCH_PAGES", "3"))
+
+_FORMATS = {"png": ("image/png", ".png"), "webp": ("image/webp", ".webp"), "jpeg": ("image/jpeg", ".jpg")}
+if SNIP_FORMAT == "jpg":
+    SNIP_FORMAT = "jpeg"
+if SNIP_FORMAT not in _FORMATS:
+    SNIP_FORMAT = "png"
+SNIP_CONTENT_TYPE, SNIP_EXTENSION = _FORMATS[SNIP_FORMAT]
+
+GRID_CELL = 32.0  # points
+_STRIP = "$,:;()"
+_AMOUNT_RE = re.compile(r"^\(?\$?\d[\d,]*(\.\d+)?\)?$")
+
+
+def _norm(text: str) -> str:
+    return text.strip().lower().strip(_STRIP).replace(",", "")
+
+
+class WordIndex:
+    """Uniform grid over one page's words, plus token and text-line lookups."""
+
+    def __init__(self, words: list, cell: float = GRID_CELL):
+        self.words = words
+        self.cell = cell
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._tokens: Dict[str, List[int]] = {}
+        self._lines: Dict[Tuple[int, int], List[int]] = {}
+        for k, w in enumerate(words):
+            for key in self._cells(w[0], w[1], w[2], w[3]):
+                self._grid.setdefault(key, []).append(k)
+            self._tokens.setdefault(_norm(w[4]), []).append(k)
+            self._lines.setdefault((w[5], w[6]), []).append(k)
+
+    def _cells(self, x0, y0, x1, y1):
+        c = self.cell
+        for gx in range(int(x0 // c), int(x1 // c) + 1):
+            for gy in range(int(y0 // c), int(y1 // c) + 1):
+                yield gx, gy
+
+    def within(self, rect: fitz.Rect) -> List[int]:
+        found = set()
+        for key in self._cells(rect.x0, rect.y0, rect.x1, rect.y1):
+            for k in self._grid.get(key, ()):
+                w = self.words[k]
+                if w[0] < rect.x1 and w[2] > rect.x0 and w[1] < rect.y1 and w[3] > rect.y0:
+                    found.add(k)
+        return sorted(found)
+
+    def find(self, token: str) -> List[int]:
+        return self._tokens.get(_norm(token), [])
+
+    def rect(self, k: int) -> fitz.Rect:
+        return fitz.Rect(self.words[k][:4])
+
+    def row_rect(self, k: int, clip: fitz.Rect) -> fitz.Rect:
+        # The visual row through word k: words in clip whose vertical centre lies in k's band.
+        # Table cells are often separate text blocks, so (block, line) alone would miss them.
+        w = self.words[k]
+        r = self.rect(k)
+        for j in self.within(fitz.Rect(clip.x0, w[1], clip.x1, w[3])):
+            o = self.words[j]
+            if w[1] <= (o[1] + o[3]) / 2 <= w[3]:
+                r |= self.rect(j)
+        return r
+
+    def line(self, k: int) -> List[int]:
+        w = self.words[k]
+        return self._lines[(w[5], w[6])]
+
+
+# (document uid, page) -> WordIndex; small, since an index is only useful while its request runs
+_indexes: "OrderedDict[Tuple[int, int], WordIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+_MAX_INDEXES = 64
+
+def word_index(ctx: DocumentContext, page_index: int) -> WordIndex:
+    key = (ctx.uid, page_index)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = WordIndex(ctx.words(page_index))
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _pad(rect: fitz.Rect, bounds: fitz.Rect) -> fitz.Rect:
+    p = SNIP_PADDING
+    return fitz.Rect(rect.x0 - p, rect.y0 - p, rect.x1 + p, rect.y1 + p) & bounds
+
+
+def _locate_row(index: WordIndex, df: pd.DataFrame, row: int, clip: fitz.Rect) -> Optional[fitz.Rect]:
+    # Anchor on the row's first token (usually the year), then keep the visual row
+    # that shares the most tokens with the parsed table row
+    tokens = [_norm(t) for c in df.iloc[row].tolist() for t in str(c).split()]
+    tokens = [t for t in tokens if t and t != "nan"]
+    if not tokens:
+        return None
+    wanted = set(tokens)
+    best, best_hits = None, min(2, len(wanted)) - 1
+    for k in index.find(tokens[0]):
+        if not clip.intersects(index.rect(k)):
+            continue
+        rect = index.row_rect(k, clip)
+        hits = len({_norm(index.words[j][4]) for j in index.within(rect)} & wanted)
+        if hits > best_hits:
+            best, best_hits = rect, hits
+    return best
+
+
+def _first_row(df: pd.DataFrame, ledger) -> Optional[int]:
+    # df row (header is row 0) of the first ledger row with any value
+    if ledger is None:
+        return 1 if len(df) > 1 else None
+    filled = np.zeros(len(ledger), dtype=bool)
+    for col in ledger.columns.values():
+        filled |= ~np.isnan(col)
+    hits = np.flatnonzero(filled)
+    return int(hits[0]) + 1 if len(hits) else None
+
+
+def _current_row(ledger) -> Optional[int]:
+    # Only calendar-year ledgers say which row is "now"; policy-year ones start at the current year
+    if ledger is None or "year" not in ledger.columns:
+        return None
+    hits = np.flatnonzero(ledger.columns["year"] == datetime.date.today().year)
+    return int(hits[0]) + 1 if len(hits) else None
+
+
+def _surrender_end_row(ledger) -> Optional[int]:
+    # First row where the surrender charge has run off to zero
+    if ledger is None or "surrender_charge" not in ledger.columns:
+        return None
+    sc = ledger.columns["surrender_charge"]
+    for i in np.flatnonzero(sc == 0):
+        if np.nanmax(sc[:i], initial=0) > 0:
+            return int(i) + 1
+    return None
+
+
+def _loan_callout(ctx: DocumentContext, ledger_page: int) -> Optional[Dict[str, Any]]:
+    # A text line mentioning "loan" next to an amount, e.g. "Current Loan $136,713.00"
+    pages = sorted(set(range(min(SNIP_LOAN_SEARCH_PAGES, len(ctx)))) | {ledger_page})
+    for p in pages:
+        index = word_index(ctx, p)
+        for k in index.find("loan"):
+            line = index.line(k)
+            if any(_AMOUNT_RE.match(index.words[j][4]) and any(ch in index.words[j][4] for ch in "$,.")
+                   for j in line):
+                rect = index.rect(line[0])
+                for j in line[1:]:
+                    rect |= index.rect(j)
+                return {"label": "loan_callout", "page": p, "box": list(_pad(rect, ctx.page(p).rect))}
+    return None
+
+
+def find_snip_coords(ctx: DocumentContext, df: pd.DataFrame, page_num: int, roi=None, ledger=None,
+                     row_pages: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    # Real boxes for the proof rows, found through the page's word index.
+    # row_pages gives each df row's page when the ledger was stitched across pages.
     snips = []
     if len(df) > 1:
-        # First year row
-        snips.append({
-            "label": "first_year_row",
-            "page": page_num,
-            "box": [0, 0, 100, 100] # Placeholder coordinates
-        })
-        # Current year row (placeholder)
-        snips.append({
-            "label": "current_year_row",
-            "page": page_num,
-            "box": [0, 100, 100, 200] # Placeholder coordinates
-        })
+        wanted = [("first_year_row", _first_row(df, ledger)),
+                  ("current_year_row", _current_row(ledger)),
+                  ("surrender_charge_row", _surrender_end_row(ledger))]
+        seen = set()
+        for label, row in wanted:
+            if row is None or row in seen or row >= len(df):
+                continue
+            seen.add(row)
+            page = row_pages[row] if row_pages else page_num
+            clip = ctx.page(page).rect
+            if roi is not None and page == page_num:
+                clip = fitz.Rect(roi) & clip
+            rect = _locate_row(word_index(ctx, page), df, row, clip)
+            if rect is not None:
+                snips.append({"label": label, "page": page, "box": list(_pad(rect, clip))})
+    loan = _loan_callout(ctx, page_num)
+    if loan is not None:
+        snips.append(loan)
     return snips
 
 
-def crop_to_b64(pdf_path: str, page_index: int, rect: fitz.Rect) -> str:
-    with fitz.open(pdf_path) as doc:
-        page = doc[page_index]
-        pix = page.get_pixmap(clip=rect, dpi=200)
-        return base64.b64encode(pix.tobytes("png")).decode("ascii")
+class RenderCache:
+    """Byte-bounded LRU of rendered page regions: (doc uid, page, dpi) -> (clip, pixmap)."""
+
+    def __init__(self, max_bytes: int = SNIP_RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Tuple[int, int, int], Tuple[fitz.Rect, fitz.Pixmap, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, clip: fitz.Rect) -> Optional[fitz.Pixmap]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or not item[0].contains(clip):
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key, clip: fitz.Rect, pix: fitz.Pixmap):
+        size = pix.stride * pix.height
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (clip, pix, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._items)))
+
+    def drop(self, uid: int):
+        with self._lock:
+            for key in [k for k in self._items if k[0] == uid]:
+                self._pop(key)
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+
+render_cache = RenderCache()
+
+
+def _render(ctx: DocumentContext, page_index: int, clip: fitz.Rect, dpi: int) -> fitz.Pixmap:
+    key = (ctx.uid, page_index, dpi)
+    pix = render_cache.get(key, clip)
+    if pix is None:
+        pix = ctx.page(page_index).get_pixmap(clip=clip, dpi=dpi, alpha=False)
+        render_cache.put(key, clip, pix)
+    return pix
+
+
+def _crop(pix: fitz.Pixmap, rect: fitz.Rect, dpi: int) -> fitz.Pixmap:
+    irect = (rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+    sub = fitz.Pixmap(pix.colorspace, irect, False)
+    sub.copy(pix, irect)
+    return sub
+
+
+def encode(pix: fitz.Pixmap, fmt: str = SNIP_FORMAT, quality: int = SNIP_QUALITY) -> bytes:
+    if fmt == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if fmt == "webp":
+        # PyMuPDF has no WebP writer; Pillow does
+        from PIL import Image
+        mode = "L" if pix.n == 1 else "RGB"
+        buf = io.BytesIO()
+        Image.frombytes(mode, (pix.width, pix.height), pix.samples).save(buf, "WEBP", quality=quality)
+        return buf.getvalue()
+    return pix.tobytes("png")
+
+
+def render_snips(ctx: DocumentContext, snips: List[Dict[str, Any]], dpi: int = SNIP_DPI) -> List[bytes]:
+    # One render per page, covering all of that page's snips, then a crop per snip
+    regions: Dict[int, fitz.Rect] = {}
+    for s in snips:
+        rect = fitz.Rect(s["box"])
+        regions[s["page"]] = regions[s["page"]] | rect if s["page"] in regions else rect
+    try:
+        out = []
+        for s in snips:
+            pix = _render(ctx, s["page"], regions[s["page"]], dpi)
+            out.append(encode(_crop(pix, fitz.Rect(s["box"]), dpi)))
+        return out
+    finally:
+        render_cache.drop(ctx.uid)
+
+
+def crop_to_png(ctx: DocumentContext, page_index: int, rect: fitz.Rect) -> bytes:
+    return encode(_crop(_render(ctx, page_index, rect, SNIP_DPI), rect, SNIP_DPI), "png")
+
+
+def crop_to_b64(ctx: DocumentContext, page_index: int, rect: fitz.Rect) -> str:
+    return base64.b64encode(crop_to_png(ctx, page_index, rect)).decode("ascii")
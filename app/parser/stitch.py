@@ -0,0 +1,173 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List
+from app.parser.document import DocumentContext
+from app.parser.mapping import HEADER_SCAN_ROWS, shape_score
+from app.parser.tables import score_table, extract_page_tables
+
+# Stop following the ledger once the insured reaches this age
+MATURITY_AGE = int(os.getenv("MATURITY_AGE", "121"))
+STITCH_MAX_PAGES = int(os.getenv("STITCH_MAX_PAGES", "12"))
+# Share of the ledger's columns a page must also have to continue it
+STITCH_MIN_SHARED_COLUMNS = float(os.getenv("STITCH_MIN_SHARED_COLUMNS", "0.6"))
+# shape_score the joined rows must keep across the page break
+STITCH_MIN_SHAPE = float(os.getenv("STITCH_MIN_SHAPE", "0.75"))
+# Rows either side of a page break checked with shape_score
+_SEAM_ROWS = 5
+
+
+def _body_start(c: Dict[str, Any]) -> int:
+    # First row with a numeric year. Row 0 is normally the header; continuation pages
+    # without one start with data, and ROIs that caught a page title have it above
+    idx = c["col_map"].get("year")
+    if idx is None:
+        return 1
+    years = c["values"][:HEADER_SCAN_ROWS + 1, idx]
+    numeric = np.flatnonzero(~np.isnan(years))
+    return int(numeric[0]) if len(numeric) else 1
+
+
+def _column(c: Dict[str, Any], key: str) -> np.ndarray:
+    idx = c["col_map"].get(key)
+    body = c["values"][_body_start(c):]
+    return body[:, idx] if idx is not None else np.full(len(body), np.nan)
+
+
+def _years(c: Dict[str, Any]) -> np.ndarray:
+    y = _column(c, "year")
+    return y[~np.isnan(y)]
+
+
+class LedgerStitcher:
+    """Joins page-level candidates into one ledger, one page at a time."""
+
+    def __init__(self, seed: Dict[str, Any]):
+        self.parts = [seed]
+        self.keys = list(seed["col_map"])
+        # One stitched column per distinct seed column; fields the labeler mapped to
+        # the same source column (e.g. year and loan_balance) share it
+        by_index: Dict[int, List[str]] = {}
+        for k, idx in sorted(seed["col_map"].items(), key=lambda kv: kv[1]):
+            by_index.setdefault(idx, []).append(k)
+        self.columns = list(by_index.values())
+
+    def _continues(self, prev: Dict[str, Any], nxt: Dict[str, Any]) -> bool:
+        if "year" not in prev["col_map"] or "year" not in nxt["col_map"]:
+            return False
+        shared = [k for k in self.keys if k in nxt["col_map"]]
+        if len(shared) < STITCH_MIN_SHARED_COLUMNS * len(self.keys):
+            return False
+        a, b = _years(prev), _years(nxt)
+        if not len(a) or not len(b) or b[0] != a[-1] + 1:
+            return False
+        # Same checks shape_score applies to one page, across the seam
+        seam = np.vstack([
+            np.full((1, len(shared)), np.nan),
+            np.column_stack([_column(prev, k)[-_SEAM_ROWS:] for k in shared]),
+        ])
+        seam = np.vstack([seam, np.column_stack([_column(nxt, k)[:_SEAM_ROWS] for k in shared])])
+        return shape_score(None, {k: i for i, k in enumerate(shared)}, seam) >= STITCH_MIN_SHAPE
+
+    def extend(self, candidates: List[Dict[str, Any]]) -> bool:
+        for c in candidates:
+            if self._continues(self.parts[-1], c):
+                self.parts.append(c)
+                return True
+        return False
+
+    def prepend(self, candidates: List[Dict[str, Any]]) -> bool:
+        for c in candidates:
+            if self._continues(c, self.parts[0]):
+                self.parts.insert(0, c)
+                return True
+        return False
+
+    def done(self) -> bool:
+        ages = _column(self.parts[-1], "age")
+        ages = ages[~np.isnan(ages)]
+        return bool(len(ages)) and ages[-1] >= MATURITY_AGE
+
+    def table(self) -> Dict[str, Any]:
+        if len(self.parts) == 1:
+            return self.parts[0]
+        seed = self.parts[0]
+
+        def source(c: Dict[str, Any], fields: List[str]):
+            return next((c["col_map"][k] for k in fields if k in c["col_map"]), None)
+
+        start = _body_start(seed)
+        if start > 0:
+            header = [seed["df"].iat[start - 1, source(seed, fields)] for fields in self.columns]
+        else:
+            header = [fields[0] for fields in self.columns]
+        rows = [np.array([header], dtype=object)]
+        row_pages = [seed["page"]]
+        for c in self.parts:
+            cells = c["df"].to_numpy(dtype=object)[_body_start(c):]
+            # Text extraction of a whole continuation page leaves empty spacer rows
+            cells = cells[[any(str(v).strip() for v in row) for row in cells]] if len(cells) else cells
+            cols = []
+            for fields in self.columns:
+                idx = source(c, fields)
+                cols.append(cells[:, idx] if idx is not None else np.full(len(cells), "", dtype=object))
+            rows.append(np.column_stack(cols))
+            row_pages += [c["page"]] * len(cells)
+        df = pd.DataFrame(np.vstack(rows))
+        col_map = {k: j for j, fields in enumerate(self.columns) for k in fields}
+        # Rescored as one table, so confidence reflects the whole ledger
+        t = score_table(df, seed["page"], tuple(seed["roi"]), seed["extractor"], seed["flavor"], col_map)
+        t["pages"] = [c["page"] for c in self.parts]
+        t["page_rois"] = [{"page": c["page"], "roi": list(c["roi"])} for c in self.parts]
+        t["row_pages"] = row_pages
+        # Column positions on the real pages; col_map indexes the stitched frame only
+        t["page_col_map"] = dict(seed["col_map"])
+        if "profile" in seed:
+            t["profile"] = seed["profile"]
+        return t
+
+
+def stitch_ledger(ctx: DocumentContext, tables: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Grows the best table into the neighbouring pages. Pages discovery already
+    # extracted are reused; others are extracted one at a time, only while the
+    # ledger keeps going, so pages past its end are never touched.
+    if not tables:
+        return tables
+    seed = tables[0]
+    by_page: Dict[int, List[Dict[str, Any]]] = {}
+    for t in tables:
+        by_page.setdefault(t["page"], []).append(t)
+    hinted: Dict[int, List[Dict[str, Any]]] = {}
+    # id of a rescored candidate -> id of the discovery table it came from
+    origin: Dict[int, int] = {}
+
+    def candidates(p: int, extract: bool) -> List[Dict[str, Any]]:
+        if p not in hinted:
+            if p in by_page:
+                # Discovery scored these without the ledger's layout, so a continuation
+                # page may lack columns (e.g. the year) the seed's col_map supplies
+                hinted[p] = []
+                for t in by_page[p]:
+                    c = score_table(t["df"], p, tuple(t["roi"]), t["extractor"], t["flavor"], seed["col_map"])
+                    origin[id(c)] = id(t)
+                    hinted[p].append(c)
+            elif extract:
+                hinted[p] = extract_page_tables(ctx, p, seed["col_map"])
+            else:
+                return []
+        return hinted[p]
+
+    st = LedgerStitcher(seed)
+    # Earlier pages only need extracting when the seed clearly starts mid-ledger (policy year > 1)
+    first = _years(seed)
+    look_back = bool(len(first)) and 1 < first[0] < 1900
+    p = seed["page"] - 1
+    while p >= 0 and len(st.parts) < STITCH_MAX_PAGES and st.prepend(candidates(p, look_back)):
+        p -= 1
+    p = seed["page"] + 1
+    while p < len(ctx) and len(st.parts) < STITCH_MAX_PAGES and not st.done() and st.extend(candidates(p, True)):
+        p += 1
+    if len(st.parts) == 1:
+        return tables
+    used = {origin.get(id(c), id(c)) for c in st.parts}
+    return [st.table()] + [t for t in tables if id(t) not in used]
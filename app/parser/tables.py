@@ -1,8 +1,14 @@
 import fitz
-import camelot
-from typing import List, Dict, Any, Tuple
-import tempfile, os
-from app.parser.mapping import label_columns, shape_score, reconciliation_score
+from typing import List, Dict, Any, Tuple, Iterator, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os, re, time, threading
+from itertools import islice
+from app.parser.document import DocumentContext, mupdf_lock, mupdf_released
+from app import metrics
+from app.memory import over_budget, degrade
+from app.parser.extractors import EXTRACTORS, CAMELOT_FLAVORS, camelot_tables, roi_pdf_bytes
+from app.parser.mapping import label_columns, shape_score, reconciliation_score, numeric_matrix, infer_year_column
 
 HEADER_CANDIDATES = [
     "Policy Year","Year","Yr","Age","Premium","Planned Premium","Annual Outlay",
@@ -10,64 +16,316 @@ HEADER_CANDIDATES = [
     "Net Surrender Value","Net Cash Surrender Value","Indebtedness","Policy Loan","Loan"
 ]
 
-def find_roi_and_tables(pdf_path: str) -> List[Dict[str, Any]]:
-    tables = []
-    with fitz.open(pdf_path) as doc:
-        for i, p in enumerate(doc):
-            text = p.get_text("text")
-            # basic heuristic: if any header candidate appears, try ROI from that y to bottom
-            blocks = p.get_text("blocks")
-            y_candidates = []
-            for (x0,y0,x1,y1,txt,_,_) in blocks:
-                t = " ".join((txt or "").split()).lower()
-                for term in HEADER_CANDIDATES:
-                    if term.lower() in t:
-                        y_candidates.append(y0)
-                        break
-            if not y_candidates:
-                continue
-            y_header = min(y_candidates)
-            roi = fitz.Rect(0, max(0, y_header-6), p.rect.width, p.rect.height)
-            # Save cropped page as temp single-page PDF
-            pdf_roi = fitz.open()
-            #pdf_roi.insert_pdf(doc, from_page=i, to_page=i, clip=roi)
-
-            # Copy the full page first
-            pdf_roi.insert_pdf(doc, from_page=i, to_page=i)
-            
-            # Then crop the page to ROI
-            page = pdf_roi[-1]   # last inserted page
-            page.set_cropbox(roi)   # roi is a fitz.Rect
-
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-            pdf_roi.save(tmp.name); pdf_roi.close()
+# Process pool for Camelot. 0 keeps extraction in-process (serial).
+TABLE_WORKERS = int(os.getenv("TABLE_WORKERS", "0"))
+# Max ROI pages one request may have in flight on the shared pool
+TABLE_WORKERS_PER_REQUEST = int(os.getenv("TABLE_WORKERS_PER_REQUEST", "2"))
+# Stop extracting further pages once a candidate scores at least this (0 disables).
+# header_strength is over all HEADER_CANDIDATES, so even a perfect 7-column ledger
+# tops out at 0.775; a clean ledger with the year sequence intact scores ~0.6.
+TABLE_EARLY_EXIT_SCORE = float(os.getenv("TABLE_EARLY_EXIT_SCORE", "0.6"))
+# Body rows a candidate needs to trigger the early exit or outrank fuller tables.
+# shape_score is trivially 1.0 on a couple of monotone rows, so a ledger's last-page
+# tail would otherwise score as well as (or better than) a full page.
+TABLE_MIN_ROWS = int(os.getenv("TABLE_MIN_ROWS", "10"))
+# Extraction tiers, fastest first; a page only reaches the next tier when the
+# previous one scored below FAST_TIER_MIN_SCORE. "camelot" uses the process pool.
+TABLE_EXTRACTORS = [n.strip() for n in os.getenv("TABLE_EXTRACTORS", "pymupdf,camelot").split(",") if n.strip()]
+FAST_TIER_MIN_SCORE = float(os.getenv("FAST_TIER_MIN_SCORE", "0.6"))
+# Best table score a learned profile must reach before we skip full discovery
+PROFILE_MIN_SCORE = float(os.getenv("PROFILE_MIN_SCORE", "0.5"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=TABLE_WORKERS)
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _find_roi(ctx: DocumentContext, i: int):
+    # basic heuristic: if any header candidate appears, try ROI from that y to bottom
+    y_candidates = []
+    for (x0,y0,x1,y1,txt,_,_) in ctx.blocks(i):
+        t = " ".join((txt or "").split()).lower()
+        for term in HEADER_CANDIDATES:
+            if term.lower() in t:
+                y_candidates.append(y0)
+                break
+    if not y_candidates:
+        return None
+    p = ctx.page(i)
+    y_header = min(y_candidates)
+    return fitz.Rect(0, max(0, y_header-6), p.rect.width, p.rect.height)
+
+
+_HEADER_TERMS = [term.lower() for term in HEADER_CANDIDATES]
+_NUMERIC_TOKEN_RE = re.compile(r"^\(?-?\$?[\d,]+(\.\d+)?\)?%?$")
+
+
+def _count_rulings(page: fitz.Page) -> int:
+    # Straight lines and rectangles from the page's vector drawings (lattice grids)
+    count = 0
+    for d in page.get_cdrawings():
+        for item in d.get("items", ()):
+            if item[0] in ("l", "re"):
+                count += 1
+    return count
+
+
+def rank_page(ctx: DocumentContext, i: int) -> float:
+    # Cheap pre-ranking so ledger pages reach Camelot before narrative pages
+    words = ctx.words(i)
+    if not words:
+        return 0.0
+    text = ctx.text(i).lower()
+    header_density = sum(1 for term in _HEADER_TERMS if term in text) / len(_HEADER_TERMS)
+    numeric_density = sum(1 for w in words if _NUMERIC_TOKEN_RE.match(w[4])) / len(words)
+    ruling_density = min(1.0, _count_rulings(ctx.page(i)) / 50.0)
+    return 0.4 * header_density + 0.4 * numeric_density + 0.2 * ruling_density
+
+
+# A target is (page index, ROI as a tuple, Camelot flavors, column-map hint)
+Target = Tuple[int, Tuple[float, float, float, float], Tuple[str, ...], Optional[Dict[str, int]]]
+# A Camelot job adds the single-page ROI PDF: (page, roi, pdf bytes, flavors, hint)
+Job = Tuple[int, Tuple[float, float, float, float], bytes, Tuple[str, ...], Optional[Dict[str, int]]]
+
+
+def _roi_targets(ctx: DocumentContext) -> List[Target]:
+    candidates = []
+    for window in ctx.windows():
+        for i in window:
+            roi = _find_roi(ctx, i)
+            if roi is not None:
+                candidates.append((rank_page(ctx, i), i, roi))
+        if candidates and over_budget():
+            # Rank what was seen so far rather than keep reading pages
+            degrade("discovery_truncated")
+            break
+    # Highest rank first; page order breaks ties
+    candidates.sort(key=lambda c: (-c[0], c[1]))
+    return [(i, tuple(roi), CAMELOT_FLAVORS, None) for _, i, roi in candidates]
+
+
+def _profile_targets(ctx: DocumentContext, profile: Dict[str, Any]) -> List[Target]:
+    # Jump straight to the ROIs a learned profile recorded for this layout
+    targets = []
+    for hint in profile.get("roi", []):
+        i = hint["page"]
+        if i >= len(ctx):
+            continue
+        p = ctx.page(i)
+        roi = fitz.Rect(0, max(0, hint["y0"]), p.rect.width, min(p.rect.height, hint["y1"]))
+        if roi.is_empty:
+            continue
+        flavors = (profile["flavor"],) if profile.get("flavor") in CAMELOT_FLAVORS else CAMELOT_FLAVORS
+        targets.append((i, tuple(roi), flavors, profile.get("col_map")))
+    return targets
+
+
+def _apply_col_hint(df, col_map: Dict[str, int], col_hint: Optional[Dict[str, int]]) -> Dict[str, int]:
+    # Fill columns the header matcher missed from the profile's known layout
+    if not col_hint:
+        return col_map
+    merged = dict(col_map)
+    for key, idx in col_hint.items():
+        if key not in merged and 0 <= int(idx) < df.shape[1]:
+            merged[key] = int(idx)
+    return merged
+
+
+def score_table(df, page_index: int, roi: Tuple[float, float, float, float], extractor: str, flavor: str,
+                col_hint: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    col_map = _apply_col_hint(df, label_columns(df), col_hint)
+    values = numeric_matrix(df)
+    if "year" not in col_map:
+        year = infer_year_column(values, col_map)
+        if year is not None:
+            col_map["year"] = year
+    header_strength = len(col_map) / len(HEADER_CANDIDATES)
+    shape = shape_score(df, col_map, values)
+    recon = reconciliation_score(df, col_map, values)
+    score = 0.4 * header_strength + 0.4 * shape + 0.2 * recon
+    return {
+        "page": page_index,
+        "roi": list(roi),
+        "extractor": extractor,
+        "flavor": flavor,
+        "df": df,
+        "col_map": col_map,
+        "score": score,
+        # Parsed cells, reused when the winning table becomes the ledger
+        "values": values,
+        "metrics": {
+            "header_strength": header_strength,
+            "shape_fit": shape,
+            "recon_success": recon
+        }
+    }
+
+
+def _extract_page(page_index: int, roi: Tuple[float, float, float, float], pdf_bytes: bytes,
+                  flavors: Tuple[str, ...] = CAMELOT_FLAVORS, col_hint: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    # Runs in a pool worker, so it only receives picklable inputs
+    return [score_table(df, page_index, roi, "camelot", flavor, col_hint)
+            for flavor, df in camelot_tables(pdf_bytes, flavors)]
+
+
+def _has_min_rows(t: Dict[str, Any]) -> bool:
+    return len(t["df"]) - 1 >= TABLE_MIN_ROWS
+
+
+def rank_key(t: Dict[str, Any]) -> Tuple[bool, float]:
+    # Tables with enough rows first, then by score
+    return _has_min_rows(t), t["score"]
+
+
+def _clears_early_exit(page_tables: List[Dict[str, Any]]) -> bool:
+    return TABLE_EARLY_EXIT_SCORE > 0 and any(
+        t["score"] >= TABLE_EARLY_EXIT_SCORE and _has_min_rows(t) for t in page_tables)
+
+
+def _extract_serial(jobs: Iterator[Job]) -> List[List[Dict[str, Any]]]:
+    per_page = []
+    for job in jobs:
+        per_page.append(_extract_page(*job))
+        if _clears_early_exit(per_page[-1]):
+            break
+    return per_page
+
+
+def _extract_parallel(jobs: Iterator[Job]) -> List[List[Dict[str, Any]]]:
+    pool = _get_pool()
+    limit = max(1, min(TABLE_WORKERS, TABLE_WORKERS_PER_REQUEST))
+    per_page = []
+    jobs = iter(jobs)
+    while True:
+        # Windows of at most `limit` pages of this request on the shared pool;
+        # a whole window finishes before the early-exit check so results stay deterministic
+        window = list(islice(jobs, limit))
+        if not window:
+            break
+        futures = [pool.submit(_extract_page, *job) for job in window]
+        results = [f.result() for f in futures]
+        per_page.extend(results)
+        if any(_clears_early_exit(r) for r in results):
+            break
+    # Merged in job order so the final stable sort matches serial mode
+    return per_page
+
+
+def _camelot_tier(ctx: DocumentContext, targets: List[Target]) -> List[List[Dict[str, Any]]]:
+    # Camelot itself never touches fitz, so MuPDF is free for other requests
+    # except while each ROI page is cut out
+    def jobs() -> Iterator[Job]:
+        for i, roi, flavors, col_hint in targets:
+            with mupdf_lock():
+                pdf_bytes = roi_pdf_bytes(ctx, i, fitz.Rect(roi))
+            yield i, roi, pdf_bytes, flavors, col_hint
+    with mupdf_released():
+        if TABLE_WORKERS > 0:
             try:
-                # try lattice then stream
-                for flavor in ("lattice","stream"):
-                    try:
-                        ts = camelot.read_pdf(tmp.name, flavor=flavor, pages="1")
-                        for t in ts:
-                            col_map = label_columns(t.df)
-                            header_strength = len(col_map) / len(HEADER_CANDIDATES)
-                            shape = shape_score(t.df, col_map)
-                            recon = reconciliation_score(t.df, col_map)
-                            score = 0.4 * header_strength + 0.4 * shape + 0.2 * recon
-                            tables.append({
-                                "page": i,
-                                "flavor": flavor,
-                                "df": t.df,
-                                "col_map": col_map,
-                                "score": score,
-                                "metrics": {
-                                    "header_strength": header_strength,
-                                    "shape_fit": shape,
-                                    "recon_success": recon
-                                }
-                            })
-                        if ts.n > 0:
-                            break
-                    except Exception:
-                        continue
-            finally:
-                os.unlink(tmp.name)
-    return sorted(tables, key=lambda x: x["score"], reverse=True)
+                return _extract_parallel(jobs())
+            except BrokenProcessPool:
+                _reset_pool()
+        return _extract_serial(jobs())
+
+
+def _in_process_tier(name: str, ctx: DocumentContext, targets: List[Target]) -> List[List[Dict[str, Any]]]:
+    extractor = EXTRACTORS[name]
+    per_page = []
+    for i, roi, _, col_hint in targets:
+        try:
+            found = extractor.extract(ctx, i, fitz.Rect(roi))
+        except Exception:
+            found = []
+        per_page.append([score_table(df, i, roi, name, flavor, col_hint) for flavor, df in found])
+        if _clears_early_exit(per_page[-1]):
+            break
+    return per_page
+
+
+# Per-tier pages processed, time spent and how often the tier produced the winning table
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+def _record(name: str, **delta):
+    with _stats_lock:
+        entry = _stats.setdefault(name, {"pages": 0, "seconds": 0.0, "wins": 0})
+        for k, v in delta.items():
+            entry[k] += v
+
+def extractor_stats() -> Dict[str, Dict[str, float]]:
+    with _stats_lock:
+        total_wins = sum(e["wins"] for e in _stats.values())
+        return {name: dict(e, win_rate=(e["wins"] / total_wins if total_wins else 0.0)) for name, e in _stats.items()}
+
+
+def _run_tiers(ctx: DocumentContext, targets: List[Target]) -> List[Dict[str, Any]]:
+    per_page = []
+    pending = targets
+    for name in TABLE_EXTRACTORS:
+        if not pending:
+            break
+        if name == "camelot" and TABLE_WORKERS <= 0 and any(per_page) and over_budget():
+            # In-process Camelot is the heaviest tier; keep the faster tiers' tables
+            degrade("camelot_skipped")
+            break
+        start = time.perf_counter()
+        with metrics.stage(f"tables.{name}"):
+            if name == "camelot":
+                results = _camelot_tier(ctx, pending)
+            else:
+                results = _in_process_tier(name, ctx, pending)
+        _record(name, pages=len(results), seconds=time.perf_counter() - start)
+        per_page.extend(results)
+        if any(_clears_early_exit(r) for r in results):
+            break
+        # Pages this tier handled well enough never reach the slower tiers
+        pending = [tgt for tgt, r in zip(pending, results)
+                   if not any(t["score"] >= FAST_TIER_MIN_SCORE for t in r)]
+    tables = [t for page_tables in per_page for t in page_tables]
+    return sorted(tables, key=rank_key, reverse=True)
+
+
+def _record_win(tables: List[Dict[str, Any]]):
+    # Only the discovery result counts, not the per-page runs made while stitching
+    if tables:
+        _record(tables[0]["extractor"], wins=1)
+        metrics.table_wins_total.inc(extractor=tables[0]["extractor"])
+
+
+def extract_page_tables(ctx: DocumentContext, page_index: int,
+                        col_hint: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    # Candidates for one page on demand (e.g. the next page of a ledger being stitched)
+    roi = _find_roi(ctx, page_index)
+    if roi is None:
+        if not col_hint:
+            return []
+        # Continuation pages often drop the header; the hint supplies the columns
+        roi = ctx.page(page_index).rect
+    return _run_tiers(ctx, [(page_index, tuple(roi), CAMELOT_FLAVORS, col_hint)])
+
+
+def find_roi_and_tables(ctx: DocumentContext, profile: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    if profile is not None:
+        tables = _run_tiers(ctx, _profile_targets(ctx, profile))
+        if tables and tables[0]["score"] >= PROFILE_MIN_SCORE:
+            for t in tables:
+                t["profile"] = profile["id"]
+            _record_win(tables)
+            return tables
+        # Profile result scored low: the layout changed, fall back to full discovery
+    tables = _run_tiers(ctx, _roi_targets(ctx))
+    _record_win(tables)
+    return tables
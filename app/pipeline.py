@@ -0,0 +1,306 @@
+import base64, asyncio
+from fastapi import HTTPException
+from typing import List, Dict, Any, Tuple, AsyncIterator, Optional, Union
+from dotenv import load_dotenv
+from app.models import AnalyzeResponse, Fields, Series, Verifications, ProofSnip
+from app.concurrency import run_blocking, run_io
+from app.storage import get_uploader
+from app.cache import get_result_cache, digest_key
+from app import metrics
+from app.memory import start_budget, current_budget, over_budget, degrade
+from app.uploads import Upload
+from app.decision import CONFIDENCE_THRESHOLD, decide
+from app.parser.document import DocumentContext, mupdf_lock
+from app.parser.preflight import ocr_if_needed, normalize_orientation
+from app.parser.tables import find_roi_and_tables
+from app.parser.stitch import stitch_ledger
+from app.parser.profiles import get_profile_store, fingerprint
+from app.parser.ledger import Ledger
+from app.parser.confidence import compute_confidence
+from app.parser.pii import redact_pdf_boxes, find_pii_coords, REDACT_LEDGER_ONLY
+from app.parser.snips import find_snip_coords, render_snips as encode_snips, SNIP_CONTENT_TYPE, SNIP_EXTENSION
+load_dotenv()
+
+
+# --- CPU-bound stages (run on the bounded pipeline executor) ---
+# Each holds the MuPDF lock for its run; see app/parser/document.py
+
+def open_upload(upload: Upload) -> DocumentContext:
+    # Spooled uploads are opened from disk; PyMuPDF then reads pages on demand
+    if upload.path is not None:
+        ctx = DocumentContext.open(upload.path)
+    else:
+        ctx = DocumentContext.from_bytes(upload.data)
+    ctx.digest = upload.digest
+    return ctx
+
+
+def prepare_document(upload: Upload) -> DocumentContext:
+    with mupdf_lock():
+        with metrics.stage("open"):
+            ctx = open_upload(upload)
+        metrics.pages_total.inc(len(ctx), kind="all")
+        metrics.count("pages", len(ctx))
+        try:
+            with metrics.stage("preflight"):
+                ctx = ocr_if_needed(ctx)
+                return normalize_orientation(ctx)
+        except Exception:
+            ctx.close()
+            raise
+
+
+def discover_tables(ctx: DocumentContext) -> Tuple[List[str], List[Dict[str, Any]]]:
+    with mupdf_lock():
+        with metrics.stage("profile_match"):
+            tokens = fingerprint(ctx)
+            profile = get_profile_store().match(tokens)
+        metrics.profiles_total.inc(result="hit" if profile else "miss")
+        with metrics.stage("tables"):
+            tables = find_roi_and_tables(ctx, profile)
+        metrics.candidate_tables.observe(len(tables))
+        metrics.count("candidate_tables", len(tables))
+        with metrics.stage("stitch"):
+            # Ledgers split over several pages become one table
+            tables = stitch_ledger(ctx, tables)
+    if tables:
+        metrics.count("ledger_pages", len(tables[0].get("pages", [tables[0]["page"]])))
+    return tokens, tables
+
+
+def build_series(t: Dict[str, Any]) -> Tuple[Ledger, Series, Verifications, float]:
+    df = t["df"]
+    metrics = t["metrics"]
+
+    # Columnar ledger from the labeled columns; the response lists are derived from it
+    ledger = Ledger.from_table(t)
+    series = ledger.to_series()
+
+    # Simple verification metric placeholders
+    verif = Verifications(
+        net_sv_identity_rmse=None,
+        year_sequence_ok=True,
+        rows_parsed_pct=float(len(df) - 1) / float(len(df)) if len(df) > 1 else 0.0
+    )
+    metrics["rows_parsed"] = verif.rows_parsed_pct
+    return ledger, series, verif, compute_confidence(metrics)
+
+
+def render_snips(ctx: DocumentContext, t: Dict[str, Any], ledger: Ledger) -> List[Tuple[Dict[str, Any], bytes]]:
+    # Rendered before redaction edits the shared document
+    if over_budget():
+        # Proof snips are the optional part of the response; pixmaps are the big allocation
+        degrade("snips_skipped")
+        return []
+    with mupdf_lock(), metrics.stage("snips"):
+        coords = find_snip_coords(ctx, t["df"], t["page"], t["roi"], ledger, t.get("row_pages"))
+        return list(zip(coords, encode_snips(ctx, coords)))
+
+
+def redact_document(ctx: DocumentContext, ledger_pages: Optional[List[int]] = None) -> bytes:
+    # With REDACT_LEDGER_ONLY only the ledger pages are scanned, redacted and uploaded
+    pages = ledger_pages if REDACT_LEDGER_ONLY else None
+    if pages is None and over_budget():
+        # Still redacted, but only the ledger pages are scanned and uploaded
+        degrade("redact_ledger_only")
+        pages = ledger_pages
+    with mupdf_lock():
+        with metrics.stage("pii"):
+            pii_coords = find_pii_coords(ctx, pages)
+        with metrics.stage("redact"):
+            return redact_pdf_boxes(ctx, pii_coords, pages)
+
+
+def close_document(ctx: DocumentContext):
+    with mupdf_lock():
+        ctx.close()
+
+
+class DocumentStages:
+    """Runs one request's document stages on the pipeline executor, one at a time.
+
+    A cancelled await (client disconnect, job runner stop) leaves the stage
+    running on its thread; aclose() then closes the document once that stage
+    finishes instead of closing it underneath.
+    """
+
+    def __init__(self):
+        self.ctx: Optional[DocumentContext] = None
+        self._pending: Optional[asyncio.Future] = None
+
+    async def run(self, fn, *args):
+        self._pending = asyncio.ensure_future(run_blocking(fn, *args))
+        return await asyncio.shield(self._pending)
+
+    async def open(self, upload: Upload) -> DocumentContext:
+        self.ctx = await self.run(prepare_document, upload)
+        return self.ctx
+
+    def _close_after(self, fut: asyncio.Future):
+        ctx = self.ctx
+        if not fut.cancelled() and fut.exception() is None and isinstance(fut.result(), DocumentContext):
+            # Cancelled while opening: the stage's result is the document to close
+            ctx = fut.result()
+        if ctx is not None:
+            asyncio.ensure_future(run_blocking(close_document, ctx))
+
+    async def aclose(self):
+        if self._pending is not None and not self._pending.done():
+            self._pending.add_done_callback(self._close_after)
+        elif self.ctx is not None:
+            await run_blocking(close_document, self.ctx)
+
+
+# --- Orchestration ---
+
+def to_proof_snip(s: Dict[str, Any], png: bytes, upload: Dict[str, Any]) -> ProofSnip:
+    # Base64 only as the fallback when the upload failed
+    image_data = upload["url"] if upload["url"] else base64.b64encode(png).decode("ascii")
+    return ProofSnip(label=s["label"], page=s["page"], image_b64=image_data)
+
+
+async def iter_analysis(upload: Upload) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    # Yields (stage, payload) as each stage finishes; the last event is "result"
+    # with the AnalyzeResponse dict and the final client-facing content
+    stages = DocumentStages()
+    try:
+        ctx = await stages.open(upload)
+        yield "preflight", {"pages": len(ctx), "ocr_pages": ctx.ocr_pages}
+        tokens, tables = await stages.run(discover_tables, ctx)
+        if not tables:
+            # Return minimal response with low confidence
+            resp = AnalyzeResponse(
+                decision_ready=False,
+                needs_manual_review=True,
+                confidence_overall=0.0,
+                notes=["No tables detected."]
+            )
+            resp_dict = resp.model_dump(mode="json")
+            yield "result", {"response": resp_dict, "content": resp_dict}
+            return
+
+        # Take best table
+        t = tables[0]
+        with metrics.stage("series"):
+            ledger, series, verif, conf = build_series(t)
+        yield "table", {
+            "page": t["page"],
+            "pages": t.get("pages", [t["page"]]),
+            "flavor": t["flavor"],
+            "score": t["score"],
+            "columns": list(t["col_map"].keys()),
+            "series": series.model_dump(),
+            "ledger": ledger.to_columns(),
+        }
+        decision_ready = conf >= CONFIDENCE_THRESHOLD
+        needs_review = not decision_ready
+        yield "confidence", {
+            "confidence_overall": conf,
+            "decision_ready": decision_ready,
+            "needs_manual_review": needs_review,
+            "verifications": verif.model_dump(),
+        }
+        if decision_ready:
+            # Remember this layout so the next upload skips ROI discovery
+            await run_io(get_profile_store().learn, tokens, t)
+
+        snips = await stages.run(render_snips, ctx, t, ledger)
+        redacted_pdf = await stages.run(redact_document, ctx, t.get("pages", [t["page"]]))
+    finally:
+        await stages.aclose()
+
+    # Snips and the redacted PDF upload concurrently over one pooled client
+    uploader = get_uploader()
+    snip_uploads = asyncio.ensure_future(uploader.upload_many([(img, SNIP_CONTENT_TYPE, SNIP_EXTENSION) for _, img in snips]))
+    try:
+        pdf_upload = await run_io(uploader.upload, redacted_pdf, 'application/pdf', '.pdf')
+        s3_url = pdf_upload["url"]
+        if not s3_url:
+            raise HTTPException(status_code=500, detail="Failed to upload file to S3")
+        yield "redacted_pdf", {"url": s3_url}
+        uploads = await snip_uploads
+    finally:
+        if not snip_uploads.done():
+            snip_uploads.cancel()
+    proof_snips = [to_proof_snip(s, png, up) for (s, png), up in zip(snips, uploads)]
+    yield "snips", {"proof_snips": [p.model_dump() for p in proof_snips]}
+
+    resp = AnalyzeResponse(
+        decision_ready=decision_ready,
+        needs_manual_review=needs_review,
+        confidence_overall=conf,
+        fields=Fields(
+            crediting_rate=None,
+            death_benefit_pattern=None,
+            face_amount_structure=None,
+            loan_balance_today=None
+        ),
+        series=series,
+        verifications=verif,
+        proof_snips=proof_snips,
+        redacted_pdf_b64=s3_url,
+        notes=[f"Columns found: {list(t['col_map'].keys())}"]
+    )
+    budget = current_budget()
+    if budget is not None and budget.degraded:
+        resp.notes.append(f"Degraded to stay within the memory budget: {', '.join(budget.degraded)}")
+
+    decision = await decide(resp)
+
+    final_response_content = {
+        "analysis": decision["analysis"],
+        "decision_source": decision["source"],
+        "redacted_pdf_b64": s3_url
+    }
+    if budget is not None and budget.degraded:
+        final_response_content["degraded"] = list(budget.degraded)
+    yield "result", {"response": resp.model_dump(mode="json"), "content": final_response_content}
+
+
+async def iter_upload(data: Union[bytes, Upload], timings: bool = False) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    # Same bytes + same pipeline/config version -> cached result, no S3 or OpenAI.
+    # With timings=True a "timings" event with the per-stage breakdown and the
+    # request's RSS budget report precedes "result".
+    upload = data if isinstance(data, Upload) else Upload.from_bytes(data)
+    trace = metrics.start_trace()
+    budget = start_budget()
+    key = ""
+    try:
+        cache = get_result_cache()
+        with metrics.stage("cache_lookup"):
+            key = digest_key(upload.digest)
+            cached = await run_io(cache.get, key)
+        metrics.cache_requests_total.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield "cached", {"key": key}
+            if timings:
+                yield "timings", dict(trace.summary(), memory=budget.report())
+            yield "result", cached
+            return
+
+        async for stage, payload in iter_analysis(upload):
+            if stage == "result":
+                # Fallback decisions (transient LLM failure) and degraded results are not cached
+                content = payload["content"]
+                if content.get("decision_source") != "fallback" and not content.get("degraded"):
+                    await run_io(cache.set, key, payload)
+                if timings:
+                    yield "timings", dict(trace.summary(), memory=budget.report())
+            yield stage, payload
+    finally:
+        budget.finish()
+        trace.finish(key)
+
+
+async def analyze_upload(data: Union[bytes, Upload], timings: bool = False) -> Dict[str, Any]:
+    # Drains the generator so the trace is finished before returning
+    content, breakdown = None, None
+    async for stage, payload in iter_upload(data, timings):
+        if stage == "timings":
+            breakdown = payload
+        elif stage == "result":
+            content = payload["content"]
+    if breakdown is not None:
+        # Copy so the breakdown never ends up in the cached result
+        content = dict(content, timings=breakdown)
+    return content
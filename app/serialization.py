@@ -0,0 +1,60 @@
+from typing import Any, Optional
+import numpy as np
+import orjson
+from fastapi import HTTPException, Response
+
+# MessagePack is optional: only bulk consumers that ask for it need the package
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any):
+    # Pydantic models and numpy scalars/arrays that orjson doesn't handle natively
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    return orjson.dumps(obj, default=_default, option=_JSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+
+
+def loads(data) -> Any:
+    return orjson.loads(data)
+
+
+def dumps_msgpack(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    return bool(accept) and MSGPACK_MEDIA_TYPE in accept and msgpack is not None
+
+
+def check_acceptable(accept: Optional[str]):
+    # Asked for MessagePack only, without the package installed: refuse up front instead
+    # of running the pipeline and answering in a type the client said it can't read
+    if not accept or MSGPACK_MEDIA_TYPE not in accept or msgpack is not None:
+        return
+    types = [part.split(";")[0].strip() for part in accept.split(",")]
+    if not any(t in (JSON_MEDIA_TYPE, "application/*", "*/*") for t in types):
+        raise HTTPException(status_code=406, detail="MessagePack responses need the msgpack package; "
+                                                    "accept application/json instead.")
+
+
+def render(obj: Any, accept: Optional[str] = None, status_code: int = 200) -> Response:
+    # The one place a response body is encoded: JSON via orjson, or MessagePack on request
+    if wants_msgpack(accept):
+        return Response(dumps_msgpack(obj), status_code=status_code, media_type=MSGPACK_MEDIA_TYPE)
+    return Response(dumps(obj), status_code=status_code, media_type=JSON_MEDIA_TYPE)
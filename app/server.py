@@ -0,0 +1,116 @@
+# Production entry point: python -m app.server
+#
+# Gunicorn master with uvicorn workers. The app and its heavy models (spaCy/Presidio,
+# pandas, Camelot, OpenCV) load once in the master before forking, so workers share
+# those pages copy-on-write. Workers are recycled after SERVER_MAX_REQUESTS requests or
+# once their RSS passes WORKER_MAX_RSS_MB, which also bounds leaks in Camelot/Ghostscript.
+import os, gc, time, signal, logging, threading
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+load_dotenv()
+
+# The master requeues interrupted job items once at start. Workers requeue their own
+# items when recycled and only reclaim items whose owning worker died.
+os.environ["JOB_RESUME_ON_START"] = "false"
+
+from app.memory import rss_bytes
+
+logger = logging.getLogger(__name__)
+
+SERVER_BIND = os.getenv("SERVER_BIND", "0.0.0.0:8000")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Load the app and warm models in the master before forking
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "true").lower() == "true"
+# Recycle a worker after this many requests (0 disables); jitter keeps them from restarting together
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "500"))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "50"))
+SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "120"))
+# Time a recycled worker gets to finish its in-flight requests
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "60"))
+# Recycle a worker once its RSS passes this (0 disables), checked every WORKER_RSS_CHECK_SECONDS
+WORKER_MAX_RSS_MB = float(os.getenv("WORKER_MAX_RSS_MB", "2048"))
+WORKER_RSS_CHECK_SECONDS = float(os.getenv("WORKER_RSS_CHECK_SECONDS", "10"))
+
+
+def on_starting(server):
+    # Master only, before any worker exists. Own connection, closed before forking:
+    # SQLite handles must not cross a fork.
+    from app.jobs import JobStore
+    store = JobStore()
+    resumed = store.resume()
+    store.close()
+    if resumed:
+        logger.info("Resumed %d job items", resumed)
+
+
+def preload():
+    # Runs in the master: everything imported or built here is inherited by the workers
+    from app.main import api, PII_WARM_UP
+    from app.parser.pii import warm_up
+    if PII_WARM_UP:
+        start = time.perf_counter()
+        warm_up()
+        logger.info("Models warmed up in the master in %.1fs", time.perf_counter() - start)
+    # Move what is loaded so far out of the collector's reach: a GC pass in a worker
+    # would otherwise write to (and so copy) every shared page
+    gc.collect()
+    gc.freeze()
+    return api
+
+
+def _watch_rss(worker):
+    limit = WORKER_MAX_RSS_MB * 1024 * 1024
+    while True:
+        time.sleep(WORKER_RSS_CHECK_SECONDS)
+        rss = rss_bytes()
+        if rss > limit:
+            # SIGTERM is a graceful stop for a uvicorn worker; the master forks a fresh one
+            logger.warning("Worker %d RSS %.0f MB is over %.0f MB, recycling",
+                           worker.pid, rss / (1024 * 1024), WORKER_MAX_RSS_MB)
+            os.kill(worker.pid, signal.SIGTERM)
+            return
+
+
+def post_worker_init(worker):
+    if WORKER_MAX_RSS_MB > 0:
+        threading.Thread(target=_watch_rss, args=(worker,), name="rss-watchdog", daemon=True).start()
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if SERVER_PRELOAD:
+            return preload()
+        from app.main import api
+        return api
+
+
+def options() -> dict:
+    return {
+        "bind": SERVER_BIND,
+        "workers": WEB_CONCURRENCY,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": SERVER_PRELOAD,
+        "max_requests": SERVER_MAX_REQUESTS,
+        "max_requests_jitter": SERVER_MAX_REQUESTS_JITTER,
+        "timeout": SERVER_TIMEOUT,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "on_starting": on_starting,
+        "post_worker_init": post_worker_init,
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    Server(options()).run()
+
+
+if __name__ == "__main__":
+    main()
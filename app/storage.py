@@ -0,0 +1,118 @@
+import os, io, time, uuid, asyncio, logging
+import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from typing import Any, Dict, List, Optional, Tuple
+from app.concurrency import run_io
+from app import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+AWS_REGION = os.getenv("AWS_REGION")
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+# Only needed for S3-compatible stand-ins (e.g. a local moto server)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+
+if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME]):
+    raise ValueError("AWS S3 environment variables not set. Please check your .env file.")
+
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))
+S3_UPLOAD_ATTEMPTS = int(os.getenv("S3_UPLOAD_ATTEMPTS", "3"))
+S3_RETRY_BACKOFF_SECONDS = float(os.getenv("S3_RETRY_BACKOFF_SECONDS", "0.25"))
+
+# One upload to S3: (body, content type, file extension)
+UploadItem = Tuple[bytes, str, str]
+
+
+class S3Uploader:
+    """Shared, pooled S3 client that uploads a request's files concurrently."""
+
+    def __init__(self, bucket: str = S3_BUCKET_NAME, region: str = AWS_REGION, client=None):
+        self.bucket = bucket
+        self.region = region
+        self.client = client or boto3.client(
+            's3',
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+            region_name=region,
+            endpoint_url=S3_ENDPOINT_URL,
+            config=Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                # Retries are ours (below) so they also cover multipart uploads
+                retries={"total_max_attempts": 1},
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MULTIPART_CONCURRENCY,
+        )
+
+    def url_for(self, key: str) -> str:
+        if S3_ENDPOINT_URL:
+            return f"{S3_ENDPOINT_URL.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        if len(data) >= S3_MULTIPART_THRESHOLD:
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket, key,
+                                       ExtraArgs={"ContentType": content_type}, Config=self.transfer_config)
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def upload(self, data: bytes, content_type: str = 'application/pdf', extension: str = '.pdf') -> Dict[str, Any]:
+        # Generate random filename
+        key = f"extractor/{uuid.uuid4()}{extension}"
+        start = time.perf_counter()
+        error: Optional[Exception] = None
+        attempt = 0
+        with metrics.stage("s3_upload"):
+            for attempt in range(1, S3_UPLOAD_ATTEMPTS + 1):
+                try:
+                    self._put(key, data, content_type)
+                    error = None
+                    break
+                except (BotoCoreError, ClientError, S3UploadFailedError) as e:
+                    error = e
+                    if attempt < S3_UPLOAD_ATTEMPTS:
+                        time.sleep(S3_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+        metrics.uploads_total.inc(content_type=content_type, outcome="error" if error else "ok")
+        if not error:
+            metrics.upload_bytes_total.inc(len(data), content_type=content_type)
+            metrics.count("upload_bytes", len(data))
+        result = {
+            "key": key,
+            "url": None if error else self.url_for(key),
+            "bytes": len(data),
+            "attempts": attempt,
+            "seconds": time.perf_counter() - start,
+            "error": str(error) if error else None,
+        }
+        if error:
+            logger.error("Error uploading file to S3: %s", error)
+        else:
+            logger.info("Uploaded %s (%d bytes) in %.3fs", key, len(data), result["seconds"])
+        return result
+
+    async def upload_many(self, items: List[UploadItem]) -> List[Dict[str, Any]]:
+        # All of a request's uploads at once, over the shared connection pool
+        return list(await asyncio.gather(*(run_io(self.upload, *item) for item in items)))
+
+
+_uploader = None
+
+def get_uploader() -> S3Uploader:
+    global _uploader
+    if _uploader is None:
+        _uploader = S3Uploader()
+    return _uploader
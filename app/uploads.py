@@ -0,0 +1,83 @@
+import os, hashlib, tempfile
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+from app.concurrency import run_io
+
+# Uploads past this size get a 413
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Uploads larger than this are spooled to a temp file and opened by PyMuPDF from disk
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(32 * 1024 * 1024)))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or None
+
+
+class Upload:
+    """An uploaded PDF: bytes when small, otherwise a file on disk, plus its sha256."""
+
+    def __init__(self, data: Optional[bytes] = None, path: Optional[str] = None,
+                 size: int = 0, digest: str = "", owned: bool = False):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.digest = digest
+        # Temp files we created are removed by close(); job blobs are not
+        self.owned = owned
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Upload":
+        return cls(data=data, size=len(data), digest=hashlib.sha256(data).hexdigest())
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self.owned and self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+def check_content_length(value: Optional[str], max_bytes: int = MAX_UPLOAD_BYTES):
+    # Starlette has already spooled the multipart body to its own temp file by now;
+    # this only saves copying an oversized one. The chunked copy enforces the limit.
+    if max_bytes > 0 and value and value.isdigit() and int(value) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes.")
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Upload:
+    # Reads the body in chunks, hashing as it goes; at most UPLOAD_SPOOL_BYTES stay in memory
+    h = hashlib.sha256()
+    buf = bytearray()
+    f = None
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes > 0 and size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes.")
+            h.update(chunk)
+            if f is None and len(buf) + len(chunk) <= UPLOAD_SPOOL_BYTES:
+                buf += chunk
+                continue
+            if f is None:
+                f = tempfile.NamedTemporaryFile(suffix=".pdf", dir=UPLOAD_DIR, delete=False)
+                await run_io(f.write, bytes(buf))
+                buf = bytearray()
+            await run_io(f.write, chunk)
+    except BaseException:
+        if f is not None:
+            f.close()
+            os.unlink(f.name)
+        raise
+    if f is None:
+        return Upload(data=bytes(buf), size=size, digest=h.hexdigest())
+    f.close()
+    return Upload(path=f.name, size=size, digest=h.hexdigest(), owned=True)
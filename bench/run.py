@@ -0,0 +1,230 @@
+"""Pipeline benchmark over synthetic ledgers, with S3 and OpenAI stubbed out.
+
+    python -m bench.run                          # all scenarios, compare with bench/baseline.json
+    python -m bench.run --scenarios scanned --repeat 10 --concurrency 2
+    python -m bench.run --update-baseline        # record this machine's numbers as the baseline
+
+No baseline is committed: the numbers only mean something on the machine that
+recorded them. CI keeps bench/baseline.json as a build artifact instead: the
+main branch build runs --update-baseline on the benchmark runner and saves the
+file; other builds restore it from the latest main build, then run
+`python -m bench.run` and fail on the non-zero exit.
+
+Each scenario runs in its own interpreter so peak RSS is per scenario.
+Results are written as JSON; with a baseline present, regressions in
+throughput, p95 latency or peak RSS beyond --tolerance exit non-zero.
+"""
+import os, sys, json, math, time, asyncio, argparse, platform, resource, subprocess, tempfile
+from typing import Any, Dict, List
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "small-lattice": {"pages": 4, "years": 20, "style": "lattice"},
+    "small-stream": {"pages": 4, "years": 20, "style": "stream"},
+    "long-ledger": {"pages": 12, "years": 100, "style": "lattice"},
+    "scanned": {"pages": 4, "years": 20, "style": "lattice", "scanned_pages": 2},
+    "pii-heavy": {"pages": 10, "years": 30, "style": "stream", "pii_density": 0.9},
+    "large": {"pages": 40, "years": 60, "style": "stream", "pii_density": 0.3},
+}
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(values: List[float], q: float) -> float:
+    # Nearest-rank percentile; fine for the handful of samples a benchmark takes
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(q / 100.0 * len(s)) - 1))
+    return s[k]
+
+
+# --- Stubs (child process only) ---
+
+class StubUploader:
+    async def upload_many(self, items):
+        return [self.upload(*item) for item in items]
+
+    def upload(self, data, content_type="application/pdf", extension=".pdf"):
+        return {"key": f"bench/{len(data)}{extension}", "url": f"https://bench.invalid/{len(data)}{extension}",
+                "bytes": len(data), "attempts": 1, "seconds": 0.0, "error": None}
+
+
+class StubOpenAI:
+    """Just enough of AsyncOpenAI for app.decision, with a fixed fake latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = type("Message", (), {"content": "Needs-Review (benchmark stub)"})
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+def _child(name: str, args) -> Dict[str, Any]:
+    # Settings must be in place before app modules read them at import
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("S3_BUCKET_NAME", "bench")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["RESULT_CACHE_BACKEND"] = "none"
+    os.environ["OCR_CACHE_DIR"] = ""
+    os.environ["PROFILE_DIR"] = tempfile.mkdtemp(prefix="bench-profiles-")
+
+    from bench.synth import make_ledger_pdf
+    import app.pipeline as pipeline
+    import app.decision as decision
+    pipeline.get_uploader = StubUploader
+    decision._client = StubOpenAI(args.llm_latency)
+
+    data = make_ledger_pdf(seed=args.seed, **SCENARIOS[name])
+
+    async def run() -> Dict[str, Any]:
+        # Warm-up runs load spaCy/Presidio and pay first-call costs; they are not measured.
+        # Synthetic ledgers score below CONFIDENCE_THRESHOLD, so no layout profile is learned
+        # and every measured run does full table discovery.
+        for _ in range(args.warmup):
+            await pipeline.analyze_upload(data)
+        sem = asyncio.Semaphore(args.concurrency)
+        latencies: List[float] = []
+        stages: Dict[str, List[float]] = {}
+        counts: Dict[str, float] = {}
+
+        async def one():
+            async with sem:
+                start = time.perf_counter()
+                content = await pipeline.analyze_upload(data, timings=True)
+                latencies.append(time.perf_counter() - start)
+                for stage, secs in content["timings"]["stages"].items():
+                    stages.setdefault(stage, []).append(secs)
+                counts.update(content["timings"]["counts"])
+
+        wall = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.repeat)))
+        wall = time.perf_counter() - wall
+        return {
+            "params": SCENARIOS[name],
+            "pdf_bytes": len(data),
+            "runs": args.repeat,
+            "throughput_docs_per_s": args.repeat / wall if wall else 0.0,
+            "latency_p50_s": percentile(latencies, 50),
+            "latency_p95_s": percentile(latencies, 95),
+            "latency_max_s": max(latencies),
+            "stages_p50_s": {k: percentile(v, 50) for k, v in sorted(stages.items())},
+            "stages_p95_s": {k: percentile(v, 95) for k, v in sorted(stages.items())},
+            "counts": counts,
+            # ru_maxrss is KiB on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        }
+
+    return asyncio.run(run())
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for name, cur in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or "error" in cur or "error" in base:
+            continue
+        if cur["throughput_docs_per_s"] < base["throughput_docs_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {cur['throughput_docs_per_s']:.2f} docs/s "
+                               f"< baseline {base['throughput_docs_per_s']:.2f}")
+        for key, unit in (("latency_p95_s", "s"), ("peak_rss_mb", "MB")):
+            if cur[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {cur[key]:.2f}{unit} > baseline {base[key]:.2f}{unit}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the analyze pipeline on synthetic ledgers.")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--llm-latency", type=float, default=0.0, help="seconds the stubbed OpenAI call sleeps")
+    ap.add_argument("--out", default=None, help="results file (default bench/results/<time>.json)")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--child-out", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        with open(args.child_out, "w") as f:
+            json.dump(_child(args.child, args), f)
+        return
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results: Dict[str, Any] = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} cpus={os.cpu_count()}",
+        "settings": {k: v for k, v in vars(args).items() if k not in ("child", "child_out")},
+        "scenarios": {},
+    }
+    for name in names:
+        fd, out = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        cmd = [sys.executable, "-m", "bench.run", "--child", name, "--child-out", out,
+               "--repeat", str(args.repeat), "--warmup", str(args.warmup), "--concurrency", str(args.concurrency),
+               "--seed", str(args.seed), "--llm-latency", str(args.llm_latency)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        try:
+            if proc.returncode != 0:
+                results["scenarios"][name] = {"error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+            else:
+                with open(out) as f:
+                    results["scenarios"][name] = json.load(f)
+        finally:
+            os.unlink(out)
+        r = results["scenarios"][name]
+        if "error" in r:
+            print(f"{name:14s} FAILED: {r['error']}")
+        else:
+            print(f"{name:14s} {r['throughput_docs_per_s']:7.2f} docs/s  p50 {r['latency_p50_s']:6.2f}s  "
+                  f"p95 {r['latency_p95_s']:6.2f}s  rss {r['peak_rss_mb']:7.1f}MB")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results: {out}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline updated: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("no baseline yet; run with --update-baseline on a reference machine to record one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
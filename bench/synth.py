@@ -0,0 +1,167 @@
+"""Synthetic in-force illustration PDFs for benchmarking.
+
+    python -m bench.synth --out golden_set/synthetic --pages 8 --years 40 --style stream
+
+Everything is drawn with PyMuPDF from a seeded RNG, so the same arguments
+always produce the same document.
+"""
+import os, argparse, random
+import fitz
+from typing import List, Tuple
+
+HEADERS = ["Policy Year", "Age", "Planned Premium", "Cash Value", "Surrender Charge",
+           "Net Surrender Value", "Death Benefit"]
+COL_WIDTHS = [52, 36, 78, 78, 78, 90, 78]
+
+CARRIERS = ["Northwind Life", "Granite Mutual", "Bluewater Assurance", "Summit National Life"]
+FIRST_NAMES = ["James", "Maria", "Robert", "Linda", "Michael", "Patricia", "David", "Jennifer"]
+LAST_NAMES = ["Johnson", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Wilson", "Anderson"]
+FILLER = ("This illustration is not a contract and assumes the current crediting rate remains "
+          "unchanged for all years shown. Values are not guaranteed and actual results may be more "
+          "or less favorable. Policy charges include premium load, cost of insurance and monthly "
+          "administrative fees, which are deducted from the account value.")
+
+PAGE_W, PAGE_H = 612, 792
+MARGIN = 50
+ROW_H = 13
+FONT_SIZE = 7.5
+
+
+def ledger_rows(years: int, rng: random.Random) -> List[List[str]]:
+    age = rng.randint(35, 60)
+    premium = rng.choice([2400, 5000, 7500, 12000])
+    face = premium * rng.choice([40, 60, 80])
+    rate = rng.uniform(0.03, 0.06)
+    cash = 0.0
+    rows = []
+    for year in range(1, years + 1):
+        cash = cash * (1 + rate) + premium * 0.9 - face * 0.0015
+        cash = max(cash, 0.0)
+        charge = cash * max(0.0, 0.1 - 0.01 * (year - 1))
+        rows.append([str(year), str(age + year - 1), f"{premium:,.0f}", f"{cash:,.0f}",
+                     f"{charge:,.0f}", f"{cash - charge:,.0f}", f"{face:,.0f}"])
+    return rows
+
+
+def _person(rng: random.Random) -> Tuple[str, str, str]:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    phone = f"({rng.randint(200, 989)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)}"
+    email = f"{first.lower()}.{last.lower()}@example.com"
+    return f"{first} {last}", phone, email
+
+
+def _narrative(page: fitz.Page, y: float, rng: random.Random, pii_density: float, paragraphs: int) -> float:
+    # pii_density is the chance each paragraph names a person with contact details
+    for _ in range(paragraphs):
+        text = FILLER
+        if rng.random() < pii_density:
+            name, phone, email = _person(rng)
+            text = f"Prepared for {name}. Questions may be directed to {phone} or {email}. " + text
+        rect = fitz.Rect(MARGIN, y, PAGE_W - MARGIN, y + 70)
+        page.insert_textbox(rect, text, fontsize=9, fontname="helv")
+        y += 78
+        if y > PAGE_H - 120:
+            break
+    return y
+
+
+def _draw_table(page: fitz.Page, rows: List[List[str]], top: float, lattice: bool, header: bool = True):
+    xs = [MARGIN]
+    for w in COL_WIDTHS:
+        xs.append(xs[-1] + w)
+    body = [HEADERS] + rows if header else rows
+    for r, row in enumerate(body):
+        y = top + r * ROW_H
+        is_header = header and r == 0
+        for c, cell in enumerate(row):
+            font = "hebo" if is_header else "helv"
+            # Right-align numbers, as real ledgers do
+            width = fitz.get_text_length(cell, fontname=font, fontsize=FONT_SIZE)
+            x = xs[c] + 3 if is_header else xs[c + 1] - 3 - width
+            page.insert_text((x, y + ROW_H - 3.5), cell, fontsize=FONT_SIZE, fontname=font)
+    if lattice:
+        bottom = top + len(body) * ROW_H
+        shape = page.new_shape()
+        for r in range(len(body) + 1):
+            y = top + r * ROW_H
+            shape.draw_line((xs[0], y), (xs[-1], y))
+        for x in xs:
+            shape.draw_line((x, top), (x, bottom))
+        shape.finish(color=(0, 0, 0), width=0.5)
+        shape.commit()
+
+
+def make_ledger_pdf(pages: int = 6, years: int = 30, style: str = "lattice", scanned_pages: int = 0,
+                    pii_density: float = 0.2, seed: int = 0, repeat_header: bool = True) -> bytes:
+    """One illustration: a cover page, the ledger (split across pages as needed) and narrative pages.
+
+    style is "lattice" (ruled grid) or "stream" (whitespace-aligned). The last
+    scanned_pages pages are rasterized, so they have no text layer and go through OCR.
+    repeat_header=False prints the column header on the first ledger page only.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    carrier = rng.choice(CARRIERS)
+
+    cover = doc.new_page(width=PAGE_W, height=PAGE_H)
+    name, phone, email = _person(rng)
+    cover.insert_text((MARGIN, 80), f"{carrier} - In-Force Illustration", fontsize=16, fontname="hebo")
+    cover.insert_text((MARGIN, 110), f"Insured: {name}   Phone: {phone}   Email: {email}", fontsize=10)
+    _narrative(cover, 140, rng, pii_density, 6)
+
+    rows = ledger_rows(years, rng)
+    per_page = int((PAGE_H - 2 * MARGIN - 40) // ROW_H) - 1
+    chunks = [rows[i:i + per_page] for i in range(0, len(rows), per_page)]
+    for n, chunk in enumerate(chunks):
+        page = doc.new_page(width=PAGE_W, height=PAGE_H)
+        page.insert_text((MARGIN, MARGIN + 10), f"{carrier} - Tabular Detail (Current Assumptions)",
+                         fontsize=11, fontname="hebo")
+        _draw_table(page, chunk, MARGIN + 30, style == "lattice", header=repeat_header or n == 0)
+
+    while len(doc) < pages:
+        page = doc.new_page(width=PAGE_W, height=PAGE_H)
+        page.insert_text((MARGIN, MARGIN + 10), "Important Policy Disclosures", fontsize=11, fontname="hebo")
+        _narrative(page, MARGIN + 30, rng, pii_density, 8)
+
+    scanned = set(range(max(0, len(doc) - scanned_pages), len(doc)))
+    if scanned:
+        out = fitz.open()
+        for i in range(len(doc)):
+            if i in scanned:
+                pix = doc[i].get_pixmap(dpi=150, colorspace=fitz.csGRAY)
+                page = out.new_page(width=PAGE_W, height=PAGE_H)
+                page.insert_image(page.rect, pixmap=pix)
+            else:
+                out.insert_pdf(doc, from_page=i, to_page=i)
+        doc.close()
+        doc = out
+    try:
+        return doc.tobytes(garbage=3, deflate=True)
+    finally:
+        doc.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write synthetic ledger PDFs.")
+    ap.add_argument("--out", default="golden_set/synthetic")
+    ap.add_argument("--count", type=int, default=1)
+    ap.add_argument("--pages", type=int, default=6)
+    ap.add_argument("--years", type=int, default=30)
+    ap.add_argument("--style", choices=["lattice", "stream"], default="lattice")
+    ap.add_argument("--scanned-pages", type=int, default=0)
+    ap.add_argument("--pii-density", type=float, default=0.2)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no-repeat-header", action="store_true", help="Header on the first ledger page only")
+    args = ap.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    for n in range(args.count):
+        data = make_ledger_pdf(args.pages, args.years, args.style, args.scanned_pages, args.pii_density,
+                               args.seed + n, not args.no_repeat_header)
+        path = os.path.join(args.out, f"{args.style}-p{args.pages}-y{args.years}-s{args.seed + n}.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
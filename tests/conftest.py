@@ -0,0 +1,10 @@
+import os
+
+# app.storage refuses to import without S3 settings; the tests only ever talk to moto
+for key, value in {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_REGION": "us-east-1",
+    "S3_BUCKET_NAME": "extractor-test",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app import main, metrics
+from app.parser import tables
+
+
+@pytest.fixture
+def client():
+    # No `with`: startup (spaCy warm-up, job workers) stays off unless a test sets it up
+    return TestClient(main.api)
+
+
+def _samples(body: str) -> dict:
+    return dict(line.rsplit(" ", 1) for line in body.splitlines() if line and not line.startswith("#"))
+
+
+def test_counter_and_histogram_exposition():
+    c = metrics.Counter("t_total", "Things.")
+    c.inc(kind="a")
+    c.inc(2, kind='b"q')
+    assert c.render() == ["# HELP t_total Things.", "# TYPE t_total counter",
+                          't_total{kind="a"} 1.0', 't_total{kind="b\\"q"} 2.0']
+
+    h = metrics.Histogram("t_seconds", "Time.", buckets=(0.1, 1.0))
+    h.observe(0.05, stage="x")
+    h.observe(0.5, stage="x")
+    h.observe(5.0, stage="x")
+    assert h.render()[2:] == [
+        't_seconds_bucket{stage="x",le="0.1"} 1',
+        't_seconds_bucket{stage="x",le="1.0"} 2',
+        't_seconds_bucket{stage="x",le="+Inf"} 3',
+        't_seconds_sum{stage="x"} 5.55',
+        't_seconds_count{stage="x"} 3',
+    ]
+
+
+def test_metrics_endpoint(client, monkeypatch):
+    monkeypatch.setattr(tables, "_stats", {"pymupdf": {"pages": 4, "seconds": 0.5, "wins": 3},
+                                           "camelot": {"pages": 1, "seconds": 2.0, "wins": 1}})
+    metrics.stage_seconds.observe(0.2, stage="test.metrics")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    for metric in metrics.REGISTRY:
+        assert f"# TYPE {metric.name} " in body
+    samples = _samples(body)
+    assert samples['extractor_stage_seconds_count{stage="test.metrics"}'] == "1"
+    assert samples["extractor_pending_requests"] == "0"
+    assert "extractor_cache_hit_ratio" in samples
+    assert samples['extractor_tier_pages_total{extractor="pymupdf"}'] == "4"
+    assert samples['extractor_tier_seconds_total{extractor="camelot"}'] == "2.0"
+    assert samples['extractor_tier_win_rate{extractor="pymupdf"}'] == "0.75"
+
+
+class _Runner:
+    running = True
+
+
+@pytest.fixture
+def ready(client, monkeypatch):
+    runner = _Runner()
+    state = {"warm": False}
+    monkeypatch.setattr(main, "get_job_runner", lambda: runner)
+    monkeypatch.setattr(main, "pii_is_warm", lambda: state["warm"])
+    monkeypatch.setattr(main, "PII_WARM_UP", True)
+    monkeypatch.setattr(main.api.state, "warm_up", None, raising=False)
+
+    def get(warm=None, workers=None, warm_up=None):
+        if warm is not None:
+            state["warm"] = warm
+        if workers is not None:
+            runner.running = workers
+        if warm_up is not None:
+            main.api.state.warm_up = warm_up
+        r = client.get("/ready")
+        return r.status_code, r.json()
+    return get
+
+
+def _failed_warm_up():
+    loop = asyncio.new_event_loop()
+    task = loop.create_future()
+    task.set_exception(OSError("en_core_web_sm not found"))
+    loop.close()
+    return task
+
+
+def test_ready_holds_traffic_until_models_are_warm(ready):
+    status, body = ready(warm=False, workers=True)
+    assert status == 503
+    assert body["ready"] is False and body["pii_warm"] is False and "error" not in body
+    status, body = ready(warm=True)
+    assert status == 200
+    assert body == {"pid": body["pid"], "pii_warm": True, "job_workers": True, "ready": True}
+
+
+def test_ready_needs_job_workers_running(ready):
+    status, body = ready(warm=True, workers=False)
+    assert status == 503 and body["job_workers"] is False
+
+
+def test_ready_reports_a_failed_warm_up(ready):
+    status, body = ready(warm=False, warm_up=_failed_warm_up())
+    assert status == 503
+    assert body["error"] == "PII warm-up failed: en_core_web_sm not found"
+
+
+def test_ready_without_warm_up_only_waits_for_workers(ready, monkeypatch):
+    monkeypatch.setattr(main, "PII_WARM_UP", False)
+    status, body = ready(warm=False, workers=True)
+    assert status == 200 and body["pii_warm"] is True
+
+
+def test_msgpack_without_the_package_is_not_acceptable(client, monkeypatch):
+    from app import serialization
+    monkeypatch.setattr(serialization, "msgpack", None)
+    monkeypatch.setattr(main, "analyze_upload", lambda *a: pytest.fail("analyzed a request it can't answer"))
+    pdf = {"file": ("a.pdf", b"%PDF-1.4", "application/pdf")}
+    r = client.post("/analyze", files=pdf, headers={"Accept": "application/msgpack"})
+    assert r.status_code == 406 and "msgpack" in r.json()["detail"]
+
+    # JSON is an acceptable fallback whenever the client lists it
+    for accept in ("application/msgpack, application/json;q=0.5", "application/msgpack, */*;q=0.1"):
+        serialization.check_acceptable(accept)
+    assert serialization.render({"a": 1}, "application/msgpack, */*").media_type == "application/json"
@@ -0,0 +1,110 @@
+import json, time, asyncio, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app import decision
+from app.cache import MemoryCache
+from app.models import AnalyzeResponse, Series
+
+
+class _MockOpenAI(BaseHTTPRequestHandler):
+    # Answers POST /v1/chat/completions the way the server's `mode` says
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append((self.path, body))
+        if server.mode == "slow":
+            time.sleep(server.delay)
+        if server.mode == "error":
+            payload = json.dumps({"error": {"message": "boom", "type": "server_error"}}).encode()
+            self.send_response(500)
+        else:
+            payload = json.dumps({
+                "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "  Decision-Ready\n- from the mock  "}}],
+            }).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockOpenAI)
+    server.daemon_threads = True
+    server.mode, server.delay, server.requests = "ok", 0.0, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(decision, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setattr(decision, "DECISION_LLM", True)
+    # Fresh client per test: each asyncio.run gets its own event loop
+    monkeypatch.setattr(decision, "_client", None)
+    monkeypatch.setattr(decision, "_cache", MemoryCache(max_entries=16, ttl=60))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _resp(confidence=0.95, **kwargs):
+    series = Series(cash_value_by_year=[1000.0, 2000.0], net_surrender_value_by_year=[900.0, 1900.0])
+    return AnalyzeResponse(confidence_overall=confidence, series=series, redacted_pdf_b64="QUJD", **kwargs)
+
+
+def _decide(resp):
+    return asyncio.run(decision.decide(resp))
+
+
+def test_below_threshold_uses_rules_without_calling_the_llm(llm):
+    result = _decide(_resp(confidence=0.5))
+    assert result["source"] == "rules"
+    assert result["analysis"].startswith("Needs-Review")
+    assert "confidence 0.50 is below 0.80" in result["analysis"]
+    assert llm.requests == []
+
+
+def test_llm_success_then_cache_hit(llm):
+    result = _decide(_resp())
+    assert result == {"analysis": "Decision-Ready\n- from the mock", "source": "llm"}
+    assert len(llm.requests) == 1
+    path, body = llm.requests[0]
+    assert path == "/v1/chat/completions"
+    assert body["model"] == decision.DECISION_MODEL
+    # The base64 PDF never goes to the LLM
+    assert "redacted_pdf_b64" not in body["messages"][1]["content"]
+
+    again = _decide(_resp())
+    assert again == {"analysis": "Decision-Ready\n- from the mock", "source": "cache"}
+    assert len(llm.requests) == 1
+
+
+def test_timeout_falls_back_to_rules(llm, monkeypatch):
+    llm.mode, llm.delay = "slow", 1.0
+    # Client built with the default timeout, so only the whole-call budget can fire
+    decision.get_client()
+    monkeypatch.setattr(decision, "DECISION_TIMEOUT_SECONDS", 0.2)
+    start = time.perf_counter()
+    result = _decide(_resp())
+    assert time.perf_counter() - start < 0.9
+    assert result["source"] == "fallback"
+    assert result["analysis"].startswith("Decision-Ready")
+    assert result["analysis"].endswith("(Local rules: LLM timed out)")
+
+
+def test_server_error_falls_back_to_rules_and_is_not_cached(llm):
+    llm.mode = "error"
+    result = _decide(_resp(notes=["x"]))
+    assert result["source"] == "fallback"
+    assert result["analysis"].endswith("(Local rules: LLM unavailable)")
+    # No retries: the fallback covers failures
+    assert len(llm.requests) == 1
+
+    llm.mode = "ok"
+    assert _decide(_resp(notes=["x"]))["source"] == "llm"
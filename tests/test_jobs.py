@@ -0,0 +1,227 @@
+import io, os, sys, asyncio, sqlite3, zipfile, subprocess
+import pytest
+from fastapi import HTTPException
+from app import cache, jobs
+from app.concurrency import AdmissionGate
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = jobs.JobStore(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "blobs"))
+    yield s
+    s.close()
+
+
+def _blob(store, content: bytes) -> str:
+    return store.write_blob(io.BytesIO(content), "x.pdf", {"files": 0, "bytes": 0})
+
+
+def _blobs(store):
+    return sorted(n for n in os.listdir(store.blob_dir) if n.endswith(".pdf"))
+
+
+def _zip(members) -> io.BytesIO:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+def test_claims_by_priority_then_fifo_and_content_together(store):
+    a, b, c = (_blob(store, x) for x in (b"%PDF a", b"%PDF b", b"%PDF c"))
+    store.create_job([("a.pdf", a), ("b.pdf", b)], priority=0)
+    urgent = store.create_job([("c.pdf", c), ("a-again.pdf", a)], priority=5)
+    assert store.claim() == (c, os.path.join(store.blob_dir, f"{c}.pdf"))
+    # Both items holding `a` are claimed at once, whichever job they belong to
+    assert store.claim()[0] == a
+    assert store.status(urgent)["running"] == 2
+    assert store.claim()[0] == b
+    assert store.claim() is None
+
+
+def test_two_processes_never_claim_the_same_item(store):
+    other = jobs.JobStore(store.db_path, store.blob_dir)
+    digests = [_blob(store, f"%PDF {i}".encode()) for i in range(6)]
+    store.create_job([(f"{i}.pdf", d) for i, d in enumerate(digests)], priority=0)
+    claimed = []
+    for s in [store, other] * 4:
+        c = s.claim()
+        if c is not None:
+            claimed.append(c[0])
+    other.close()
+    assert sorted(claimed) == sorted(digests)
+
+
+def test_resume_requeues_everything_running(store):
+    d = _blob(store, b"%PDF")
+    job = store.create_job([("a.pdf", d)], priority=0)
+    store.claim()
+    assert store.resume() == 1
+    assert store.status(job)["queued"] == 1
+
+
+def test_requeue_only_touches_this_process_items(store):
+    d = _blob(store, b"%PDF")
+    job = store.create_job([("a.pdf", d)], priority=0)
+    store.claim()
+    store._conn.execute("UPDATE items SET owner=? WHERE content_hash=?", (os.getpid() + 1, d))
+    assert store.requeue(d) == 0
+    store._conn.execute("UPDATE items SET owner=? WHERE content_hash=?", (os.getpid(), d))
+    assert store.requeue(d) == 1
+    assert store.status(job)["queued"] == 1
+
+
+def test_reclaim_stale_only_takes_items_of_dead_owners(store):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    live, gone = _blob(store, b"%PDF live"), _blob(store, b"%PDF gone")
+    job = store.create_job([("live.pdf", live), ("gone.pdf", gone)], priority=0)
+    store.claim(), store.claim()
+    store._conn.execute("UPDATE items SET owner=? WHERE content_hash=?", (dead.pid, gone))
+    assert store.reclaim_stale() == 1
+    assert store.status(job)["queued"] == 1 and store.status(job)["running"] == 1
+
+
+def test_finish_discards_blobs_no_pending_item_needs(store):
+    d = _blob(store, b"%PDF shared")
+    store.create_job([("a.pdf", d)], priority=0)
+    store.claim()
+    # Queued again by a second job before the first finishes
+    store.create_job([("b.pdf", _blob(store, b"%PDF shared"))], priority=0)
+    store.finish(d, {"ok": True})
+    assert _blobs(store) == [f"{d}.pdf"]
+    store.claim()
+    store.finish(d, {"ok": True})
+    assert _blobs(store) == []
+
+
+def test_dedupe_reuses_results_only_for_the_same_cache_key(store, monkeypatch):
+    d = _blob(store, b"%PDF")
+    store.create_job([("a.pdf", d)], priority=0)
+    store.claim()
+    store.finish(d, {"decision": "v2"})
+
+    again = store.create_job([("a.pdf", _blob(store, b"%PDF"))], priority=0)
+    assert store.status(again)["done"] == 1
+    assert store.results(again)[0]["result"] == {"decision": "v2"}
+    # The reused item never runs, so its blob is dropped straight away
+    assert _blobs(store) == []
+
+    # A pipeline or config change makes the old result stale, as it does for /analyze
+    monkeypatch.setattr(cache, "PIPELINE_VERSION", "next")
+    stale = store.create_job([("a.pdf", _blob(store, b"%PDF"))], priority=0)
+    assert store.status(stale)["queued"] == 1
+    monkeypatch.setattr(cache, "PIPELINE_VERSION", cache.PIPELINE_VERSION)
+    monkeypatch.setenv("DECISION_MODEL", "another-model")
+    assert store.status(store.create_job([("a.pdf", _blob(store, b"%PDF"))], priority=0))["queued"] == 1
+
+
+def test_stores_from_before_result_key_are_migrated(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE items (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, filename TEXT NOT NULL,
+            content_hash TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL, result TEXT,
+            error TEXT, finished_at REAL);
+        INSERT INTO items (job_id, filename, content_hash, priority, status, result) VALUES ('j', 'a.pdf', 'h', 0, 'done', '{}');
+    """)
+    conn.close()
+    s = jobs.JobStore(path, str(tmp_path / "blobs"))
+    columns = [r[1] for r in s._conn.execute("PRAGMA table_info(items)")]
+    assert "owner" in columns and "result_key" in columns
+    # Results from before the key existed are never reused
+    d = _blob(s, b"%PDF")
+    assert s.status(s.create_job([("a.pdf", d)], priority=0))["queued"] == 1
+    s.close()
+
+
+@pytest.fixture
+def submit(store, monkeypatch):
+    monkeypatch.setattr(jobs, "_store", store)
+    monkeypatch.setattr(jobs, "_runner", jobs.JobRunner(store, workers=0))
+    return lambda uploads: asyncio.run(jobs.submit_job(uploads))
+
+
+def test_zip_members_become_items(store, submit):
+    archive = _zip([("one.pdf", b"%PDF 1"), ("docs/two.PDF", b"%PDF 2"), ("readme.txt", b"x"), ("dir/", b"")])
+    job = submit([("batch.zip", archive), ("three.pdf", io.BytesIO(b"%PDF 3"))])
+    assert store.status(job)["total"] == 3
+    assert len(_blobs(store)) == 3
+
+
+@pytest.mark.parametrize("setting,value,detail", [
+    ("JOB_MAX_FILE_BYTES", 1024, "exceeds 1024 bytes"),
+    ("JOB_MAX_BATCH_BYTES", 3000, "at most 3000 bytes"),
+    ("JOB_MAX_FILES", 2, "at most 2 files"),
+])
+def test_zip_limits_reject_the_batch_and_leave_no_blobs(store, submit, monkeypatch, setting, value, detail):
+    monkeypatch.setattr(jobs, setting, value)
+    # Compresses to almost nothing; counted decompressed
+    archive = _zip([(f"{i}.pdf", b"%PDF" + b"\0" * 1500) for i in range(3)])
+    with pytest.raises(HTTPException) as e:
+        submit([("batch.zip", archive)])
+    assert e.value.status_code == 413 and detail in e.value.detail
+    assert os.listdir(store.blob_dir) == []
+
+
+def test_bad_uploads_are_rejected(store, submit):
+    with pytest.raises(HTTPException) as e:
+        submit([("batch.zip", io.BytesIO(b"not a zip"))])
+    assert e.value.status_code == 400
+    with pytest.raises(HTTPException) as e:
+        submit([("notes.txt", io.BytesIO(b"x"))])
+    assert e.value.status_code == 400
+    with pytest.raises(HTTPException) as e:
+        submit([("empty.zip", _zip([("readme.txt", b"x")]))])
+    assert e.value.status_code == 400
+    assert os.listdir(store.blob_dir) == []
+
+
+def test_job_workers_hold_background_slots_and_yield_to_requests():
+    gate = AdmissionGate(limit=4, background_share=0.5)
+    assert gate.try_acquire_background() and gate.try_acquire_background()
+    # Background work stops at its share; requests still get the rest of the gate
+    assert not gate.try_acquire_background()
+    gate.acquire(), gate.acquire()
+    with pytest.raises(HTTPException) as e:
+        gate.acquire()
+    assert e.value.status_code == 503
+    gate.release(), gate.release(), gate.release()
+    # One job slot free, but a request is in flight: jobs stay at or under the share
+    gate.acquire()
+    assert not gate.try_acquire_background()
+
+
+def test_runner_waits_for_a_background_slot(store, monkeypatch):
+    gate = AdmissionGate(limit=2, background_share=0.5)
+    ran = []
+
+    async def fake_analyze(upload, timings=False):
+        ran.append(upload.digest)
+        return {"ok": True}
+    import app.pipeline
+    monkeypatch.setattr(app.pipeline, "analyze_upload", fake_analyze)
+    monkeypatch.setattr(jobs, "JOB_POLL_SECONDS", 0.01)
+    d = _blob(store, b"%PDF")
+    job = store.create_job([("a.pdf", d)], priority=0)
+
+    async def main():
+        runner = jobs.JobRunner(store, workers=1, admission=gate)
+        # One /analyze request in flight already fills the background share
+        gate.acquire()
+        await runner.start()
+        await asyncio.sleep(0.1)
+        assert ran == []
+        gate.release()
+        for _ in range(100):
+            if ran:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        await runner.stop()
+        assert gate.pending == 0
+    asyncio.run(main())
+    assert ran == [d]
+    assert store.status(job)["done"] == 1
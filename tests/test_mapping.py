@@ -0,0 +1,128 @@
+import math, random
+import numpy as np
+import pandas as pd
+import pytest
+from app.parser.mapping import clean_number, numeric_matrix, shape_score, reconciliation_score
+
+
+# Row-wise scorers as they were before numeric_matrix; the vectorized ones must match them.
+
+def _old_shape_score(df, col_map):
+    scores = []
+    if "year" in col_map:
+        years = [clean_number(v) for v in df.iloc[1:, col_map["year"]].to_list()]
+        years = [y for y in years if y is not None]
+        if len(years) > 1:
+            year_diffs = [years[i] - years[i-1] for i in range(1, len(years))]
+            scores.append(sum(1 for d in year_diffs if d == 1) / float(len(year_diffs)))
+    if "surrender_charge" in col_map:
+        sc = [clean_number(v) for v in df.iloc[1:, col_map["surrender_charge"]].to_list()]
+        sc = [v for v in sc if v is not None]
+        if len(sc) > 1 and sc[-1] == 0:
+            scores.append(1.0)
+        elif len(sc) > 1:
+            decreasing = [sc[i] <= sc[i-1] for i in range(1, len(sc))]
+            scores.append(sum(decreasing) / len(decreasing))
+    if "net_surrender_value" in col_map and "cash_value" in col_map:
+        nsv = [clean_number(v) for v in df.iloc[1:, col_map["net_surrender_value"]].to_list()]
+        cv = [clean_number(v) for v in df.iloc[1:, col_map["cash_value"]].to_list()]
+        if len(nsv) == len(cv):
+            valid = [nsv[i] <= cv[i] for i in range(len(nsv)) if nsv[i] is not None and cv[i] is not None]
+            if valid:
+                scores.append(sum(valid) / len(valid))
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def _old_reconciliation_score(df, col_map):
+    required_cols = ["net_surrender_value", "cash_value", "surrender_charge"]
+    if not all(c in col_map for c in required_cols):
+        return 0.0
+    rows_ok = 0
+    total_rows = 0
+    for i in range(1, len(df)):
+        nsv = clean_number(df.iloc[i, col_map["net_surrender_value"]])
+        cv = clean_number(df.iloc[i, col_map["cash_value"]])
+        sc = clean_number(df.iloc[i, col_map["surrender_charge"]])
+        loan = clean_number(df.iloc[i, col_map.get("loan_balance", -1)]) or 0.0
+        interest = clean_number(df.iloc[i, col_map.get("loan_interest", -1)]) or 0.0
+        if nsv is not None and cv is not None and sc is not None:
+            total_rows += 1
+            if abs(nsv - (cv - sc - loan - interest)) <= 0.01 * abs(nsv):
+                rows_ok += 1
+    return rows_ok / total_rows if total_rows > 0 else 0.0
+
+
+COL_MAP = {"year": 0, "age": 1, "cash_value": 2, "surrender_charge": 3, "net_surrender_value": 4, "loan_balance": 5}
+HEADER = ["Policy Year", "Age", "Cash Value", "Surrender Charge", "Net Surrender Value", "Policy Loan"]
+# Everything clean_number has a rule for, plus text it rejects
+ODD_CELLS = ["", "  ", "n/a", "--", "$1,234", "(500)", "$(1,000.50)", "2025-26", "1e3", " 7 ",
+             "1_000", "0x10", "inf", "-inf", "12%", "-", None]
+
+
+def _fmt(v, rng):
+    style = rng.randrange(4)
+    if style == 0:
+        return f"{v:,.0f}"
+    if style == 1:
+        return f"${v:,.2f}"
+    if style == 2:
+        return f"({abs(v):,.0f})" if v < 0 else str(int(v))
+    return str(v)
+
+
+def _ledger(rng, rows):
+    cash, out = 0.0, [HEADER]
+    for year in range(1, rows + 1):
+        cash = cash * 1.04 + rng.choice([900, 2500, 4000])
+        charge = max(0.0, cash * (0.1 - 0.01 * year))
+        loan = rng.choice([0.0, 0.0, 250.0])
+        nsv = cash - charge - loan + rng.choice([0.0, 0.0, 0.0, 500.0])
+        row = [str(year + rng.choice([0, 0, 0, 1])), str(40 + year), _fmt(cash, rng), _fmt(charge, rng),
+               _fmt(nsv, rng), _fmt(loan, rng)]
+        if rng.random() < 0.3:
+            row[rng.randrange(len(row))] = rng.choice(ODD_CELLS)
+        out.append(row)
+    return pd.DataFrame(out)
+
+
+def _same(a, b):
+    return a == pytest.approx(b, abs=1e-12) or (math.isnan(a) and math.isnan(b))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_scores_match_row_wise_implementation(seed):
+    rng = random.Random(seed)
+    df = _ledger(rng, rng.randint(1, 30))
+    col_map = dict(COL_MAP)
+    if seed % 3 == 0:
+        # Unmapped loan column: both versions read the last column
+        del col_map["loan_balance"]
+    values = numeric_matrix(df)
+    assert _same(shape_score(df, col_map, values), _old_shape_score(df, col_map))
+    assert _same(reconciliation_score(df, col_map, values), _old_reconciliation_score(df, col_map))
+
+
+def test_numeric_matrix_matches_clean_number_cell_for_cell():
+    cells = ODD_CELLS + ["12", "-3.5", "$0", "(0)", "1,000,000", "Cash Value", "1999-2000", "+5", ".5"]
+    df = pd.DataFrame([cells])
+    got = numeric_matrix(df)[0]
+    for cell, v in zip(cells, got):
+        expected = clean_number(cell)
+        if expected is None:
+            assert np.isnan(v), cell
+        else:
+            assert v == expected, cell
+
+
+def test_nan_cells_are_missing():
+    # Documented difference: clean_number("nan") is a float the old scorers kept (and
+    # counted as a failed row); numeric_matrix treats NaN cells as missing.
+    df = pd.DataFrame([HEADER,
+                       ["1", "40", "1000", "100", "900", "0"],
+                       ["nan", "41", "nan", "nan", "nan", "0"],
+                       ["2", "42", "2000", "0", "2000", "0"]])
+    assert math.isnan(clean_number("nan"))
+    assert np.isnan(numeric_matrix(df)[2]).sum() == 4
+    assert shape_score(df, COL_MAP) == 1.0
+    assert reconciliation_score(df, COL_MAP) == 1.0
+    assert _old_reconciliation_score(df, COL_MAP) == pytest.approx(2 / 3)
@@ -0,0 +1,193 @@
+import io, os, asyncio
+import fitz
+import pytest
+from fastapi import HTTPException, UploadFile
+from bench.synth import make_ledger_pdf
+from app import memory, pipeline, uploads
+from app.cache import MemoryCache
+from app.parser import document, tables
+from app.parser.document import DocumentContext
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def budget():
+    # A request's budget, as iter_upload starts one; reset so it never leaks into other tests
+    b = memory.MemoryBudget(limit_mb=100)
+    token = memory._current.set(b)
+    yield b
+    memory._current.reset(token)
+
+
+@pytest.fixture
+def over(monkeypatch):
+    # Every module that checks the budget sees it exceeded
+    for module in (document, tables, pipeline):
+        monkeypatch.setattr(module, "over_budget", lambda: True)
+
+
+def _ctx(data):
+    return DocumentContext(fitz.open(stream=data), data=data)
+
+
+def _doc(pages: int) -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {i}")
+    return doc.tobytes()
+
+
+# --- Spooling and upload limits ---
+
+def _spool(data: bytes, max_bytes: int = uploads.MAX_UPLOAD_BYTES) -> uploads.Upload:
+    return asyncio.run(uploads.spool_upload(UploadFile(io.BytesIO(data), filename="a.pdf"), max_bytes))
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 1000)
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_BYTES", 4000)
+    return tmp_path
+
+
+def test_small_uploads_stay_in_memory(upload_dir):
+    up = _spool(b"%PDF" * 500)
+    assert up.data == b"%PDF" * 500 and up.path is None
+    assert up.digest == uploads.Upload.from_bytes(b"%PDF" * 500).digest
+    assert os.listdir(upload_dir) == []
+
+
+def test_large_uploads_spool_to_disk_and_close_removes_them(upload_dir):
+    data = os.urandom(10_500)
+    up = _spool(data)
+    assert up.data is None and os.path.dirname(up.path) == str(upload_dir)
+    assert up.size == len(data) and up.read() == data
+    assert up.digest == uploads.Upload.from_bytes(data).digest
+    up.close()
+    assert os.listdir(upload_dir) == []
+
+
+def test_oversized_uploads_get_413_and_leave_nothing_behind(upload_dir):
+    with pytest.raises(HTTPException) as e:
+        _spool(os.urandom(10_500), max_bytes=8000)
+    assert e.value.status_code == 413
+    assert os.listdir(upload_dir) == []
+    with pytest.raises(HTTPException) as e:
+        uploads.check_content_length("9000", max_bytes=8000)
+    assert e.value.status_code == 413
+    uploads.check_content_length("8000", max_bytes=8000)
+    uploads.check_content_length(None, max_bytes=8000)
+
+
+def test_spooled_and_job_uploads_open_from_disk(tmp_path):
+    # Job workers hand the pipeline their blob's path; nothing is read into memory
+    path = tmp_path / "blob.pdf"
+    path.write_bytes(_doc(3))
+    up = uploads.Upload(path=str(path), size=path.stat().st_size, digest="d" * 64)
+    ctx = pipeline.open_upload(up)
+    assert ctx.path == str(path) and ctx.data is None
+    assert ctx.digest == "d" * 64 and len(ctx) == 3
+    ctx.close()
+    up.close()
+    # Not owned: the blob store removes it, not the upload
+    assert path.exists()
+
+
+# --- Page windows ---
+
+def test_windows_release_page_caches_on_long_documents():
+    ctx = _ctx(_doc(5))
+    seen = []
+    for window in ctx.windows(size=2):
+        for i in window:
+            ctx.text(i)
+        seen.append((window, sorted(ctx._text)))
+    # Each window's text is dropped before the next one is read
+    assert seen == [([0, 1], [0, 1]), ([2, 3], [2, 3]), ([4], [4])]
+    assert ctx._text == {}
+
+
+def test_windows_keep_caches_on_short_documents_unless_over_budget(budget, monkeypatch):
+    ctx = _ctx(_doc(3))
+    for window in ctx.windows(size=4):
+        for i in window:
+            ctx.text(i)
+    assert sorted(ctx._text) == [0, 1, 2]
+
+    shrunk = []
+    monkeypatch.setattr(document, "over_budget", lambda: True)
+    monkeypatch.setattr(fitz.TOOLS, "store_shrink", shrunk.append)
+    for window in ctx.windows(size=4):
+        for i in window:
+            ctx.text(i)
+    assert ctx._text == {} and shrunk == [100]
+
+
+# --- Budget and the degradation ladder ---
+
+def test_budget_tracks_growth_and_records_each_step_once(monkeypatch):
+    rss = iter([500 * MB, 550 * MB, 620 * MB, 620 * MB])
+    monkeypatch.setattr(memory, "rss_bytes", lambda: next(rss))
+    b = memory.MemoryBudget(limit_mb=100)
+    assert not b.over()
+    assert b.over()
+    b.degrade("snips_skipped")
+    b.degrade("snips_skipped")
+    report = b.report()
+    assert report["rss_growth_mb"] == 120.0 and report["degraded"] == ["snips_skipped"]
+
+
+def test_over_budget_is_false_outside_a_request():
+    assert memory.current_budget() is None
+    assert memory.over_budget() is False
+
+
+def test_discovery_stops_reading_pages_once_over_budget(budget, over, monkeypatch):
+    # Ledger on pages 1-2 of a 40-page document; only the first window is scanned
+    data = make_ledger_pdf(pages=40, years=60)
+    monkeypatch.setattr(document, "PAGE_WINDOW", 16)
+    targets = tables._roi_targets(_ctx(data))
+    assert {t[0] for t in targets} <= set(range(16))
+    assert budget.degraded == ["discovery_truncated"]
+
+
+def test_camelot_is_skipped_once_a_fast_tier_found_something(budget, over, monkeypatch):
+    monkeypatch.setattr(tables, "TABLE_EXTRACTORS", ["pymupdf", "camelot"])
+    monkeypatch.setattr(tables, "TABLE_WORKERS", 0)
+    # Nothing clears the fast tier, so every page would otherwise reach Camelot
+    monkeypatch.setattr(tables, "FAST_TIER_MIN_SCORE", 2.0)
+    monkeypatch.setattr(tables, "TABLE_EARLY_EXIT_SCORE", 0)
+    monkeypatch.setattr(tables, "_camelot_tier", lambda *a: pytest.fail("Camelot ran over budget"))
+    found = tables.find_roi_and_tables(_ctx(make_ledger_pdf(pages=4, years=60)))
+    assert found and {t["extractor"] for t in found} == {"pymupdf"}
+    # Discovery was cut short first, then Camelot was dropped
+    assert budget.degraded == ["discovery_truncated", "camelot_skipped"]
+
+
+def test_snips_are_skipped_and_redaction_narrows_to_the_ledger(budget, over, monkeypatch):
+    calls = {}
+    monkeypatch.setattr(pipeline, "REDACT_LEDGER_ONLY", False)
+    monkeypatch.setattr(pipeline, "find_pii_coords", lambda ctx, pages: calls.setdefault("scanned", pages) and {})
+    monkeypatch.setattr(pipeline, "redact_pdf_boxes", lambda ctx, coords, pages: calls.setdefault("kept", pages) and b"")
+    ctx = _ctx(_doc(6))
+    assert pipeline.render_snips(ctx, {}, None) == []
+    pipeline.redact_document(ctx, [2, 3])
+    assert calls == {"scanned": [2, 3], "kept": [2, 3]}
+    assert budget.degraded == ["snips_skipped", "redact_ledger_only"]
+
+
+def test_degraded_results_are_returned_but_not_cached(monkeypatch):
+    cache = MemoryCache(max_entries=4, ttl=60)
+    monkeypatch.setattr(pipeline, "get_result_cache", lambda: cache)
+
+    async def analysis(upload):
+        memory.degrade("snips_skipped")
+        yield "result", {"response": {}, "content": {"analysis": "x", "decision_source": "llm",
+                                                      "degraded": list(memory.current_budget().degraded)}}
+    monkeypatch.setattr(pipeline, "iter_analysis", analysis)
+    content = asyncio.run(pipeline.analyze_upload(b"%PDF degraded", timings=True))
+    assert content["degraded"] == ["snips_skipped"]
+    assert content["timings"]["memory"]["degraded"] == ["snips_skipped"]
+    assert cache.get(pipeline.digest_key(uploads.Upload.from_bytes(b"%PDF degraded").digest)) is None
@@ -0,0 +1,56 @@
+import fitz
+from app.parser.document import DocumentContext
+from app.parser.pii import _entity_rects, redact_pdf_boxes
+
+NAME = "Jane Q. Doe"
+
+
+def _ctx(pages: int = 3) -> DocumentContext:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Insured: {NAME}")
+        page.insert_text((72, 100), f"Policy Year {i + 1} Cash Value 1,000")
+    doc.set_metadata({"author": NAME, "title": f"Illustration for {NAME}"})
+    doc.set_xml_metadata(f"<x:xmpmeta xmlns:x='adobe:ns:meta/'><dc>{NAME}</dc></x:xmpmeta>")
+    data = doc.tobytes()
+    return DocumentContext(fitz.open(stream=data), data=data)
+
+
+def _name_rects(ctx, i):
+    # What find_pii_coords builds from an analyzer hit on the name
+    text, offsets = ctx.word_text(i)
+    start = text.index(NAME)
+    return _entity_rects(ctx.words(i), offsets, [o[0] for o in offsets], start, start + len(NAME))
+
+
+def test_redaction_removes_the_text_not_just_covers_it():
+    ctx = _ctx()
+    spans = {i: _name_rects(ctx, i) for i in range(3)}
+    assert all(len(r) == 1 for r in spans.values())
+    out = fitz.open(stream=redact_pdf_boxes(ctx, spans))
+    assert len(out) == 3
+    for page in out:
+        text = page.get_text()
+        assert "Jane" not in text and "Doe" not in text
+        # Everything outside the boxes survives
+        assert "Insured:" in text and "Cash Value" in text
+        assert page.search_for("Doe") == []
+
+
+def test_redaction_clears_metadata_and_xmp():
+    ctx = _ctx()
+    assert ctx.doc.metadata["author"] == NAME
+    out = fitz.open(stream=redact_pdf_boxes(ctx, {}))
+    assert not any(out.metadata.get(k) for k in ("author", "title", "subject", "keywords"))
+    assert NAME not in out.get_xml_metadata()
+
+
+def test_keep_pages_emits_only_the_ledger_redacted():
+    ctx = _ctx(4)
+    spans = {i: _name_rects(ctx, i) for i in range(4)}
+    out = fitz.open(stream=redact_pdf_boxes(ctx, spans, keep_pages=[2, 1, 9]))
+    assert len(out) == 2
+    assert [p.get_text().count("Policy Year") for p in out] == [1, 1]
+    assert "Policy Year 2" in out[0].get_text() and "Policy Year 3" in out[1].get_text()
+    assert all(NAME not in p.get_text() for p in out)
@@ -0,0 +1,65 @@
+import fitz
+import pytest
+from bench.synth import make_ledger_pdf
+from app.parser import snips, tables
+from app.parser.document import DocumentContext
+
+
+@pytest.fixture(scope="module")
+def ledger():
+    data = make_ledger_pdf(pages=3, years=30, style="lattice")
+    ctx = DocumentContext(fitz.open(stream=data), data=data)
+    mp = pytest.MonkeyPatch()
+    mp.setattr(tables, "TABLE_EXTRACTORS", ["pymupdf"])
+    try:
+        best = tables.find_roi_and_tables(ctx)[0]
+    finally:
+        mp.undo()
+    return ctx, best
+
+
+def test_grid_lookup_matches_a_scan_of_every_word(ledger):
+    ctx, best = ledger
+    index = snips.word_index(ctx, best["page"])
+    assert snips.word_index(ctx, best["page"]) is index
+    for rect in (fitz.Rect(0, 0, 50, 50), fitz.Rect(100, 150, 300, 170), fitz.Rect(best["roi"]), ctx.page(1).rect):
+        expected = [k for k, w in enumerate(index.words)
+                    if w[0] < rect.x1 and w[2] > rect.x0 and w[1] < rect.y1 and w[3] > rect.y0]
+        assert index.within(rect) == expected
+
+
+def test_rows_are_located_by_their_own_cells(ledger):
+    ctx, best = ledger
+    df, clip = best["df"], fitz.Rect(best["roi"])
+    index = snips.word_index(ctx, best["page"])
+    tops = []
+    for row in (1, 7, 10, 30):
+        rect = snips._locate_row(index, df, row, clip)
+        assert rect is not None
+        found = [snips._norm(index.words[k][4]) for k in index.within(rect)]
+        # The year token also turns up in other rows' ages; the box holds exactly this row
+        assert [snips._norm(str(c)) for c in df.iloc[row]] == found
+        tops.append(rect.y0)
+    assert tops == sorted(tops)
+
+
+def test_snips_are_cropped_from_one_render_per_page(ledger, monkeypatch):
+    ctx, best = ledger
+    rendered = []
+    get_pixmap = fitz.Page.get_pixmap
+    monkeypatch.setattr(fitz.Page, "get_pixmap", lambda page, **kw: rendered.append(page.number) or get_pixmap(page, **kw))
+    page = best["page"]
+    boxes = [list(snips._pad(snips._locate_row(snips.word_index(ctx, page), best["df"], row, fitz.Rect(best["roi"])),
+                             ctx.page(page).rect)) for row in (1, 5, 20)]
+    found = [{"label": str(i), "page": page, "box": box} for i, box in enumerate(boxes)]
+    found.append({"label": "cover", "page": 0, "box": [36, 60, 300, 120]})
+    images = snips.render_snips(ctx, found, dpi=100)
+    assert sorted(rendered) == [0, page]
+    # Each crop is exactly what rendering the box on its own gives
+    for s, png in zip(found, images):
+        direct = get_pixmap(ctx.page(s["page"]), clip=fitz.Rect(s["box"]), dpi=100, alpha=False)
+        crop = fitz.Pixmap(png)
+        assert (crop.width, crop.height) == (direct.width, direct.height)
+        assert crop.samples == direct.samples
+    # The shared renders are dropped once the request's snips are encoded
+    assert not any(key[0] == ctx.uid for key in snips.render_cache._items)
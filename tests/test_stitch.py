@@ -0,0 +1,77 @@
+import random
+import fitz
+import pandas as pd
+import pytest
+from bench.synth import HEADERS, ledger_rows, make_ledger_pdf
+from app.parser import stitch
+from app.parser.document import DocumentContext
+from app.parser.tables import find_roi_and_tables, score_table
+
+ROWS = ledger_rows(100, random.Random(0))
+
+
+@pytest.fixture(autouse=True)
+def no_maturity(monkeypatch):
+    # The synthetic insured passes age 121 long before year 100
+    monkeypatch.setattr(stitch, "MATURITY_AGE", 999)
+
+
+def _ctx(data=None, pages=6):
+    if data is None:
+        doc = fitz.open()
+        for _ in range(pages):
+            doc.new_page()
+        data = doc.tobytes()
+    return DocumentContext(fitz.open(stream=data), data=data)
+
+
+def _table(page, rows, header=HEADERS, hint=None):
+    df = pd.DataFrame(([header] if header else []) + rows)
+    return score_table(df, page, (0, 0, 612, 792), "pymupdf", "lines", hint)
+
+
+def _years(t):
+    return [int(v) for v in t["df"].iloc[1:, t["col_map"]["year"]]]
+
+
+@pytest.mark.parametrize("style,repeat_header", [("lattice", True), ("stream", True), ("stream", False)])
+def test_stitches_the_whole_ledger(style, repeat_header):
+    # 100 years over pages 1-3; page 3 is a 2-row tail
+    ctx = _ctx(make_ledger_pdf(pages=6, years=100, style=style, repeat_header=repeat_header))
+    ledger = stitch.stitch_ledger(ctx, find_roi_and_tables(ctx))[0]
+    assert ledger["pages"] == [1, 2, 3]
+    assert _years(ledger) == list(range(1, 101))
+    assert len(ledger["row_pages"]) == len(ledger["df"])
+    assert ledger["row_pages"][1:] == [1] * 49 + [2] * 49 + [3] * 2
+
+
+def test_reused_pages_are_rescored_with_the_seeds_columns(monkeypatch):
+    monkeypatch.setattr(stitch, "extract_page_tables", lambda *a: [])
+    seed = _table(1, ROWS[:49])
+    # Discovery saw the tail without a year header; two rows are too few to infer it
+    tail = _table(2, ROWS[49:51], header=[""] + HEADERS[1:])
+    assert "year" not in tail["col_map"]
+    other = _table(4, ROWS[:20])
+    out = stitch.stitch_ledger(_ctx(), [seed, tail, other])
+    assert out[0]["pages"] == [1, 2]
+    assert _years(out[0]) == list(range(1, 52))
+    # Parts are matched back to discovery's tables; the rest pass through untouched
+    assert out[1:] == [other]
+
+
+def test_stops_at_the_first_page_that_does_not_continue(monkeypatch):
+    extracted = []
+    monkeypatch.setattr(stitch, "extract_page_tables", lambda ctx, p, hint: extracted.append(p) or [])
+    tables = [
+        _table(1, ROWS[:49]),
+        _table(2, ROWS[49:98]),
+        # A second ledger (e.g. guaranteed values) restarting at year 1
+        _table(3, ROWS[:30]),
+        # Would continue page 2, but page 3 already broke the run
+        _table(4, ROWS[98:], header=None),
+    ]
+    out = stitch.stitch_ledger(_ctx(), tables)
+    assert out[0]["pages"] == [1, 2]
+    assert _years(out[0]) == list(range(1, 99))
+    assert [t["page"] for t in out[1:]] == [3, 4]
+    assert extracted == []
@@ -0,0 +1,105 @@
+import asyncio
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from app import storage
+
+BUCKET = "extractor-test"
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        calls = []
+        # Every S3 operation the uploader makes, in order
+        client.meta.events.register("before-call.s3.*", lambda model, **kw: calls.append(model.name))
+        client.calls = calls
+        yield client
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(storage.time, "sleep", delays.append)
+    return delays
+
+
+def _fail(client, operation, times):
+    # Fails the first `times` calls of one operation with a retryable S3 error
+    state = {"left": times}
+
+    def handler(**kwargs):
+        if state["left"] > 0:
+            state["left"] -= 1
+            raise ClientError({"Error": {"Code": "SlowDown", "Message": "Reduce your request rate."}}, operation)
+    client.meta.events.register(f"before-call.s3.{operation}", handler)
+
+
+def test_small_upload_is_one_put(s3):
+    up = storage.S3Uploader(bucket=BUCKET, region="us-east-1", client=s3)
+    result = up.upload(b"%PDF-1.7 small", "application/pdf", ".pdf")
+    assert result["error"] is None and result["attempts"] == 1
+    assert result["url"].endswith(result["key"])
+    assert s3.calls == ["PutObject"]
+    obj = s3.get_object(Bucket=BUCKET, Key=result["key"])
+    assert obj["Body"].read() == b"%PDF-1.7 small"
+    assert obj["ContentType"] == "application/pdf"
+
+
+def test_large_upload_is_multipart(s3, monkeypatch):
+    # S3's smallest part is 5 MB, so 11 MB gives three parts
+    monkeypatch.setattr(storage, "S3_MULTIPART_THRESHOLD", 5 * 1024 * 1024)
+    monkeypatch.setattr(storage, "S3_MULTIPART_CHUNKSIZE", 5 * 1024 * 1024)
+    up = storage.S3Uploader(bucket=BUCKET, region="us-east-1", client=s3)
+    data = bytes(range(256)) * (11 * 4096)
+    result = up.upload(data, "application/pdf", ".pdf")
+    assert result["error"] is None
+    assert "PutObject" not in s3.calls
+    assert s3.calls.count("UploadPart") == 3
+    assert s3.calls[0] == "CreateMultipartUpload" and s3.calls[-1] == "CompleteMultipartUpload"
+    assert s3.get_object(Bucket=BUCKET, Key=result["key"])["Body"].read() == data
+
+
+def test_retries_with_exponential_backoff(s3, sleeps, monkeypatch):
+    monkeypatch.setattr(storage, "S3_UPLOAD_ATTEMPTS", 3)
+    monkeypatch.setattr(storage, "S3_RETRY_BACKOFF_SECONDS", 0.25)
+    _fail(s3, "PutObject", 2)
+    up = storage.S3Uploader(bucket=BUCKET, region="us-east-1", client=s3)
+    result = up.upload(b"%PDF retry", "application/pdf", ".pdf")
+    assert result["error"] is None and result["attempts"] == 3
+    assert sleeps == [0.25, 0.5]
+    assert s3.get_object(Bucket=BUCKET, Key=result["key"])["Body"].read() == b"%PDF retry"
+
+
+def test_gives_up_after_the_last_attempt(s3, sleeps, monkeypatch):
+    monkeypatch.setattr(storage, "S3_UPLOAD_ATTEMPTS", 3)
+    _fail(s3, "PutObject", 5)
+    up = storage.S3Uploader(bucket=BUCKET, region="us-east-1", client=s3)
+    failed_before = storage.metrics.uploads_total.value(content_type="image/png", outcome="error")
+    result = up.upload(b"png", "image/png", ".png")
+    assert result["url"] is None and result["attempts"] == 3
+    assert "SlowDown" in result["error"]
+    # No sleep after the final attempt
+    assert len(sleeps) == 2
+    assert storage.metrics.uploads_total.value(content_type="image/png", outcome="error") == failed_before + 1
+
+
+def test_upload_many_keeps_order_and_isolates_failures(s3, sleeps, monkeypatch):
+    monkeypatch.setattr(storage, "S3_UPLOAD_ATTEMPTS", 1)
+    up = storage.S3Uploader(bucket=BUCKET, region="us-east-1", client=s3)
+    items = [(f"snip {i}".encode(), "image/png", ".png") for i in range(5)] + [(b"%PDF", "application/pdf", ".pdf")]
+    results = asyncio.run(up.upload_many(items))
+    assert [r["bytes"] for r in results] == [len(body) for body, _, _ in items]
+    for (body, content_type, ext), r in zip(items, results):
+        assert r["key"].endswith(ext)
+        obj = s3.get_object(Bucket=BUCKET, Key=r["key"])
+        assert obj["Body"].read() == body and obj["ContentType"] == content_type
+
+    _fail(s3, "PutObject", 1)
+    results = asyncio.run(up.upload_many(items[:3]))
+    # One failed upload doesn't fail the others
+    assert sum(r["url"] is None for r in results) == 1
+    assert sum(r["url"] is not None for r in results) == 2
@@ -0,0 +1,97 @@
+import random
+import fitz
+import pandas as pd
+import pytest
+from bench.synth import HEADERS, ledger_rows, make_ledger_pdf
+from app.parser import tables
+from app.parser.document import DocumentContext
+
+
+def _df(rows):
+    return pd.DataFrame([HEADERS] + rows)
+
+
+@pytest.fixture(scope="module")
+def lattice_100():
+    # Cover page, then 49 + 49 + 2 ledger rows on pages 1-3
+    return make_ledger_pdf(pages=6, years=100, style="lattice")
+
+
+def _ctx(data):
+    return DocumentContext(fitz.open(stream=data), data=data)
+
+
+def test_fragment_cannot_exit_early_or_outrank_a_full_page(monkeypatch):
+    monkeypatch.setattr(tables, "TABLE_EARLY_EXIT_SCORE", 0.6)
+    rows = ledger_rows(60, random.Random(0))
+    full = tables.score_table(_df(rows[:49]), 1, (0, 0, 1, 1), "pymupdf", "lines")
+    tail = tables.score_table(_df(rows[58:]), 2, (0, 0, 1, 1), "pymupdf", "lines")
+    # Two monotone rows look like a perfect ledger to shape_score
+    assert tail["metrics"]["shape_fit"] == 1.0
+    assert tail["score"] >= tables.TABLE_EARLY_EXIT_SCORE
+    assert not tables._clears_early_exit([tail])
+    assert tables._clears_early_exit([full])
+    tail["score"] = full["score"] + 0.1
+    ranked = sorted([tail, full], key=tables.rank_key, reverse=True)
+    assert ranked[0] is full
+
+
+def _visited(monkeypatch):
+    pages = []
+    extractor = tables.EXTRACTORS["pymupdf"]
+    extract = extractor.extract
+
+    def spy(ctx, page_index, roi):
+        pages.append(page_index)
+        return extract(ctx, page_index, roi)
+    monkeypatch.setattr(extractor, "extract", spy)
+    return pages
+
+
+def test_early_exit_skips_past_a_fragment_but_stops_on_a_full_page(lattice_100, monkeypatch):
+    monkeypatch.setattr(tables, "TABLE_EARLY_EXIT_SCORE", 0.6)
+    pages = _visited(monkeypatch)
+    ctx = _ctx(lattice_100)
+    target = lambda i: (i, tuple(ctx.page(i).rect), tables.CAMELOT_FLAVORS, None)
+
+    per_page = tables._in_process_tier("pymupdf", ctx, [target(3), target(1), target(2)])
+    # Page 3 holds the 2-row tail: not enough to stop, page 1 is
+    assert pages == [3, 1]
+    assert len(per_page) == 2
+
+    pages.clear()
+    tables._in_process_tier("pymupdf", ctx, [target(1), target(3)])
+    assert pages == [1]
+
+
+def test_discovery_ranks_the_full_page_first(lattice_100, monkeypatch):
+    monkeypatch.setattr(tables, "TABLE_EXTRACTORS", ["pymupdf"])
+    found = tables.find_roi_and_tables(_ctx(lattice_100))
+    best = found[0]
+    assert best["page"] in (1, 2)
+    assert len(best["df"]) - 1 == 49
+
+
+def test_only_pages_the_fast_tier_missed_fall_through_to_camelot(lattice_100, monkeypatch):
+    monkeypatch.setattr(tables, "TABLE_EXTRACTORS", ["pymupdf", "camelot"])
+    monkeypatch.setattr(tables, "TABLE_EARLY_EXIT_SCORE", 0)
+    ctx = _ctx(lattice_100)
+    target = lambda i: (i, tuple(ctx.page(i).rect), tables.CAMELOT_FLAVORS, None)
+    rows = ledger_rows(49, random.Random(1))
+    sent = []
+
+    def camelot(ctx, targets):
+        sent.extend(t[0] for t in targets)
+        return [[tables.score_table(_df(rows), t[0], t[1], "camelot", "lattice")] for t in targets]
+    monkeypatch.setattr(tables, "_camelot_tier", camelot)
+
+    # The cover page has nothing PyMuPDF scores well, page 1 a full table
+    found = tables._run_tiers(ctx, [target(0), target(1)])
+    assert sent == [0]
+    assert {t["extractor"] for t in found if t["page"] == 1} == {"pymupdf"}
+    # Both tiers' tables for the cover page are kept and ranked together
+    assert max((t for t in found if t["page"] == 0), key=tables.rank_key)["extractor"] == "camelot"
+
+    sent.clear()
+    tables._run_tiers(ctx, [target(1), target(2)])
+    assert sent == []